@@ -95,6 +95,10 @@ const ProductManagement = () => {
     setPreviewImage(product.image);
     setIsEditing(true);
     setIsCreating(false);
+    // The catalog listing is a compact payload: load the description from the detail endpoint
+    api.get(`/products/${product.id}/`)
+      .then((res) => setFormData((prev) => ({ ...prev, description: res.data?.description || '' })))
+      .catch((err) => console.warn('Failed to load product details', err));
   };
 
   const handleCreateProduct = () => {
@@ -6,7 +6,7 @@ import { useDispatch } from 'react-redux';
 import { fetchUserOrders } from '../../features/orders/ordersSlice';
 import orderService from '../../services/orderService';
 
-const OrderHistory = ({ orders, status, error }) => {
+const OrderHistory = ({ orders, status, error, next, loadingMore, onLoadMore }) => {
   const { t } = useTranslation();
   if (status === 'loading') {
     return (
@@ -135,7 +135,7 @@ const OrderHistory = ({ orders, status, error }) => {
                           <li key={idx} className="flex items-center justify-between px-3 py-2 bg-white/60">
                             <div className="flex items-center gap-3">
                               <div className="w-10 h-10 rounded-md overflow-hidden bg-slate-100 border border-slate-200">
-                                <img src={it.product?.image || '/placeholder.svg'} alt={it.product_name || it.product?.name || 'Item'} className="w-full h-full object-cover" />
+                                <img src={it.product_image || it.product?.image || '/placeholder.svg'} alt={it.product_name || it.product?.name || 'Item'} className="w-full h-full object-cover" />
                               </div>
                               <div>
                                 <p className="text-sm font-medium text-slate-800">{it.product_name || it.product?.name}</p>
@@ -192,6 +192,17 @@ const OrderHistory = ({ orders, status, error }) => {
           );
         })}
       </ul>
+      {next && onLoadMore && (
+        <div className="px-5 py-4 text-center border-t border-slate-200/60">
+          <button
+            onClick={onLoadMore}
+            disabled={loadingMore}
+            className="px-5 py-2.5 rounded-lg text-sm font-medium bg-emerald-600 text-white shadow hover:bg-emerald-700 transition disabled:opacity-60"
+          >
+            {loadingMore ? t('orders.loadingMore', 'Loading…') : t('orders.loadMore', 'Load older orders')}
+          </button>
+        </div>
+      )}
     </div>
   );
 };
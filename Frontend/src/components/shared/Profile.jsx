@@ -3,7 +3,7 @@ import { useTranslation } from 'react-i18next';
 import { useSelector, useDispatch } from 'react-redux';
 import { useLocation } from 'react-router-dom';
 import { getUserProfile, updateUserProfile } from '../../features/auth/authSlice';
-import { fetchUserOrders } from '../../features/orders/ordersSlice';
+import { fetchUserOrders, fetchMoreUserOrders } from '../../features/orders/ordersSlice';
 import Loader from './Loader';
 import ErrorMessage from './ErrorMessage';
 import OrderHistory from '../orders/OrderHistory';
@@ -15,7 +15,7 @@ const Profile = () => {
   const { t } = useTranslation();
   const dispatch = useDispatch();
   const { user, status: authStatus, error: authError } = useSelector((state) => state.auth);
-  const { orders, status: ordersStatus, error: ordersError } = useSelector((state) => state.orders);
+  const { orders, ordersNext, loadingMore: ordersLoadingMore, status: ordersStatus, error: ordersError } = useSelector((state) => state.orders);
   
   const [activeTab, setActiveTab] = useState('profile');
   const [isEditing, setIsEditing] = useState(false);
@@ -581,7 +581,14 @@ const Profile = () => {
                   Order History
                 </h2>
                 
-                <OrderHistory orders={orders} status={ordersStatus} error={ordersError} />
+                <OrderHistory
+                  orders={orders}
+                  status={ordersStatus}
+                  error={ordersError}
+                  next={ordersNext}
+                  loadingMore={ordersLoadingMore}
+                  onLoadMore={() => dispatch(fetchMoreUserOrders(ordersNext))}
+                />
               </div>
             )}
 
@@ -4,6 +4,8 @@ import orderService from '../../services/orderService';
 
 const initialState = {
   orders: [],
+  ordersNext: null, // cursor link of the next (older) page of orders
+  loadingMore: false,
   currentOrder: null,
   shopOwnerOrders: [],
   shopOwnerRegularOrders: [],
@@ -17,8 +19,7 @@ export const fetchUserOrders = createAsyncThunk(
   'orders/fetchUserOrders',
   async (_, thunkAPI) => {
     try {
-  const orders = await orderService.getOrders();
-  return orders;
+  return await orderService.getOrders(); // { orders, next }
     } catch (error) {
       const message = 
         error.response?.data?.message ||
@@ -31,6 +32,23 @@ export const fetchUserOrders = createAsyncThunk(
   }
 );
 
+// Load the next (older) page of user orders
+export const fetchMoreUserOrders = createAsyncThunk(
+  'orders/fetchMoreUserOrders',
+  async (next, thunkAPI) => {
+    try {
+      return await orderService.getMoreOrders(next);
+    } catch (error) {
+      const message =
+        error.response?.data?.message ||
+        error.response?.data?.detail ||
+        error.message ||
+        'Failed to load more orders';
+      return thunkAPI.rejectWithValue(message);
+    }
+  }
+);
+
 // Shop owner: fetch orders tied to owned shops
 export const fetchShopOwnerOrders = createAsyncThunk(
   'orders/fetchShopOwnerOrders',
@@ -138,12 +156,27 @@ const ordersSlice = createSlice({
       })
       .addCase(fetchUserOrders.fulfilled, (state, action) => {
         state.status = 'succeeded';
-  state.orders = action.payload; // already array
+        state.orders = action.payload.orders;
+        state.ordersNext = action.payload.next;
       })
       .addCase(fetchUserOrders.rejected, (state, action) => {
         state.status = 'failed';
         state.error = action.payload;
       })
+
+      // Load more user orders
+      .addCase(fetchMoreUserOrders.pending, (state) => {
+        state.loadingMore = true;
+      })
+      .addCase(fetchMoreUserOrders.fulfilled, (state, action) => {
+        state.loadingMore = false;
+        state.orders = [...state.orders, ...action.payload.orders];
+        state.ordersNext = action.payload.next;
+      })
+      .addCase(fetchMoreUserOrders.rejected, (state, action) => {
+        state.loadingMore = false;
+        state.error = action.payload;
+      })
       
       // Fetch order by ID
       .addCase(fetchOrderById.pending, (state) => {
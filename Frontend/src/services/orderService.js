@@ -1,11 +1,21 @@
 import api from './api';
 
+// GET /orders/ returns one page (20 orders) and a `next` cursor link: older pages load on demand
+const fetchOrdersPage = async (params = {}) => {
+  const response = await api.get('/orders/', { params });
+  return { orders: response.data.orders || [], next: response.data.next || null };
+};
+
 // Order services
 export const orderService = {
-  // Get all orders for the current user
-  getOrders: async () => {
-    const response = await api.get('/orders/');
-  return response.data.orders || [];
+  // Get the latest orders of the current user: { orders, next }
+  getOrders: async (params = {}) => fetchOrdersPage(params),
+
+  // Get the page after `next` (full link returned by the previous page)
+  getMoreOrders: async (next) => {
+    if (!next) return { orders: [], next: null };
+    const u = new URL(next, window.location.origin);
+    return fetchOrdersPage(Object.fromEntries(u.searchParams));
   },
 
   // Get a single order by ID
@@ -57,10 +67,7 @@ export const orderService = {
   },
 
   // Get order history with filtering options
-  getOrderHistory: async (params = {}) => {
-    const response = await api.get('/orders/', { params });
-  return response.data.orders || [];
-  },
+  getOrderHistory: async (params = {}) => fetchOrdersPage(params),
 
   // Shop owner / admin decision on credit order
   decideCredit: async ({ orderId, action, note }) => {
@@ -133,13 +133,13 @@ export const productService = {
   // Search products
   searchProducts: async (query) => {
     try {
-      const response = await api.get('/products/', {
-        params: { search: query },
+      const response = await api.get('/products/search/', {
+        params: { q: query },
       });
-      return response.data;
+      return response.data?.results || [];
     } catch (error) {
       console.error('Error searching products:', error);
-      return { products: [] };
+      return [];
     }
   },
 
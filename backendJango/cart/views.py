@@ -7,6 +7,15 @@ from django.shortcuts import get_object_or_404
 from .models import Cart, CartItem
 from .serializers import CartSerializer, CartItemSerializer
 from products.models import Product
+from django.db.models import Prefetch, prefetch_related_objects
+
+
+def with_items(cart):
+    """Load cart lines with their product/shop/category in two queries before serializing."""
+    prefetch_related_objects([cart], Prefetch(
+        'items', queryset=CartItem.objects.select_related('product__shop', 'product__category'),
+    ))
+    return cart
 
 class CartView(APIView):
     permission_classes = [IsAuthenticated]
@@ -14,7 +23,7 @@ class CartView(APIView):
     def get(self, request):
         """Get user's cart"""
         cart, created = Cart.objects.get_or_create(user=request.user)
-        serializer = CartSerializer(cart)
+        serializer = CartSerializer(with_items(cart))
         return Response(serializer.data)
 
     def post(self, request):
@@ -47,7 +56,7 @@ class CartView(APIView):
                 cart_item.quantity = product.stock
             cart_item.save()
 
-        serializer = CartSerializer(cart)
+        serializer = CartSerializer(with_items(cart))
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 class CartItemView(APIView):
@@ -66,7 +75,7 @@ class CartItemView(APIView):
             cart_item.quantity = quantity
             cart_item.save()
 
-        serializer = CartSerializer(cart_item.cart)
+        serializer = CartSerializer(with_items(cart_item.cart))
         return Response(serializer.data)
 
     def delete(self, request, item_id):
@@ -74,7 +83,7 @@ class CartItemView(APIView):
         cart_item = get_object_or_404(CartItem, id=item_id, cart__user=request.user)
         cart_item.delete()
         
-        serializer = CartSerializer(cart_item.cart)
+        serializer = CartSerializer(with_items(cart_item.cart))
         return Response(serializer.data)
 
 class CartClearView(APIView):
@@ -85,7 +94,7 @@ class CartClearView(APIView):
         try:
             cart = Cart.objects.get(user=request.user)
             cart.items.all().delete()
-            serializer = CartSerializer(cart)
+            serializer = CartSerializer(with_items(cart))
             return Response(serializer.data)
         except Cart.DoesNotExist:
             return Response({'message': 'Cart is already empty'})
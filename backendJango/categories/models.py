@@ -10,6 +10,7 @@ class Category(models.Model):
     description = models.TextField(blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
     image = models.URLField(blank=True, null=True)  # URL Cloudinary
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
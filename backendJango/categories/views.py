@@ -1,11 +1,32 @@
+from django.utils.cache import patch_cache_control
 from rest_framework import viewsets, permissions
 from .models import Category
 from .serializers import CategorySerializer
+from shopnow.conditional import ConditionalGetMixin, aggregate_version
+from shopnow.response_cache import ResponseCacheMixin
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(ResponseCacheMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
+    cache_namespace = 'categories'
+
+    def get_initial_cache_tags(self):
+        if self.action == 'retrieve':
+            return [f"category:{self.kwargs.get('pk')}"]
+        return ['categories']
+
+    def get_cache_tags(self, data):
+        return ['categories']
+
+    def get_resource_version(self):
+        qs = Category.objects.all()
+        if self.action == 'retrieve':
+            try:
+                qs = qs.filter(pk=int(self.kwargs['pk']))
+            except (KeyError, ValueError):
+                return None
+        return aggregate_version(qs)
 
     def get_permissions(self):
         # Everyone can list / retrieve categories
@@ -24,3 +45,10 @@ class CategoryViewSet(viewsets.ModelViewSet):
             from rest_framework.exceptions import PermissionDenied
             raise PermissionDenied('Seuls les administrateurs ou shop owners peuvent créer une catégorie.')
         serializer.save()
+
+    def list(self, request, *args, **kwargs):
+        # Categories change rarely and are no longer bundled in the paginated product listing:
+        # let browsers / CDN keep them for a few minutes.
+        response = super().list(request, *args, **kwargs)
+        patch_cache_control(response, public=True, max_age=300)
+        return response
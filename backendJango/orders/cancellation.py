@@ -0,0 +1,126 @@
+"""Stock release of cancelled orders, and expiry of abandoned pending orders.
+
+:func:`restock` gives the units of cancelled orders back with one grouped
+SELECT of their items and one UPDATE of their products (sharded products
+get theirs back on a shard, products.stock_shards), whatever cancelled
+them: the customer, an admin, a rejected credit request or the sweeper.
+Units go back once per order: the cancelling UPDATE is compare-and-set on the
+status (shopnow.tracking, or row locks in bulk transitions), so only the
+writer that really moved the order out of ``RESTOCKABLE_STATUSES`` restocks,
+and a cancelled order can never be reopened (``OrderReopenError``).
+
+:func:`expire_pending` is the sweeper (``manage.py expire_pending_orders``):
+orders still ``pending`` ``PENDING_ORDER_EXPIRY_MINUTES`` after creation with
+an online payment method and no payment reference were abandoned at the
+payment step. They are walked on the ``(status, created_at)`` index in
+chunks of ``batch_size`` and cancelled through
+:func:`orders.transitions.bulk_transition`, so one chunk costs the same few
+statements whatever its size. Cash on delivery and credit orders wait for
+delivery or a credit decision and are never expired.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, Sum, Value, When
+from django.utils import timezone
+
+from products import stock_shards
+from products.models import Product
+from shopnow import response_cache
+from . import transitions
+from .models import Order, OrderItem
+
+# Cancelling an order in these states gives its stock back (later ones have left the shop)
+RESTOCKABLE_STATUSES = ('pending', 'paid', 'processing')
+DEFAULT_EXPIRY_MINUTES = 60
+DEFAULT_EXPIRY_PAYMENT_METHODS = ('stripe', 'card', 'd17')
+DEFAULT_SWEEP_BATCH_SIZE = 500
+
+
+def restock(order_ids):
+    """Give the stock of ``order_ids`` back; returns ``{product_id: quantity}``.
+
+    Must run inside the transaction that cancels the orders.
+    """
+    demand = dict(
+        OrderItem.objects.filter(order_id__in=list(order_ids)).order_by()
+        .values('product_id').annotate(quantity=Sum('quantity')).values_list('product_id', 'quantity')
+    )
+    if not demand:
+        return {}
+    products = {
+        pk: (shard_count, shop_id) for pk, shard_count, shop_id in
+        Product.objects.filter(pk__in=list(demand)).values_list('pk', 'stock_shard_count', 'shop_id')
+    }
+    given = Case(
+        *[When(pk=product_id, then=Value(quantity)) for product_id, quantity in demand.items()
+          if not products.get(product_id, (0, None))[0]],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    # status is assigned before stock: MySQL evaluates SET left to right, so a
+    # product only comes back when it was sold out, not switched off by its shop
+    Product.objects.filter(pk__in=sorted(products)).update(
+        status=Case(When(status='unavailable', stock=0, then=Value('available')), default=F('status')),
+        stock=F('stock') + given,
+        updated_at=timezone.now(),
+    )
+    for product_id in sorted(products):
+        if products[product_id][0]:
+            stock_shards.give_back(product_id, products[product_id][0], demand[product_id])
+    response_cache.invalidate_products(list(products), {shop_id for _, shop_id in products.values() if shop_id})
+    return demand
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def expirable(now=None, max_age=None):
+    """Abandoned top-level pending orders, oldest first."""
+    now = now or timezone.now()
+    if max_age is None:
+        max_age = timedelta(minutes=_setting('PENDING_ORDER_EXPIRY_MINUTES', DEFAULT_EXPIRY_MINUTES))
+    methods = _setting('PENDING_ORDER_EXPIRY_PAYMENT_METHODS', DEFAULT_EXPIRY_PAYMENT_METHODS)
+    return (
+        Order.objects.filter(status='pending', created_at__lt=now - max_age, parent__isnull=True)
+        .filter(payment_method__in=list(methods), payment_intent_id='')
+        .order_by('created_at', 'pk')
+    )
+
+
+def _expire_chunk(candidates, batch_size, after):
+    """Cancel the next chunk after ``after``; returns (cancelled count, last position or None)."""
+    with transaction.atomic():
+        chunk = candidates.select_for_update()
+        if after is not None:
+            chunk = chunk.filter(Q(created_at__gt=after[0]) | Q(created_at=after[0], pk__gt=after[1]))
+        rows = list(chunk.values_list('pk', 'created_at', 'has_sub_orders')[:batch_size])
+        if not rows:
+            return 0, None
+        ids = [pk for pk, _, _ in rows]
+        parents = [pk for pk, _, has_sub_orders in rows if has_sub_orders]
+        if parents:
+            subs = list(
+                Order.objects.select_for_update().filter(parent_id__in=parents).order_by('pk')
+                .values_list('pk', 'parent_id', 'status')
+            )
+            # A multi-shop order expires only while none of its shops has moved on;
+            # its sub-orders are cancelled and the parent follows them
+            moved = {parent_id for _, parent_id, status in subs if status not in ('pending', 'cancelled')}
+            ids = [pk for pk in ids if pk not in parents]
+            ids += [pk for pk, parent_id, status in subs if parent_id not in moved and status == 'pending']
+        cancelled, _ = transitions.bulk_transition(ids, 'cancelled') if ids else ([], {})
+    return len(cancelled), (rows[-1][1], rows[-1][0])
+
+
+def expire_pending(batch_size=DEFAULT_SWEEP_BATCH_SIZE, max_age=None, now=None):
+    """Cancel abandoned pending orders (and restock them) in chunks; returns how many were cancelled."""
+    candidates = expirable(now, max_age)
+    cancelled, after = 0, None
+    while True:
+        count, after = _expire_chunk(candidates, batch_size, after)
+        if after is None:
+            return cancelled
+        cancelled += count
@@ -110,10 +110,12 @@ class MyCreditsView(APIView):
     def get(self, request):
         upcoming = request.query_params.get('upcoming') == 'true'
         
+        # Credit of a multi-shop order is held by its per-shop sub-orders
         qs = Order.objects.filter(
             user=request.user,
-            payment_method='credit'
-        ).prefetch_related('items__product', 'shop')
+            payment_method='credit',
+            has_sub_orders=False,
+        ).select_related('shop__owner').prefetch_related('items')
         
         if upcoming:
             # Crédits à payer dans les 7 jours
@@ -144,7 +146,8 @@ class MyCreditsView(APIView):
                 'items': [
                     {
                         'product_id': it.product_id,
-                        'product_name': it.product.name,
+                        'product_name': it.product_name,
+                        'product_image': it.product_image,
                         'quantity': it.quantity,
                         'price': str(it.price),
                         'subtotal': str(it.subtotal),
@@ -0,0 +1,138 @@
+"""Streaming order export (CSV or JSONL) for accounting.
+
+Orders are read in keyset chunks over the primary key (``WHERE id > last
+ORDER BY id LIMIT n``), each chunk with its items, products, customers and
+shops prefetched, and written to the response as they are produced. Memory
+use depends on the chunk size, not on the number of orders exported. Keyset
+chunks are used instead of ``QuerySet.iterator()``: the MySQL driver buffers
+a whole result set client side, whereas each chunk here is its own query.
+
+CSV has one line per order item (order columns repeated). JSONL has one
+order per line, with its items nested. CSV cells starting like a spreadsheet
+formula are prefixed with a quote, so names and addresses typed by customers
+or shop owners open as text.
+"""
+import csv
+import json
+from datetime import datetime, timedelta
+
+from django.db.models import Prefetch
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import Order, OrderItem
+
+DEFAULT_CHUNK_SIZE = 500
+FORMATS = ('csv', 'jsonl')
+CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8', 'jsonl': 'application/x-ndjson'}
+ORDER_COLUMNS = [
+    'order_id', 'created_at', 'status', 'payment_method', 'credit_status', 'total_price',
+    'shop_id', 'shop_name', 'customer_id', 'customer_name', 'customer_email', 'shipping_address',
+    'parent_order_id',
+]
+ITEM_COLUMNS = ['product_id', 'product_name', 'quantity', 'price', 'subtotal']
+# Spreadsheets evaluate cells starting with these as formulas (CSV injection)
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def filter_orders(queryset, params):
+    """Apply ``?status=a,b`` and ``?date_from`` / ``?date_to`` (YYYY-MM-DD, inclusive).
+
+    Dates become plain ``created_at`` bounds so indexes on created_at serve
+    the range. Raises ValueError with a message for the client.
+    """
+    statuses = [s for s in params.get('status', '').split(',') if s and s != 'all']
+    if statuses:
+        queryset = queryset.filter(status__in=statuses)
+    for param, lookup, shift in (('date_from', 'created_at__gte', 0), ('date_to', 'created_at__lt', 1)):
+        value = params.get(param)
+        if value:
+            day = parse_date(value)
+            if day is None:
+                raise ValueError(f'{param} must be YYYY-MM-DD')
+            start = datetime.combine(day + timedelta(days=shift), datetime.min.time())
+            queryset = queryset.filter(**{lookup: timezone.make_aware(start)})
+    return queryset
+
+
+def iter_orders(queryset, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield orders by increasing id, one chunk (plus its prefetches) in memory at a time."""
+    # Multi-shop parents carry no items: their sub-orders are exported instead
+    queryset = queryset.filter(has_sub_orders=False).select_related('user', 'shop').prefetch_related(
+        Prefetch('items', queryset=OrderItem.objects.order_by('id')),
+    ).order_by('id')
+    last_id = 0
+    while True:
+        chunk = list(queryset.filter(id__gt=last_id)[:chunk_size])
+        yield from chunk
+        if len(chunk) < chunk_size:
+            return
+        last_id = chunk[-1].id
+
+
+def order_row(order):
+    user = order.user
+    return {
+        'order_id': order.id,
+        'created_at': order.created_at.isoformat(),
+        'status': order.status,
+        'payment_method': order.payment_method,
+        'credit_status': order.credit_status,
+        'total_price': str(order.total_price),
+        'shop_id': order.shop_id,
+        'shop_name': order.shop.name if order.shop else None,
+        'customer_id': user.id,
+        'customer_name': user.get_full_name() or user.username,
+        'customer_email': user.email,
+        'shipping_address': order.shipping_address,
+        'parent_order_id': order.parent_id,
+    }
+
+
+def item_row(item):
+    return {
+        'product_id': item.product_id,
+        'product_name': item.product_name,
+        'quantity': item.quantity,
+        'price': str(item.price),
+        'subtotal': str(item.subtotal),
+    }
+
+
+class _Echo:
+    """File-like object whose write() returns the line, for csv.writer."""
+    def write(self, value):
+        return value
+
+
+def csv_safe(row):
+    """``row`` with text cells that a spreadsheet would run as a formula prefixed with ``'``."""
+    return {
+        key: f"'{value}" if isinstance(value, str) and value.startswith(FORMULA_PREFIXES) else value
+        for key, value in row.items()
+    }
+
+
+def stream_csv(orders):
+    writer = csv.DictWriter(_Echo(), fieldnames=ORDER_COLUMNS + ITEM_COLUMNS)
+    yield writer.writeheader()
+    for order in orders:
+        row = order_row(order)
+        items = order.items.all()
+        if not items:
+            yield writer.writerow(csv_safe(row))
+        for item in items:
+            yield writer.writerow(csv_safe({**row, **item_row(item)}))
+
+
+def stream_jsonl(orders):
+    for order in orders:
+        row = order_row(order)
+        row['items'] = [item_row(item) for item in order.items.all()]
+        yield json.dumps(row, ensure_ascii=False) + '\n'
+
+
+def stream(queryset, fmt, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Lines (str) of the export of ``queryset`` in ``fmt``."""
+    orders = iter_orders(queryset, chunk_size=chunk_size)
+    return stream_csv(orders) if fmt == 'csv' else stream_jsonl(orders)
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from orders.models import OrderItem
+
+
+class Command(BaseCommand):
+    help = 'Copy product name, image and shop onto order items saved before they were snapshotted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Order items updated per statement')
+
+    def handle(self, *args, **options):
+        updated = OrderItem.backfill_snapshots(batch_size=max(1, options['batch_size']))
+        self.stdout.write(self.style.SUCCESS(f'Snapshotted {updated} order items'))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from orders import rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily order statistics (OrderDailyStat) from the orders table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Only rebuild days from this date on (YYYY-MM-DD)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rollup rows inserted per statement')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            since = parse_date(options['since'])
+            if since is None:
+                raise CommandError('--since must be YYYY-MM-DD')
+        rows = rollups.backfill(since=since, batch_size=max(1, options['batch_size']))
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rows} daily order statistics rows'))
@@ -0,0 +1,27 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from orders import cancellation
+
+
+class Command(BaseCommand):
+    help = 'Cancel abandoned pending orders and give their stock back (run from cron, or with --loop)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=cancellation.DEFAULT_SWEEP_BATCH_SIZE, help='Orders cancelled per transaction')
+        parser.add_argument('--max-age-minutes', type=int, help='Override PENDING_ORDER_EXPIRY_MINUTES')
+        parser.add_argument('--loop', action='store_true', help='Keep sweeping every --interval seconds')
+        parser.add_argument('--interval', type=int, default=300, help='Seconds between sweeps with --loop')
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+        max_age = None
+        if options['max_age_minutes'] is not None:
+            max_age = timedelta(minutes=max(0, options['max_age_minutes']))
+        while True:
+            cancelled = cancellation.expire_pending(batch_size=batch_size, max_age=max_age)
+            self.stdout.write(f'Cancelled {cancelled} expired pending orders')
+            if not options['loop']:
+                return
+            time.sleep(max(1, options['interval']))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from shopnow import idempotency
+
+
+class Command(BaseCommand):
+    help = 'Delete stored Idempotency-Key responses past their TTL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows deleted per statement')
+
+    def handle(self, *args, **options):
+        deleted = idempotency.purge_expired(batch_size=max(1, options['batch_size']))
+        self.stdout.write(self.style.SUCCESS(f'Purged {deleted} expired idempotency records'))
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+from orders import reservations
+
+
+class Command(BaseCommand):
+    help = 'Delete expired checkout stock reservations in batches (run from cron, or with --loop)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=reservations.DEFAULT_SWEEP_BATCH_SIZE, help='Rows deleted per statement')
+        parser.add_argument('--loop', action='store_true', help='Keep sweeping every --interval seconds')
+        parser.add_argument('--interval', type=int, default=60, help='Seconds between sweeps with --loop')
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+        while True:
+            deleted = reservations.sweep(batch_size=batch_size)
+            self.stdout.write(f'Released {deleted} expired reservations')
+            if not options['loop']:
+                return
+            time.sleep(max(1, options['interval']))
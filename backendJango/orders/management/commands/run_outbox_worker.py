@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+from shopnow import outbox
+
+PURGE_EVERY_SECONDS = 3600
+
+
+class Command(BaseCommand):
+    help = 'Dispatch transactional outbox events to their handlers (several workers may run side by side)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Events claimed per batch')
+        parser.add_argument('--once', action='store_true', help='Process one batch and exit (cron)')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds to sleep when no event is due')
+        parser.add_argument('--keep-days', type=int, default=7, help='Delete done events older than this (0: keep them)')
+
+    def handle(self, *args, **options):
+        outbox.autodiscover()
+        batch_size = max(1, options['batch_size'])
+        worker = outbox.worker_id()
+        next_purge = 0
+        while True:
+            if options['keep_days'] and time.monotonic() >= next_purge:
+                outbox.purge_done(options['keep_days'] * 86400)
+                next_purge = time.monotonic() + PURGE_EVERY_SECONDS
+            succeeded, failed = outbox.run_once(batch_size=batch_size, worker=worker)
+            if succeeded or failed:
+                self.stdout.write(f'Dispatched {succeeded} events, {failed} failed')
+            if options['once']:
+                return
+            if succeeded + failed < batch_size:
+                time.sleep(max(0.1, options['interval']))
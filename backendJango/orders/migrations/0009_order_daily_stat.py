@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0008_order_user_created_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderDailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('shop_id', models.BigIntegerField(default=0)),
+                ('status', models.CharField(max_length=20)),
+                ('payment_method', models.CharField(blank=True, max_length=50)),
+                ('order_count', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['shop_id', 'day'], name='order_daily_stat_shop_idx')],
+                'constraints': [models.UniqueConstraint(fields=('day', 'shop_id', 'status', 'payment_method'), name='order_daily_stat_key')],
+            },
+        ),
+    ]
@@ -1,7 +1,9 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import OuterRef, Subquery
 from django.contrib.auth.models import User
 from django.conf import settings
 from decimal import Decimal
+from shopnow.tracking import DirtyFieldsMixin
 
 class DeliveryZone(models.Model):
     """
@@ -18,7 +20,7 @@ class DeliveryZone(models.Model):
     def __str__(self):
         return f"{self.name} - {self.base_price}TND base"
 
-class Delivery(models.Model):
+class Delivery(DirtyFieldsMixin, models.Model):
     """
     Informations de livraison pour chaque commande
     """
@@ -69,6 +71,10 @@ class Delivery(models.Model):
     class Meta:
         verbose_name_plural = "Deliveries"
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['order_id'], name='delivery_order_idx'),
+            models.Index(fields=['status', 'created_at'], name='delivery_status_created_idx'),
+        ]
 
     def __str__(self):
         return f"Delivery #{self.tracking_number} - {self.get_status_display()}"
@@ -95,7 +101,14 @@ class Delivery(models.Model):
         return self.delivery_fee
 
 
-class Order(models.Model):
+class OrderReopenError(ValueError):
+    """A cancelled order cannot move to another status (its stock was given back)."""
+
+
+class Order(DirtyFieldsMixin, models.Model):
+    # Status history, outbox events and daily statistics (orders.rollups.KEY_FIELDS) derive from these
+    guarded_fields = ('status', 'payment_method', 'shop_id', 'total_price', 'created_at')
+
     STATUS_CHOICES = [
         ('pending', 'Pending'),
         ('paid', 'Paid'),
@@ -126,6 +139,9 @@ class Order(models.Model):
     shop = models.ForeignKey('shops.Shop', null=True, blank=True, on_delete=models.SET_NULL, related_name='orders')
     # Date prévue pour le paiement en différé (pour les commandes à crédit)
     payment_due_date = models.DateField(null=True, blank=True)
+    # Panier multi-shop: une commande parente (sans articles) et une sous-commande par shop
+    parent = models.ForeignKey('self', null=True, blank=True, on_delete=models.CASCADE, related_name='sub_orders')
+    has_sub_orders = models.BooleanField(default=False)
 
     shipping_address = models.TextField(blank=True)
     phone_number = models.CharField(max_length=30, blank=True)
@@ -135,35 +151,58 @@ class Order(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Customer order history: filter on user, seek / range on created_at
+            models.Index(fields=['user', 'created_at', 'id'], name='order_user_created_idx'),
+            # Customer credits (MyCreditsView): credit orders of a user due in a date range
+            models.Index(fields=['user', 'payment_method', 'credit_status', 'payment_due_date'], name='order_user_credit_due_idx'),
+            # Shop owner listings (ShopOwnerOrdersView): shop + credit filter, newest first
+            models.Index(fields=['shop', 'credit_status', 'created_at'], name='order_shop_credit_idx'),
+            # Shop credit stats (CreditStatsView, CreditsByUserView)
+            models.Index(fields=['shop', 'payment_method', 'credit_status'], name='order_shop_payment_idx'),
+            # Admin listing (AdminOrdersView): optional status filter, newest first
+            models.Index(fields=['status', 'created_at'], name='order_status_created_idx'),
+            models.Index(fields=['created_at'], name='order_created_idx'),
+        ]
 
     def __str__(self):
         return f"Order #{self.id} ({self.user})"
 
     def recalc_total(self):
-        total = sum(item.subtotal for item in self.items.all())
+        lines = self.sub_orders.all() if self.has_sub_orders else self.items.all()
+        total = sum(line.total_price if self.has_sub_orders else line.subtotal for line in lines)
         self.total_price = total
         self.save(update_fields=['total_price'])
         return total
 
+    def line_items(self):
+        """Items of the order, or of its sub-orders (prefetch ``items`` and ``sub_orders__items``)."""
+        items = list(self.items.all())
+        if self.has_sub_orders:
+            items += [item for sub in self.sub_orders.all() for item in sub.items.all()]
+        return items
+
+    def check_changes(self, changes):
+        old_status, new_status = changes.get('status', (None, None))
+        if old_status == 'cancelled':
+            raise OrderReopenError(f'Commande #{self.pk} annulée: elle ne peut pas passer en {new_status}')
+
     def save(self, *args, **kwargs):
-        # Track status change for history
-        status_changed = False
-        old_status = None
-        if self.pk:
-            try:
-                old = Order.objects.get(pk=self.pk)
-                if old.status != self.status:
-                    status_changed = True
-                    old_status = old.status
-            except Order.DoesNotExist:
-                pass
-        super().save(*args, **kwargs)
-        if status_changed:
-            OrderStatusHistory.objects.create(
-                order=self,
-                from_status=old_status,
-                to_status=self.status,
-            )
+        # Refused before the block below: an error raised inside it breaks the caller's transaction
+        self.check_changes(self.pending_changes(kwargs.get('update_fields')))
+        # The daily statistics (orders.rollups, post_save) are written in the same transaction
+        with transaction.atomic(savepoint=False):
+            # A stale instance is compared with the locked row: it cannot log a change twice
+            self.compare_and_set(kwargs.get('update_fields'))
+            super().save(*args, **kwargs)
+            # Track status change for history (compared with the loaded values)
+            if 'status' in self.saved_changes:
+                old_status, new_status = self.saved_changes['status']
+                OrderStatusHistory.objects.create(
+                    order=self,
+                    from_status=old_status,
+                    to_status=new_status,
+                )
 
 
 class OrderItem(models.Model):
@@ -173,7 +212,45 @@ class OrderItem(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2)
     subtotal = models.DecimalField(max_digits=12, decimal_places=2, default=0)
 
-    def save(self, *args, **kwargs):
+    # Product as it was when ordered: history renders from these, without joining the catalog
+    product_name = models.CharField(max_length=255, blank=True)
+    product_image = models.URLField(blank=True, null=True)
+    shop = models.ForeignKey('shops.Shop', null=True, blank=True, on_delete=models.SET_NULL, related_name='order_items')
+
+    SNAPSHOT_FIELDS = ['product_name', 'product_image', 'shop']
+
+    def capture_product(self, product=None):
+        """Copy name, image and shop of the product being bought (also used before bulk_create)."""
+        product = product or self.product
+        self.product_name = product.name
+        self.product_image = product.image
+        self.shop_id = product.shop_id
+
+    @classmethod
+    def backfill_snapshots(cls, batch_size=1000):
+        """Fill the product snapshot of items saved before it existed; returns the number of items.
+
+        One UPDATE ... SET col = (SELECT ... FROM products_product) per batch of ids.
+        """
+        from products.models import Product
+        product = Product.objects.filter(pk=OuterRef('product_id'))
+        updated = 0
+        last_id = 0
+        while True:
+            ids = list(
+                cls.objects.filter(pk__gt=last_id, product_name='').order_by('pk').values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                return updated
+            updated += cls.objects.filter(pk__in=ids).update(
+                product_name=Subquery(product.values('name')[:1]),
+                product_image=Subquery(product.values('image')[:1]),
+                shop_id=Subquery(product.values('shop_id')[:1]),
+            )
+            last_id = ids[-1]
+
+    def compute_subtotal(self):
+        """Normalize price and set subtotal (also used before bulk_create, which skips save)."""
         # Ensure price is a Decimal (frontend may send a float -> Decimal * float raises TypeError)
         if not isinstance(self.price, Decimal):
             try:
@@ -183,10 +260,16 @@ class OrderItem(models.Model):
                 self.price = Decimal('0')
         # Compute subtotal with Decimal arithmetic only
         self.subtotal = self.price * Decimal(self.quantity)
+        return self.subtotal
+
+    def save(self, *args, **kwargs):
+        self.compute_subtotal()
+        if not self.product_name:
+            self.capture_product()
         super().save(*args, **kwargs)
 
     def __str__(self):
-        return f"{self.quantity} x {self.product.name} (Order {self.order_id})"
+        return f"{self.quantity} x {self.product_name or self.product.name} (Order {self.order_id})"
 
 
 class OrderStatusHistory(models.Model):
@@ -200,3 +283,106 @@ class OrderStatusHistory(models.Model):
 
     def __str__(self):
         return f"Order {self.order_id}: {self.from_status or 'created'} -> {self.to_status} @ {self.changed_at}" 
+
+
+class StockReservation(models.Model):
+    """Temporary hold on product stock while a checkout is being paid (see orders.reservations)."""
+    token = models.UUIDField(db_index=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='stock_reservations')
+    product = models.ForeignKey('products.Product', on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Held quantity per product (availability) and expired holds (sweeper)
+            models.Index(fields=['product', 'expires_at', 'quantity'], name='reservation_product_idx'),
+            models.Index(fields=['expires_at'], name='reservation_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f"Hold {self.quantity} x product {self.product_id} until {self.expires_at}"
+
+
+class IdempotencyRecord(models.Model):
+    """First response to a POST sent with an ``Idempotency-Key`` header (see shopnow.idempotency).
+
+    ``status_code`` is NULL while the first request is still running: the row
+    doubles as the lock collapsing concurrent duplicates.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='idempotency_records')
+    scope = models.CharField(max_length=50)
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    content = models.BinaryField(null=True, blank=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'scope', 'key'], name='idempotency_user_scope_key'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at'], name='idempotency_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.scope}:{self.key} ({self.status_code or 'in progress'})"
+
+
+class OrderDailyStat(models.Model):
+    """Order count and revenue per (day, shop, status, payment method) (see orders.rollups).
+
+    ``day`` is the order's creation date. ``shop_id`` is 0 for orders without
+    a shop; it is not a foreign key so the unique key never contains NULL.
+    """
+    day = models.DateField()
+    shop_id = models.BigIntegerField(default=0)
+    status = models.CharField(max_length=20)
+    payment_method = models.CharField(max_length=50, blank=True)
+    order_count = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'shop_id', 'status', 'payment_method'], name='order_daily_stat_key'),
+        ]
+        indexes = [
+            models.Index(fields=['shop_id', 'day'], name='order_daily_stat_shop_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} shop {self.shop_id} {self.status}/{self.payment_method or '-'}: {self.order_count}"
+
+
+class OutboxEvent(models.Model):
+    """Side effect to run after a commit, written in the same transaction as its cause (see shopnow.outbox)."""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    topic = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField()
+    locked_until = models.DateTimeField(null=True, blank=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Worker polling: due pending events, oldest first
+            models.Index(fields=['status', 'available_at', 'id'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.topic} #{self.pk} ({self.status}, {self.attempts} attempts)"
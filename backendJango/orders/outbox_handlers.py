@@ -0,0 +1,23 @@
+"""Outbox handlers for order events (run by ``manage.py run_outbox_worker``).
+
+Handlers run after the order is committed, outside the checkout request;
+they must tolerate being run more than once for the same event.
+"""
+import logging
+
+from shopnow import outbox
+
+logger = logging.getLogger('orders.events')
+
+
+@outbox.handler('order.created')
+def log_order_created(payload, event):
+    # Hook for confirmation e-mails / shop notifications
+    logger.info('Order %s placed by user %s (shop %s, total %s)',
+                payload['order_id'], payload['user_id'], payload['shop_id'], payload['total_price'])
+
+
+@outbox.handler('order.status_changed')
+def log_order_status_changed(payload, event):
+    # Hook for shipping / cancellation notifications
+    logger.info('Order %s: %s -> %s', payload['order_id'], payload['from'], payload['to'])
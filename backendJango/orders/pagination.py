@@ -0,0 +1,26 @@
+from rest_framework.response import Response
+
+from products.pagination import ProductKeysetPagination
+
+
+class OrderHistoryPagination(ProductKeysetPagination):
+    """Keyset pagination of a customer's orders over (created_at, id).
+
+    With the ``(user, created_at)`` index each page is one index range scan,
+    however many orders the customer has placed.
+    """
+    page_size = 20
+    orderings = {
+        'created_at': 'created_at',
+        '-created_at': 'created_at',
+    }
+    default_ordering = '-created_at'
+
+    def get_paginated_response(self, data):
+        # Keeps the ``orders`` key of the unpaginated payload
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'ordering': self.ordering,
+            'orders': data,
+        })
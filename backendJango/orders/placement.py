@@ -0,0 +1,263 @@
+"""Set-based order placement.
+
+Placing an order costs the same number of queries whatever the cart size.
+Two stock engines are available, selected by ``settings.ORDER_STOCK_ENGINE``:
+
+``pessimistic`` (default)
+    one ``SELECT ... FOR UPDATE`` over every product of the cart (ordered by
+    id, so concurrent checkouts lock rows in the same order and cannot
+    deadlock), stock validated in memory, then one bulk UPDATE.
+
+``optimistic``
+    products are read without locks and stock is taken by a single guarded
+    ``UPDATE ... SET stock = stock - n WHERE id IN (...) AND stock >= n``
+    issued last, right before commit. Fewer rows updated than products
+    ordered means another checkout won the race: the transaction is rolled
+    back. Row locks are then only held for the tail of the transaction, which
+    keeps throughput up when everybody buys the same product (flash sales).
+
+With either engine, products with sharded stock (``Product.stock_shard_count``,
+see products.stock_shards) are never locked nor updated here: their units are
+taken from a random shard, at the cost of one or two extra queries each.
+
+Stock held by other shoppers' checkouts (orders.reservations) is not
+available: it is read with one grouped query and, for the optimistic
+engine, also checked inside the guarded UPDATE. Sharded products are never
+held, so their shards are taken from without looking at reservations.
+"""
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from products import stock_shards, trending
+from products.models import Product
+from shopnow import response_cache
+from . import reservations
+from .models import Order, OrderItem
+
+STOCK_FIELDS = ['stock', 'status', 'trending_score', 'updated_at']
+
+
+def parse_lines(items_payload):
+    """Return ``[(product_id, quantity, price), ...]`` from the ``orderItems`` payload."""
+    lines = []
+    for line in items_payload:
+        product_id = line.get('product') or line.get('product_id')
+        quantity = int(line.get('quantity') or 0)
+        if quantity <= 0:
+            raise ValueError('Invalid quantity')
+        try:
+            product_id = int(product_id)
+        except (TypeError, ValueError):
+            raise Product.DoesNotExist('Produit introuvable')
+        lines.append((product_id, quantity, line.get('price')))
+    return lines
+
+
+def _demand(lines):
+    demand = Counter()
+    for product_id, quantity, _ in lines:
+        demand[product_id] += quantity
+    return demand
+
+
+def _check_stock(demand, products, held):
+    for product_id, quantity in demand.items():
+        product = products[product_id]
+        if quantity > product.stock - held.get(product_id, 0):
+            raise ValueError(f'Stock insuffisant pour le produit {product.name}')
+
+
+# Copied from a multi-shop parent onto each of its sub-orders
+SUB_ORDER_FIELDS = [
+    'user_id', 'status', 'payment_method', 'credit_status', 'payment_due_date',
+    'shipping_address', 'phone_number',
+]
+
+
+def _save_order(order, lines, products):
+    """Save the unsaved ``order`` with its total and return its (unsaved) items.
+
+    A cart spanning several shops becomes a parent order without items and
+    one sub-order per shop (its own shop, total and status), saved one by
+    one: the cost grows with the number of shops, not with the cart size.
+    Each item's ``order`` is the order it belongs to.
+    """
+    by_shop = {}
+    for product_id, quantity, price in lines:
+        item = OrderItem(product=products[product_id], quantity=quantity, price=price)
+        item.capture_product()
+        item.compute_subtotal()
+        by_shop.setdefault(item.shop_id, []).append(item)
+    items = [item for shop_items in by_shop.values() for item in shop_items]
+    order.total_price = sum(item.subtotal for item in items)
+    if len(by_shop) == 1:
+        order.shop_id = next(iter(by_shop))
+        order.save()
+        for item in items:
+            item.order = order
+        return items
+
+    order.shop_id = None
+    order.has_sub_orders = True
+    # Credit is requested (and decided) per shop, on the sub-orders
+    credit_status, order.credit_status = order.credit_status, 'none'
+    order.save()
+    for shop_id, shop_items in sorted(by_shop.items(), key=lambda entry: entry[0] or 0):
+        sub_order = Order(parent=order, shop_id=shop_id, total_price=sum(item.subtotal for item in shop_items))
+        for field in SUB_ORDER_FIELDS:
+            setattr(sub_order, field, getattr(order, field))
+        sub_order.credit_status = credit_status
+        sub_order.save()
+        for item in shop_items:
+            item.order = sub_order
+    return items
+
+
+def _split_sharded(demand, products):
+    """(plain product ids, sharded product ids) of ``demand``."""
+    sharded = sorted(pk for pk in demand if products[pk].stock_shard_count)
+    plain = [pk for pk in demand if not products[pk].stock_shard_count]
+    return plain, sharded
+
+
+def _take_sharded(sharded, demand, products, sold_at):
+    """Take stock of sharded products; call after the order lines are inserted."""
+    for product_id in sharded:
+        product = products[product_id]
+        if not stock_shards.take(product, demand[product_id], sold_at):
+            raise ValueError(f'Stock insuffisant pour le produit {product.name}')
+        # Cached sum minus this sale, until the next refresh
+        product.stock = max(product.stock - demand[product_id], 0)
+    if sharded:
+        stock_shards.schedule_refresh(sharded)
+
+
+def _invalidate(products):
+    # Bulk writes skip post_save: refresh cached catalog responses ourselves
+    response_cache.invalidate_products([p.pk for p in products], {p.shop_id for p in products if p.shop_id})
+
+
+class PessimisticStockEngine:
+    name = 'pessimistic'
+
+    def load(self, lines):
+        """Lock every product of ``lines`` with one query; must run inside a transaction."""
+        ids = sorted({product_id for product_id, _, _ in lines})
+        products = {
+            p.pk: p for p in Product.objects.select_for_update().filter(pk__in=ids, stock_shard_count=0).order_by('pk')
+        }
+        if len(products) != len(ids):
+            # Sharded products are read without their (hot) row lock
+            products.update(Product.objects.filter(stock_shard_count__gt=0).in_bulk(set(ids) - set(products)))
+        if len(products) != len(ids):
+            raise Product.DoesNotExist('Produit introuvable')
+        return products
+
+    def place(self, order, lines, products, reservation=None):
+        """Save ``order``, decrement stock and insert its lines in bulk; returns the items.
+
+        ``reservation`` is the checkout's own reservation token: its holds do
+        not count against it. Raises ValueError when a product lacks stock
+        (nothing is written then).
+        """
+        demand = _demand(lines)
+        # Cached sums of sharded products only over-estimate: safe for an early refusal
+        _check_stock(demand, products, reservations.held_quantities(demand, exclude_token=reservation))
+        plain, sharded = _split_sharded(demand, products)
+        items = _save_order(order, lines, products)
+        now = timezone.now()
+        touched = [products[product_id] for product_id in plain]
+        for product in touched:
+            quantity = demand[product.pk]
+            product.stock -= quantity
+            if product.stock == 0:
+                product.status = 'unavailable'
+            product.trending_score = trending.add_sale(product.trending_score, quantity, order.created_at)
+            product.updated_at = now
+        if touched:
+            Product.objects.bulk_update(touched, STOCK_FIELDS)
+        OrderItem.objects.bulk_create(items)
+        _take_sharded(sharded, demand, products, order.created_at)
+        _invalidate(touched)
+        return items
+
+
+class OptimisticStockEngine:
+    name = 'optimistic'
+
+    def load(self, lines):
+        """Read the products of ``lines`` without locking them."""
+        ids = {product_id for product_id, _, _ in lines}
+        products = Product.objects.in_bulk(ids)
+        if len(products) != len(ids):
+            raise Product.DoesNotExist('Produit introuvable')
+        return products
+
+    def place(self, order, lines, products, reservation=None):
+        """Same contract as :meth:`PessimisticStockEngine.place`; must run inside a transaction."""
+        demand = _demand(lines)
+        # Cheap early refusal on the snapshot; the guarded UPDATE below is authoritative
+        held = reservations.held_quantities(demand, exclude_token=reservation)
+        _check_stock(demand, products, held)
+        plain, sharded = _split_sharded(demand, products)
+        items = _save_order(order, lines, products)
+        OrderItem.objects.bulk_create(items)
+        _take_sharded(sharded, demand, products, order.created_at)
+        if plain:
+            self._take_plain({pk: demand[pk] for pk in plain}, products, order.created_at, reservation)
+        _invalidate([products[product_id] for product_id in plain])
+        return items
+
+    def _take_plain(self, demand, products, sold_at, reservation):
+        """Decrement stock of non-sharded products with one guarded UPDATE."""
+        wanted = Case(
+            *[When(pk=product_id, then=Value(quantity)) for product_id, quantity in demand.items()],
+            output_field=IntegerField(),
+        )
+        sale = Case(
+            *[When(pk=product_id, then=trending.add_sale_expression(quantity, sold_at))
+              for product_id, quantity in demand.items()],
+            default=F('trending_score'),
+        )
+        # status is assigned before stock: MySQL evaluates SET left to right,
+        # so it must still see the stock value the WHERE clause checked
+        # Units held by other checkouts are re-read in the same statement
+        available = F('stock') - reservations.held_expression(exclude_token=reservation)
+        updated = Product.objects.alias(available=available).filter(pk__in=list(demand), available__gte=wanted).update(
+            status=Case(When(stock=wanted, then=Value('unavailable')), default=F('status')),
+            stock=F('stock') - wanted,
+            trending_score=sale,
+            updated_at=timezone.now(),
+        )
+        if updated != len(demand):
+            raise ValueError(self._oversold_message(demand, products, reservation))
+
+        # Remaining stock for the response, as left by this very UPDATE
+        remaining = dict(Product.objects.filter(pk__in=list(demand)).values_list('pk', 'stock'))
+        for product_id, stock in remaining.items():
+            products[product_id].stock = stock
+
+    def _oversold_message(self, demand, products, reservation):
+        stocks = dict(
+            reservations.with_available_stock(Product.objects.filter(pk__in=list(demand)), reservation)
+            .values_list('pk', 'available_stock')
+        )
+        for product_id, quantity in sorted(demand.items()):
+            if stocks.get(product_id, 0) < quantity:
+                return f'Stock insuffisant pour le produit {products[product_id].name}'
+        return 'Stock insuffisant'
+
+
+ENGINES = {engine.name: engine for engine in (PessimisticStockEngine, OptimisticStockEngine)}
+
+
+def get_engine(name=None):
+    name = name or getattr(settings, 'ORDER_STOCK_ENGINE', 'pessimistic')
+    try:
+        return ENGINES[name]()
+    except KeyError:
+        raise ImproperlyConfigured(f'Unknown ORDER_STOCK_ENGINE {name!r} (expected one of {", ".join(ENGINES)})')
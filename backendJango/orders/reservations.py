@@ -0,0 +1,126 @@
+"""Time-limited stock reservations at checkout.
+
+Starting a checkout holds the cart's quantities for ``STOCK_RESERVATION_TTL_SECONDS``
+so that shoppers going through a slow payment flow do not all race for the
+same last units. Available stock is ``Product.stock`` minus the unexpired
+holds of *other* checkouts; expired holds simply stop counting, and
+``manage.py release_expired_reservations`` deletes them in batches.
+
+Placing the order with the reservation token converts the holds into order
+lines (the holds are deleted in the same transaction).
+
+Products with sharded stock (products.stock_shards) cannot be reserved: their
+purchases take units from a random shard without locking the product, so a
+hold could not be enforced without serializing every sale again.
+"""
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from products.models import Product
+from .models import StockReservation
+
+DEFAULT_TTL_SECONDS = 900
+DEFAULT_SWEEP_BATCH_SIZE = 1000
+
+
+class ReservationError(ValueError):
+    pass
+
+
+def ttl():
+    return timedelta(seconds=getattr(settings, 'STOCK_RESERVATION_TTL_SECONDS', DEFAULT_TTL_SECONDS))
+
+
+def _active(exclude_token=None, now=None):
+    holds = StockReservation.objects.filter(expires_at__gt=now or timezone.now())
+    if exclude_token:
+        holds = holds.exclude(token=exclude_token)
+    return holds
+
+
+def held_expression(exclude_token=None):
+    """Units of ``OuterRef('pk')`` held by active reservations, for annotate() / filter()."""
+    held = (
+        _active(exclude_token).filter(product=OuterRef('pk'))
+        .order_by().values('product').annotate(total=Sum('quantity')).values('total')
+    )
+    return Coalesce(Subquery(held, output_field=IntegerField()), 0)
+
+
+def with_available_stock(queryset, exclude_token=None):
+    """Annotate ``available_stock`` (stock minus others' holds) in the same query."""
+    return queryset.annotate(available_stock=F('stock') - held_expression(exclude_token))
+
+
+def held_quantities(product_ids, exclude_token=None):
+    """{product_id: held units} from one grouped query over the reservation index."""
+    rows = (
+        _active(exclude_token).filter(product_id__in=list(product_ids))
+        .order_by().values('product_id').annotate(total=Sum('quantity'))
+    )
+    return {row['product_id']: row['total'] for row in rows}
+
+
+def reserve(user, lines):
+    """Hold ``[(product_id, quantity, price), ...]`` for ``user``; returns the token and expiry.
+
+    Products are locked (ordered by id) while availability is checked, so
+    two checkouts cannot both hold the last units.
+    """
+    demand = {}
+    for product_id, quantity, _ in lines:
+        demand[product_id] = demand.get(product_id, 0) + quantity
+    token = uuid.uuid4()
+    expires_at = timezone.now() + ttl()
+    with transaction.atomic():
+        products = {p.pk: p for p in Product.objects.select_for_update().filter(pk__in=list(demand)).order_by('pk')}
+        if len(products) != len(demand):
+            raise Product.DoesNotExist('Produit introuvable')
+        held = held_quantities(demand)
+        for product_id, quantity in demand.items():
+            product = products[product_id]
+            if product.stock_shard_count:
+                raise ReservationError(f'Le produit {product.name} ne peut pas être réservé')
+            if quantity > product.stock - held.get(product_id, 0):
+                raise ReservationError(f'Stock insuffisant pour le produit {product.name}')
+        StockReservation.objects.bulk_create([
+            StockReservation(token=token, user=user, product_id=product_id, quantity=quantity, expires_at=expires_at)
+            for product_id, quantity in demand.items()
+        ])
+    return token, expires_at
+
+
+def check_token(token, user):
+    """Validate a checkout's reservation token; raises ReservationError when unknown or expired."""
+    try:
+        token = uuid.UUID(str(token))
+    except ValueError:
+        raise ReservationError('Réservation invalide')
+    if not _active().filter(token=token, user=user).exists():
+        raise ReservationError('Réservation expirée ou introuvable')
+    return token
+
+
+def release(token, user):
+    """Drop a checkout's holds (cancelled checkout, or converted into an order)."""
+    return StockReservation.objects.filter(token=token, user=user).delete()[0]
+
+
+def sweep(batch_size=DEFAULT_SWEEP_BATCH_SIZE, now=None):
+    """Delete expired holds in batches of ``batch_size`` rows; returns how many were deleted."""
+    now = now or timezone.now()
+    deleted = 0
+    while True:
+        ids = list(
+            StockReservation.objects.filter(expires_at__lte=now)
+            .order_by('expires_at').values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            return deleted
+        deleted += StockReservation.objects.filter(pk__in=ids).delete()[0]
@@ -0,0 +1,164 @@
+"""Daily order statistics kept up to date as orders are written.
+
+``OrderDailyStat`` holds one row per (creation day, shop, status, payment
+method) with the number of orders and their revenue. ``Order.save`` moves
+the order between rows in the same transaction as the order itself: +1 on
+creation, -1 / +1 when its status, payment method, shop or total changes.
+Dashboards then sum a few hundred rollup rows instead of scanning
+``orders_order``.
+
+Bulk writers (``QuerySet.update``) bypass ``save()`` and must call
+:func:`apply` themselves. ``manage.py backfill_order_stats`` rebuilds the
+table from the orders.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Order, OrderDailyStat
+
+KEY_FIELDS = ('status', 'payment_method', 'shop_id', 'total_price', 'created_at')
+
+
+def key_of(values):
+    """Rollup key ``(day, shop_id, status, payment_method)`` from order attribute values."""
+    return (
+        timezone.localdate(values['created_at']),
+        values['shop_id'] or 0,
+        values['status'],
+        values['payment_method'] or '',
+    )
+
+
+def apply(deltas):
+    """Add ``{key: (count, revenue)}`` to the rollup rows; call inside the writing transaction.
+
+    Missing rows are inserted empty first (conflicts ignored), then every row
+    is incremented in place: a constant number of queries, safe against
+    concurrent writers creating the same row.
+    """
+    deltas = {key: delta for key, delta in deltas.items() if any(delta)}
+    if not deltas:
+        return
+    OrderDailyStat.objects.bulk_create(
+        [
+            OrderDailyStat(day=day, shop_id=shop_id, status=status, payment_method=payment_method)
+            for day, shop_id, status, payment_method in deltas
+        ],
+        ignore_conflicts=True,
+    )
+    # Sorted so concurrent writers lock the rows in the same order
+    for key in sorted(deltas):
+        day, shop_id, status, payment_method = key
+        count, revenue = deltas[key]
+        OrderDailyStat.objects.filter(
+            day=day, shop_id=shop_id, status=status, payment_method=payment_method,
+        ).update(order_count=F('order_count') + count, revenue=F('revenue') + revenue)
+
+
+def transition_deltas(before, after):
+    """Deltas moving one order from its ``before`` values to its ``after`` values (either may be None)."""
+    deltas = defaultdict(lambda: (0, Decimal(0)))
+    if before is not None:
+        count, revenue = deltas[key_of(before)]
+        deltas[key_of(before)] = (count - 1, revenue - Decimal(before['total_price'] or 0))
+    if after is not None:
+        count, revenue = deltas[key_of(after)]
+        deltas[key_of(after)] = (count + 1, revenue + Decimal(after['total_price'] or 0))
+    return dict(deltas)
+
+
+def merge(deltas_list):
+    """Sum several ``{key: (count, revenue)}`` mappings into one."""
+    total = {}
+    for deltas in deltas_list:
+        for key, (count, revenue) in deltas.items():
+            old_count, old_revenue = total.get(key, (0, Decimal(0)))
+            total[key] = (old_count + count, old_revenue + revenue)
+    return total
+
+
+def _values(order):
+    return {name: getattr(order, name) for name in KEY_FIELDS}
+
+
+def order_saved(order, created):
+    """Record a saved order; ``order.saved_changes`` tells what it looked like before.
+
+    Parents of multi-shop orders are not counted: their sub-orders are.
+    """
+    if created:
+        if not order.has_sub_orders:
+            apply(transition_deltas(None, _values(order)))
+        return
+    changes = {name: change for name, change in order.saved_changes.items() if name in KEY_FIELDS}
+    if not changes or order.has_sub_orders:
+        return
+    after = _values(order)
+    before = dict(after, **{name: old for name, (old, _) in changes.items()})
+    apply(transition_deltas(before, after))
+
+
+def order_deleted(order):
+    if order.has_sub_orders:
+        return
+    apply(transition_deltas(_values(order), None))
+
+
+def summary(since=None, shop_id=None):
+    """Totals and per-status counts from the rollup rows.
+
+    ``since`` (a date) adds ``orders_since`` / ``revenue_since`` for the window.
+    """
+    rows = OrderDailyStat.objects.all()
+    if shop_id is not None:
+        rows = rows.filter(shop_id=shop_id)
+    aggregates = {'n': Sum('order_count'), 'amount': Sum('revenue')}
+    if since is not None:
+        aggregates['n_since'] = Sum('order_count', filter=Q(day__gte=since))
+        aggregates['amount_since'] = Sum('revenue', filter=Q(day__gte=since))
+    row = rows.aggregate(**aggregates)
+    totals = {'orders': row['n'] or 0, 'revenue': row['amount'] or 0}
+    if since is not None:
+        totals['orders_since'] = row['n_since'] or 0
+        totals['revenue_since'] = row['amount_since'] or 0
+    by_status = rows.order_by().values('status').annotate(c=Sum('order_count'))
+    totals['status_breakdown'] = {row['status']: row['c'] for row in by_status if row['c']}
+    return totals
+
+
+def window_start(days):
+    """First day of the last ``days`` days, today included."""
+    return timezone.localdate() - timedelta(days=days - 1)
+
+
+@transaction.atomic
+def backfill(since=None, batch_size=1000):
+    """Recompute the rollup rows from the orders (all days, or from ``since`` on); returns the row count."""
+    stale = OrderDailyStat.objects.all()
+    orders = Order.objects.filter(has_sub_orders=False)
+    if since is not None:
+        stale = stale.filter(day__gte=since)
+        orders = orders.filter(created_at__date__gte=since)
+    stale.delete()
+    grouped = (
+        orders.order_by()
+        .annotate(day=TruncDate('created_at'))
+        .values('day', 'shop_id', 'status', 'payment_method')
+        .annotate(order_count=Count('id'), revenue=Sum('total_price'))
+    )
+    rows = [
+        OrderDailyStat(
+            day=row['day'], shop_id=row['shop_id'] or 0, status=row['status'],
+            payment_method=row['payment_method'] or '', order_count=row['order_count'],
+            revenue=row['revenue'] or 0,
+        )
+        for row in grouped.iterator()
+    ]
+    OrderDailyStat.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
@@ -0,0 +1,59 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from shopnow import outbox
+from . import cancellation, rollups, transitions
+from .models import Order
+
+
+def created_payload(order):
+    return {
+        'order_id': order.pk,
+        'user_id': order.user_id,
+        'shop_id': order.shop_id,
+        'parent_id': order.parent_id,
+        'status': order.status,
+        'total_price': str(order.total_price),
+    }
+
+
+@receiver(post_save, sender=Order)
+def update_order_rollups(sender, instance, created, raw=False, **kwargs):
+    # Runs inside Order.save's transaction
+    if not raw:
+        rollups.order_saved(instance, created)
+
+
+@receiver(post_save, sender=Order)
+def publish_order_events(sender, instance, created, raw=False, **kwargs):
+    # Committed (or rolled back) together with the order; handled by run_outbox_worker
+    if raw:
+        return
+    if created:
+        outbox.publish('order.created', created_payload(instance))
+    elif 'status' in instance.saved_changes:
+        old_status, new_status = instance.saved_changes['status']
+        outbox.publish('order.status_changed', {'order_id': instance.pk, 'from': old_status, 'to': new_status})
+
+
+@receiver(post_save, sender=Order)
+def restock_cancelled_order(sender, instance, created, raw=False, **kwargs):
+    # Customer cancel, admin status edit, rejected credit: same transaction as the status change.
+    # saved_changes holds the status the row really had (compare-and-set, see Order.save)
+    if raw or created or 'status' not in instance.saved_changes:
+        return
+    old_status, new_status = instance.saved_changes['status']
+    if new_status == 'cancelled' and old_status in cancellation.RESTOCKABLE_STATUSES:
+        cancellation.restock([instance.pk])
+
+
+@receiver(post_save, sender=Order)
+def sync_parent_status(sender, instance, created, raw=False, **kwargs):
+    # A multi-shop order follows its sub-orders
+    if not raw and not created and 'status' in instance.saved_changes and instance.parent_id:
+        transitions.sync_parents([instance.parent_id])
+
+
+@receiver(post_delete, sender=Order)
+def remove_order_from_rollups(sender, instance, **kwargs):
+    rollups.order_deleted(instance)
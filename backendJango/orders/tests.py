@@ -1,7 +1,28 @@
-from django.test import TestCase
+import csv
+import hashlib
+import io
+import json
+import threading
+from decimal import Decimal
+from datetime import timedelta
+from unittest import skipIf
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Q
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from django.contrib.auth import get_user_model
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIClient
-from products.models import Product
+from products.models import Product, ProductStockShard
+from orders import cancellation, export, placement, rollups
+from orders.models import Delivery, IdempotencyRecord, Order, OrderDailyStat, OrderItem, OrderReopenError, OrderStatusHistory, OutboxEvent, StockReservation
+from products import stock_shards, trending
+from shops.models import Shop
+from shopnow import outbox, query_plans
 
 
 class OrderCreationTests(TestCase):
@@ -26,3 +47,1068 @@ class OrderCreationTests(TestCase):
 		self.assertEqual(resp.status_code, 201, resp.data)
 		self.product.refresh_from_db()
 		self.assertEqual(self.product.stock, 3)
+
+	def test_insufficient_stock_writes_nothing(self):
+		other = Product.objects.create(name='Other', price='1.00', stock=10)
+		payload = {
+			'orderItems': [
+				{'product': other.id, 'quantity': 2, 'price': '1.00'},
+				{'product': self.product.id, 'quantity': 3, 'price': '9.99'},
+				{'product': self.product.id, 'quantity': 3, 'price': '9.99'},
+			],
+			'shippingAddress': 'Somewhere', 'totalPrice': '61.94',
+		}
+		resp = self.client.post('/api/orders/', payload, format='json')
+		self.assertEqual(resp.status_code, 400)
+		self.assertIn('Stock insuffisant', resp.data['error'])
+		other.refresh_from_db()
+		self.assertEqual(other.stock, 10)
+		self.assertFalse(Order.objects.exists())
+
+	def test_unknown_product(self):
+		payload = {'orderItems': [{'product': 999999, 'quantity': 1}], 'shippingAddress': 'x', 'totalPrice': '1'}
+		resp = self.client.post('/api/orders/', payload, format='json')
+		self.assertEqual(resp.status_code, 400)
+		self.assertEqual(resp.data['error'], 'Produit introuvable')
+
+
+class SetBasedOrderPlacementTests(TestCase):
+	def setUp(self):
+		User = get_user_model()
+		self.user = User.objects.create_user(username='buyer', password='pass12345')
+		self.client = APIClient()
+		self.client.force_authenticate(user=self.user)
+		self.products = [Product.objects.create(name=f'P{i}', price='2.50', stock=3) for i in range(30)]
+
+	def _place(self, products, quantity=1):
+		payload = {
+			'orderItems': [{'product': p.id, 'quantity': quantity, 'price': str(p.price)} for p in products],
+			'shippingAddress': 'Tunis', 'totalPrice': '0',
+		}
+		with CaptureQueriesContext(connection) as ctx:
+			resp = self.client.post('/api/orders/', payload, format='json')
+		self.assertEqual(resp.status_code, 201, resp.data)
+		return resp, len(ctx.captured_queries)
+
+	def test_query_count_does_not_depend_on_cart_size(self):
+		_, single = self._place(self.products[:1])
+		resp, thirty = self._place(self.products, quantity=2)
+		self.assertEqual(single, thirty)
+		self.assertEqual(resp.data['order']['total_price'], '150.00')
+		self.assertEqual(len(resp.data['order']['items']), 30)
+		order = Order.objects.get(pk=resp.data['order']['id'])
+		self.assertEqual(order.items.count(), 30)
+		stocks = dict(Product.objects.values_list('pk', 'stock'))
+		self.assertEqual(stocks[self.products[0].pk], 0)
+		self.assertEqual(stocks[self.products[1].pk], 1)
+		self.assertEqual(Product.objects.get(pk=self.products[0].pk).status, 'unavailable')
+
+
+@override_settings(ORDER_STOCK_ENGINE='optimistic')
+class OptimisticStockEngineTests(SetBasedOrderPlacementTests):
+	def test_guarded_update_refuses_stale_snapshot(self):
+		product = Product.objects.create(name='Flash', price='5.00', stock=1, trending_score=3.0)
+		engine = placement.get_engine()
+		lines = [(product.id, 1, '5.00')]
+		# Both checkouts read stock=1 before either writes
+		first, second = engine.load(lines), engine.load(lines)
+		with transaction.atomic():
+			engine.place(Order(user=self.user), lines, first)
+		with self.assertRaisesMessage(ValueError, 'Stock insuffisant pour le produit Flash'):
+			with transaction.atomic():
+				engine.place(Order(user=self.user), lines, second)
+		product.refresh_from_db()
+		self.assertEqual((product.stock, product.status), (0, 'unavailable'))
+		self.assertEqual(Order.objects.count(), 1)
+		order = Order.objects.get()
+		self.assertAlmostEqual(product.trending_score, trending.add_sale(3.0, 1, order.created_at))
+
+
+@skipIf(connection.vendor == 'sqlite', 'SQLite serializes writers: needs MySQL / PostgreSQL')
+@override_settings(ORDER_STOCK_ENGINE='optimistic')
+class OptimisticStockConcurrencyTests(TransactionTestCase):
+	def test_concurrent_checkouts_never_oversell(self):
+		product = Product.objects.create(name='Flash', price='5.00', stock=5)
+		users = [get_user_model().objects.create_user(username=f'u{i}', password='pass12345') for i in range(20)]
+		barrier = threading.Barrier(len(users))
+		codes = []
+
+		def checkout(user):
+			client = APIClient()
+			client.force_authenticate(user=user)
+			barrier.wait()
+			try:
+				payload = {'orderItems': [{'product': product.id, 'quantity': 1, 'price': '5.00'}], 'shippingAddress': 'x', 'totalPrice': '5'}
+				codes.append(client.post('/api/orders/', payload, format='json').status_code)
+			finally:
+				connection.close()
+
+		threads = [threading.Thread(target=checkout, args=(user,)) for user in users]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		product.refresh_from_db()
+		self.assertEqual(codes.count(201), 5)
+		self.assertEqual(codes.count(400), 15)
+		self.assertEqual((product.stock, product.status), (0, 'unavailable'))
+		self.assertEqual(Order.objects.count(), 5)
+
+
+class ShardedStockTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		User = get_user_model()
+		self.user = User.objects.create_user(username='buyer', email='buyer@example.com', password='pass12345')
+		self.admin = User.objects.create_user(username='admin', email='admin@example.com', password='pass12345', is_staff=True)
+		self.client = APIClient()
+		self.client.force_authenticate(user=self.user)
+		self.product = stock_shards.configure(Product.objects.create(name='Hot', price='1.00', stock=10), 4)
+
+	def _buy(self, quantity):
+		payload = {'orderItems': [{'product': self.product.id, 'quantity': quantity, 'price': '1.00'}], 'shippingAddress': 'x', 'totalPrice': '1'}
+		with self.captureOnCommitCallbacks(execute=True):
+			return self.client.post('/api/orders/', payload, format='json')
+
+	def _shards(self):
+		return list(ProductStockShard.objects.filter(product=self.product).values_list('stock', flat=True))
+
+	def test_purchases_take_from_shards_and_fall_back_to_siblings(self):
+		self.assertEqual(self._shards(), [3, 3, 2, 2])
+		self.assertEqual(self._buy(2).status_code, 201)
+		self.assertEqual(sum(self._shards()), 8)
+		cache.clear()
+		# No single shard holds 5 units any more: drained across siblings
+		self.assertEqual(self._buy(5).status_code, 201)
+		self.assertEqual(sum(self._shards()), 3)
+		resp = self._buy(4)
+		self.assertEqual(resp.status_code, 400)
+		self.assertIn('Stock insuffisant', resp.data['error'])
+		# The cached sum was refreshed after the first purchase of each window
+		self.product.refresh_from_db()
+		self.assertEqual(self.product.stock, 3)
+		self.assertIsNotNone(self.product.trending_score)
+
+	@override_settings(ORDER_STOCK_ENGINE='optimistic')
+	def test_optimistic_engine_and_refresh(self):
+		self.assertEqual(self._buy(1).status_code, 201)
+		self.assertEqual(self._buy(1).status_code, 201)
+		self.product.refresh_from_db()
+		# Second purchase fell inside the refresh window
+		self.assertEqual(self.product.stock, 9)
+		stock_shards.rebalance()
+		self.product.refresh_from_db()
+		self.assertEqual(self.product.stock, 8)
+		self.assertEqual(self._shards(), [2, 2, 2, 2])
+		order_times = Order.objects.order_by('id').values_list('created_at', flat=True)
+		expected = None
+		for created_at in order_times:
+			expected = trending.add_sale(expected, 1, created_at)
+		self.assertAlmostEqual(self.product.trending_score, expected)
+
+	def test_admin_stock_edit_and_low_stock_stats(self):
+		admin = APIClient()
+		admin.force_authenticate(user=self.admin)
+		resp = admin.patch(f'/api/products/{self.product.id}/', {'stock': 3}, format='json')
+		self.assertEqual(resp.status_code, 200, resp.data)
+		self.assertEqual(self._shards(), [1, 1, 1, 0])
+		ProductStockShard.objects.filter(product=self.product, shard=0).update(stock=0)
+		low = admin.get('/api/admin/stats/').data['lowStockProducts']
+		self.assertEqual([(p['id'], p['stock']) for p in low], [(self.product.id, 2)])
+		# Read from the shards: the dashboard does not lock or fold them
+		self.product.refresh_from_db()
+		self.assertEqual(self.product.stock, 3)
+		stock_shards.configure(self.product, 0)
+		self.product.refresh_from_db()
+		self.assertEqual((self.product.stock, self.product.stock_shard_count), (2, 0))
+		self.assertFalse(ProductStockShard.objects.exists())
+
+
+class StockReservationTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		User = get_user_model()
+		self.alice = User.objects.create_user(username='alice', email='alice@example.com', password='pass12345')
+		self.bob = User.objects.create_user(username='bob', email='bob@example.com', password='pass12345')
+		self.product = Product.objects.create(name='Last units', price='4.00', stock=3)
+
+	def _client(self, user):
+		client = APIClient()
+		client.force_authenticate(user=user)
+		return client
+
+	def _reserve(self, user, quantity):
+		return self._client(user).post('/api/orders/reservations/', {'orderItems': [{'product': self.product.id, 'quantity': quantity}]}, format='json')
+
+	def _order(self, user, quantity, token=None):
+		payload = {'orderItems': [{'product': self.product.id, 'quantity': quantity, 'price': '4.00'}], 'shippingAddress': 'x', 'totalPrice': '4'}
+		if token:
+			payload['reservationToken'] = token
+		return self._client(user).post('/api/orders/', payload, format='json')
+
+	def _available(self):
+		with CaptureQueriesContext(connection) as ctx:
+			resp = APIClient().get('/api/orders/availability/', {'products': str(self.product.id)})
+		self.assertEqual(len(ctx.captured_queries), 1)
+		return resp.data['availability'][0]['available_stock']
+
+	def test_holds_block_other_shoppers_and_convert_to_order(self):
+		resp = self._reserve(self.alice, 2)
+		self.assertEqual(resp.status_code, 201, resp.data)
+		token = resp.data['reservation']['token']
+		self.assertEqual(self._available(), 1)
+		self.assertEqual(self._reserve(self.bob, 2).status_code, 400)
+		self.assertEqual(self._order(self.bob, 2).status_code, 400)
+		self.assertEqual(self._order(self.bob, 1).status_code, 201)
+		# Alice's own holds do not count against her order
+		self.assertEqual(self._order(self.alice, 2, token).status_code, 201)
+		self.assertFalse(StockReservation.objects.exists())
+		self.product.refresh_from_db()
+		self.assertEqual((self.product.stock, self._available()), (0, 0))
+
+	@override_settings(ORDER_STOCK_ENGINE='optimistic')
+	def test_optimistic_engine_respects_holds(self):
+		self.test_holds_block_other_shoppers_and_convert_to_order()
+
+	def test_expired_holds_stop_counting_and_are_swept(self):
+		token = self._reserve(self.alice, 3).data['reservation']['token']
+		StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+		self.assertEqual(self._available(), 3)
+		resp = self._order(self.alice, 1, token)
+		self.assertEqual(resp.status_code, 400)
+		self.assertEqual(resp.data['error'], 'Réservation expirée ou introuvable')
+		self._reserve(self.bob, 1)
+		call_command('release_expired_reservations', batch_size=1, stdout=io.StringIO())
+		self.assertEqual(list(StockReservation.objects.values_list('user__username', flat=True)), ['bob'])
+
+	def test_sharded_products_cannot_be_reserved(self):
+		token = self._reserve(self.alice, 1).data['reservation']['token']
+		# Live holds would be ignored by shard takes: sharding waits for them
+		with self.assertRaises(ValueError):
+			stock_shards.configure(self.product, 2)
+		self._client(self.alice).delete(f'/api/orders/reservations/{token}/')
+		stock_shards.configure(self.product, 2)
+		resp = self._reserve(self.alice, 1)
+		self.assertEqual(resp.status_code, 400)
+		self.assertIn('ne peut pas être réservé', resp.data['error'])
+		self.assertFalse(StockReservation.objects.exists())
+
+	def test_release(self):
+		token = self._reserve(self.alice, 3).data['reservation']['token']
+		self.assertEqual(self._client(self.alice).delete(f'/api/orders/reservations/{token}/').status_code, 204)
+		self.assertEqual(self._available(), 3)
+
+
+class IdempotentOrderCreationTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		self.user = get_user_model().objects.create_user(username='mobile', email='mobile@example.com', password='pass12345')
+		self.client = APIClient()
+		self.client.force_authenticate(user=self.user)
+		self.product = Product.objects.create(name='Dattes', price='6.00', stock=5)
+		self.payload = {'orderItems': [{'product': self.product.id, 'quantity': 2, 'price': '6.00'}], 'shippingAddress': 'Sfax', 'totalPrice': '12.00'}
+
+	def _post(self, key, payload=None):
+		return self.client.post('/api/orders/', payload or self.payload, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+	def test_retry_replays_first_response_with_one_lookup(self):
+		first = self._post('k-1')
+		self.assertEqual(first.status_code, 201)
+		with CaptureQueriesContext(connection) as ctx:
+			retry = self._post('k-1')
+		self.assertEqual(len(ctx.captured_queries), 1)
+		self.assertEqual((retry.status_code, retry.content), (201, first.content))
+		self.assertEqual(retry['Idempotent-Replayed'], 'true')
+		self.assertEqual(Order.objects.count(), 1)
+		self.product.refresh_from_db()
+		self.assertEqual(self.product.stock, 3)
+		# Another key places another order
+		self.assertEqual(self._post('k-2').status_code, 201)
+		self.assertEqual(Order.objects.count(), 2)
+
+	def test_key_reused_with_other_body_is_refused(self):
+		self._post('k-1')
+		other = dict(self.payload, shippingAddress='Gabès')
+		self.assertEqual(self._post('k-1', other).status_code, 422)
+
+	@override_settings(IDEMPOTENCY_WAIT_SECONDS=0)
+	def test_concurrent_duplicate_is_collapsed(self):
+		in_flight = IdempotencyRecord.objects.create(
+			user=self.user, scope='orders.create', key='k-1',
+			request_hash=hashlib.sha256(JSONRenderer().render(self.payload)).hexdigest(),
+			locked_until=timezone.now() + timedelta(seconds=30), expires_at=timezone.now() + timedelta(days=1),
+		)
+		self.assertEqual(self._post('k-1').status_code, 409)
+		self.assertFalse(Order.objects.exists())
+		# A lock left behind by a crashed worker is taken over
+		IdempotencyRecord.objects.filter(pk=in_flight.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+		self.assertEqual(self._post('k-1').status_code, 201)
+		self.assertEqual(IdempotencyRecord.objects.get().status_code, 201)
+
+	def test_errors_are_replayed_but_not_server_errors(self):
+		self.payload['orderItems'][0]['quantity'] = 50
+		self.assertEqual(self._post('k-1').status_code, 400)
+		self.product.stock = 100
+		self.product.save()
+		# 4xx answers are part of the contract: the retry gets the same answer
+		self.assertEqual(self._post('k-1').status_code, 400)
+		call_command('purge_idempotency_keys', stdout=io.StringIO())
+		self.assertEqual(IdempotencyRecord.objects.count(), 1)
+
+
+class OrderDirtyFieldTrackingTests(TestCase):
+	def setUp(self):
+		self.user = get_user_model().objects.create_user(username='tracked', email='tracked@example.com', password='pass12345')
+		self.order = Order.objects.create(user=self.user, total_price='10.00')
+
+	def test_status_change_logs_history_without_reading_the_row(self):
+		order = Order.objects.get(pk=self.order.pk)
+		order.status = 'paid'
+		with CaptureQueriesContext(connection) as ctx:
+			order.save()
+		# Rollup / outbox bookkeeping aside, no SELECT of the order row: a compare-and-set
+		# UPDATE of the guarded fields, the save itself and the history row
+		order_queries = [q['sql'] for q in ctx.captured_queries if 'orderdailystat' not in q['sql'] and 'outboxevent' not in q['sql']]
+		self.assertEqual([sql.split()[0] for sql in order_queries], ['UPDATE', 'UPDATE', 'INSERT'])
+		self.assertIn('pending', order_queries[0])
+		self.assertEqual(order.saved_changes, {'status': ('pending', 'paid')})
+		history = list(order.status_history.values_list('from_status', 'to_status'))
+		self.assertEqual(history, [('pending', 'paid')])
+		# Saving again without changes logs nothing
+		order.save()
+		self.assertEqual(order.status_history.count(), 1)
+
+	def test_update_fields_and_deferred_fields(self):
+		order = Order.objects.only('id', 'total_price').get(pk=self.order.pk)
+		order.status = 'shipped'
+		with CaptureQueriesContext(connection) as ctx:
+			order.save(update_fields=['total_price'])
+		# Compare-and-set on the loaded total, then the save: the deferred status is not read
+		self.assertEqual([q['sql'].split()[0] for q in ctx.captured_queries], ['UPDATE', 'UPDATE'])
+		self.assertFalse(order.status_history.exists())
+		# Deferred status is fetched once to compare, then the change is logged
+		self.assertTrue(order.is_dirty('status'))
+		order.save(update_fields=['status'])
+		self.assertEqual(list(order.status_history.values_list('from_status', 'to_status')), [('pending', 'shipped')])
+		order.refresh_from_db()
+		self.assertFalse(order.is_dirty())
+
+	def test_stale_instances_cannot_log_a_change_twice(self):
+		first = Order.objects.get(pk=self.order.pk)
+		second = Order.objects.get(pk=self.order.pk)
+		third = Order.objects.get(pk=self.order.pk)
+		first.status = 'processing'
+		first.save(update_fields=['status'])
+		# Both still believe the order is pending
+		second.status = 'processing'
+		second.save(update_fields=['status'])
+		self.assertEqual(second.saved_changes, {})
+		third.status = 'shipped'
+		third.save()
+		self.assertEqual(third.saved_changes['status'], ('processing', 'shipped'))
+		history = list(self.order.status_history.order_by('id').values_list('from_status', 'to_status'))
+		self.assertEqual(history, [('pending', 'processing'), ('processing', 'shipped')])
+		events = OutboxEvent.objects.filter(topic='order.status_changed').order_by('id')
+		self.assertEqual([(e.payload['from'], e.payload['to']) for e in events], history)
+		self.assertEqual(rollups.summary()['status_breakdown'], {'shipped': 1})
+
+
+class OrderHistoryTests(TestCase):
+	def setUp(self):
+		User = get_user_model()
+		self.user = User.objects.create_user(username='history', email='history@example.com', password='pass12345')
+		owner = User.objects.create_user(username='histowner', email='histowner@example.com', password='pass12345')
+		self.shop = Shop.objects.create(owner=owner, name='Shop', city='Tunis')
+		self.product = Product.objects.create(name='Thé', price='5.00', stock=100, shop=self.shop)
+		self.client = APIClient()
+		self.client.force_authenticate(user=self.user)
+
+	def _place(self, count, status='pending'):
+		for _ in range(count):
+			order = Order.objects.create(user=self.user, shop=self.shop, total_price='10.00')
+			OrderItem.objects.create(order=order, product=self.product, quantity=2, price='5.00')
+			if status != 'pending':
+				order.status = status
+				order.save()
+
+	def _queries(self, url='/api/orders/'):
+		# Authenticate once outside the measured block
+		with CaptureQueriesContext(connection) as ctx:
+			resp = self.client.get(url)
+		self.assertEqual(resp.status_code, 200)
+		return len(ctx.captured_queries), resp
+
+	def test_query_count_does_not_grow_with_orders(self):
+		self._place(1, status='paid')
+		few, resp = self._queries()
+		self.assertEqual(len(resp.data['orders']), 1)
+		self._place(15, status='paid')
+		many, resp = self._queries()
+		self.assertEqual(len(resp.data['orders']), 16)
+		self.assertEqual(few, many)
+		order = resp.data['orders'][0]
+		self.assertEqual(order['shop']['owner_name'], 'histowner')
+		self.assertEqual(order['items'][0]['product_name'], 'Thé')
+		self.assertEqual(order['status_history'][0]['to'], 'paid')
+
+	def test_cursor_pages_cover_every_order_once(self):
+		self._place(5)
+		seen = []
+		url = '/api/orders/?page_size=2'
+		while url:
+			resp = self.client.get(url)
+			self.assertEqual(resp.status_code, 200)
+			seen.extend(o['id'] for o in resp.data['orders'])
+			url = resp.data['next']
+		expected = list(Order.objects.filter(user=self.user).order_by('-created_at', '-id').values_list('id', flat=True))
+		self.assertEqual(seen, expected)
+
+	def test_status_and_date_filters(self):
+		self._place(2)
+		self._place(1, status='delivered')
+		resp = self.client.get('/api/orders/?status=delivered,cancelled')
+		self.assertEqual([o['status'] for o in resp.data['orders']], ['delivered'])
+		today = timezone.now().date()
+		resp = self.client.get(f'/api/orders/?date_from={today}&date_to={today}')
+		self.assertEqual(len(resp.data['orders']), 3)
+		resp = self.client.get(f'/api/orders/?date_from={today + timedelta(days=1)}')
+		self.assertEqual(resp.data['orders'], [])
+		resp = self.client.get('/api/orders/?date_to=yesterday')
+		self.assertEqual(resp.status_code, 400)
+
+	def test_other_customers_orders_are_hidden(self):
+		other = get_user_model().objects.create_user(username='other', email='other@example.com', password='pass12345')
+		Order.objects.create(user=other, total_price='1.00')
+		_, resp = self._queries()
+		self.assertEqual(resp.data['orders'], [])
+
+
+class OrderRollupTests(TestCase):
+	def setUp(self):
+		User = get_user_model()
+		self.user = User.objects.create_user(username='rollup', email='rollup@example.com', password='pass12345')
+		owner = User.objects.create_user(username='rollowner', email='rollowner@example.com', password='pass12345')
+		self.shop = Shop.objects.create(owner=owner, name='Shop', city='Tunis')
+
+	def _rows(self):
+		return {
+			(r.shop_id, r.status, r.payment_method): (r.order_count, r.revenue)
+			for r in OrderDailyStat.objects.filter(order_count__gt=0)
+		}
+
+	def test_created_and_transitioned_orders_move_between_rows(self):
+		order = Order.objects.create(user=self.user, shop=self.shop, total_price='10.00', payment_method='cash')
+		Order.objects.create(user=self.user, total_price='5.50')
+		self.assertEqual(self._rows(), {
+			(self.shop.id, 'pending', 'cash'): (1, Decimal('10.00')),
+			(0, 'pending', ''): (1, Decimal('5.50')),
+		})
+		order.status = 'paid'
+		order.total_price = Decimal('12.00')
+		order.save()
+		self.assertEqual(self._rows(), {
+			(self.shop.id, 'paid', 'cash'): (1, Decimal('12.00')),
+			(0, 'pending', ''): (1, Decimal('5.50')),
+		})
+		order.delete()
+		self.assertEqual(self._rows(), {(0, 'pending', ''): (1, Decimal('5.50'))})
+
+	def test_rollup_write_is_rolled_back_with_the_order(self):
+		order = Order.objects.create(user=self.user, total_price='10.00')
+		try:
+			with transaction.atomic():
+				order.status = 'paid'
+				order.save()
+				raise RuntimeError
+		except RuntimeError:
+			pass
+		self.assertEqual(self._rows(), {(0, 'pending', ''): (1, Decimal('10.00'))})
+
+	def test_backfill_matches_incremental_rows(self):
+		for status, price in (('pending', '1.00'), ('paid', '2.00'), ('paid', '3.00')):
+			Order.objects.create(user=self.user, shop=self.shop, status=status, total_price=price)
+		incremental = self._rows()
+		OrderDailyStat.objects.all().delete()
+		out = io.StringIO()
+		call_command('backfill_order_stats', stdout=out)
+		self.assertIn('Rebuilt 2', out.getvalue())
+		self.assertEqual(self._rows(), incremental)
+		self.assertEqual(incremental[(self.shop.id, 'paid', '')], (2, Decimal('5.00')))
+
+	def test_admin_stats_come_from_rollups(self):
+		admin = get_user_model().objects.create_superuser(username='rolladmin', email='rolladmin@example.com', password='pass12345')
+		Order.objects.create(user=self.user, total_price='10.00')
+		Order.objects.create(user=self.user, status='delivered', total_price='4.00')
+		# Orders written behind save()'s back do not show up: stats are not read from orders_order
+		Order.objects.filter(status='delivered').update(total_price='100.00')
+		client = APIClient()
+		client.force_authenticate(user=admin)
+		resp = client.get('/api/orders/admin/')
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual(resp.data['stats'], {
+			'total_orders': 2,
+			'total_revenue': 14.0,
+			'orders_last_30d': 2,
+			'revenue_last_30d': 14.0,
+			'status_breakdown': {'pending': 1, 'delivered': 1},
+		})
+		summary = rollups.summary(since=timezone.localdate() + timedelta(days=1))
+		self.assertEqual((summary['orders'], summary['orders_since']), (2, 0))
+
+
+class OrderExportTests(TestCase):
+	def setUp(self):
+		User = get_user_model()
+		self.customer = User.objects.create_user(username='exportbuyer', email='exportbuyer@example.com', password='pass12345')
+		self.owner = User.objects.create_user(username='exportowner', email='exportowner@example.com', password='pass12345', role='shop_owner')
+		rival = User.objects.create_user(username='rival', email='rival@example.com', password='pass12345', role='shop_owner')
+		self.shop = Shop.objects.create(owner=self.owner, name='Shop', city='Tunis')
+		self.rival_shop = Shop.objects.create(owner=rival, name='Rival', city='Sfax')
+		self.product = Product.objects.create(name='Café', price='3.00', stock=100, shop=self.shop)
+		for shop, status in ((self.shop, 'paid'), (self.shop, 'pending'), (self.rival_shop, 'paid')):
+			order = Order.objects.create(user=self.customer, shop=shop, status=status, total_price='6.00')
+			OrderItem.objects.create(order=order, product=self.product, quantity=2, price='3.00')
+		self.client = APIClient()
+
+	def _get(self, user, url):
+		self.client.force_authenticate(user=user)
+		resp = self.client.get(url)
+		body = b''.join(resp.streaming_content).decode('utf-8') if resp.status_code == 200 else None
+		return resp, body
+
+	def test_admin_csv_export_has_one_line_per_item(self):
+		admin = get_user_model().objects.create_superuser(username='exportadmin', email='exportadmin@example.com', password='pass12345')
+		resp, body = self._get(admin, '/api/orders/admin/export/')
+		self.assertEqual(resp.status_code, 200)
+		self.assertTrue(resp['Content-Type'].startswith('text/csv'))
+		self.assertIn('attachment;', resp['Content-Disposition'])
+		lines = body.splitlines()
+		self.assertEqual(lines[0].split(',')[:3], ['order_id', 'created_at', 'status'])
+		self.assertEqual(len(lines), 4)
+		self.assertIn('Café', lines[1])
+		resp, body = self._get(admin, f'/api/orders/admin/export/?shop={self.rival_shop.id}&status=paid')
+		self.assertEqual(len(body.splitlines()), 2)
+
+	def test_csv_cells_cannot_run_as_formulas(self):
+		order = Order.objects.filter(shop=self.shop, status='paid').get()
+		order.shipping_address = '=HYPERLINK("http://evil.example","x")'
+		order.save(update_fields=['shipping_address'])
+		order.items.update(product_name='@SUM(A1:A9)')
+		self.customer.first_name = '+cmd'
+		self.customer.save()
+		rows = list(csv.DictReader(io.StringIO(''.join(export.stream(Order.objects.filter(pk=order.pk), 'csv')))))
+		self.assertEqual(rows[0]['shipping_address'], '\'=HYPERLINK("http://evil.example","x")')
+		self.assertEqual(rows[0]['product_name'], "'@SUM(A1:A9)")
+		self.assertEqual(rows[0]['customer_name'], "'+cmd")
+		self.assertEqual(rows[0]['total_price'], '6.00')
+		# JSONL keeps the raw values
+		line = json.loads(next(export.stream(Order.objects.filter(pk=order.pk), 'jsonl')))
+		self.assertEqual(line['shipping_address'], order.shipping_address)
+
+	def test_shop_owner_jsonl_export_is_limited_to_own_shops(self):
+		resp, body = self._get(self.owner, '/api/orders/shop-owner/export/?output_format=jsonl&status=paid')
+		self.assertEqual(resp.status_code, 200)
+		orders = [json.loads(line) for line in body.splitlines()]
+		self.assertEqual([(o['shop_id'], o['status']) for o in orders], [(self.shop.id, 'paid')])
+		self.assertEqual(orders[0]['items'][0]['subtotal'], '6.00')
+		resp, _ = self._get(self.owner, f'/api/orders/shop-owner/export/?shop={self.rival_shop.id}')
+		self.assertEqual(resp.status_code, 404)
+		resp, _ = self._get(self.customer, '/api/orders/shop-owner/export/')
+		self.assertEqual(resp.status_code, 403)
+		resp, _ = self._get(self.owner, '/api/orders/shop-owner/export/?output_format=xml')
+		self.assertEqual(resp.status_code, 400)
+
+	def test_orders_are_read_in_fixed_size_chunks(self):
+		for _ in range(3):
+			Order.objects.create(user=self.customer, shop=self.shop, total_price='1.00')
+		with CaptureQueriesContext(connection) as ctx:
+			lines = list(export.stream(Order.objects.all(), 'jsonl', chunk_size=2))
+		self.assertEqual(len(lines), 6)
+		# Three chunks of orders (with user / shop joined) + their items, then one empty chunk
+		self.assertEqual(len(ctx.captured_queries), 7)
+		self.assertEqual([json.loads(line)['order_id'] for line in lines], sorted(Order.objects.values_list('id', flat=True)))
+
+
+class BulkOrderStatusTests(TestCase):
+	def setUp(self):
+		User = get_user_model()
+		self.admin = User.objects.create_superuser(username='bulkadmin', email='bulkadmin@example.com', password='pass12345')
+		self.customer = User.objects.create_user(username='bulkbuyer', email='bulkbuyer@example.com', password='pass12345')
+		self.client = APIClient()
+		self.client.force_authenticate(user=self.admin)
+
+	def _orders(self, count, status='paid'):
+		return [Order.objects.create(user=self.customer, status=status, total_price='5.00') for _ in range(count)]
+
+	def _post(self, payload):
+		return self.client.post('/api/orders/admin/bulk-status/', payload, format='json')
+
+	def test_query_count_does_not_depend_on_batch_size(self):
+		few = [o.id for o in self._orders(1)]
+		many = [o.id for o in self._orders(40)]
+		with CaptureQueriesContext(connection) as small:
+			self.assertEqual(self._post({'order_ids': few, 'status': 'shipped'}).status_code, 200)
+		with CaptureQueriesContext(connection) as large:
+			resp = self._post({'order_ids': many, 'status': 'shipped'})
+		self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+		self.assertEqual(resp.data['updated'], many)
+		self.assertEqual(Order.objects.filter(status='shipped').count(), 41)
+		history = OrderStatusHistory.objects.filter(order_id=many[0]).values_list('from_status', 'to_status')
+		self.assertEqual(list(history), [('paid', 'shipped')])
+		self.assertEqual(rollups.summary()['status_breakdown'], {'shipped': 41})
+
+	def test_rejections_are_reported_per_order(self):
+		paid, = self._orders(1)
+		shipped, = self._orders(1, status='shipped')
+		cancelled, = self._orders(1, status='cancelled')
+		resp = self._post({'order_ids': [paid.id, shipped.id, cancelled.id, 999999, paid.id], 'status': 'shipped'})
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual(resp.data['updated'], [paid.id])
+		self.assertEqual(resp.data['rejected'], {
+			str(shipped.id): 'already_in_status',
+			str(cancelled.id): 'final_status:cancelled',
+			'999999': 'not_found',
+		})
+		cancelled.refresh_from_db()
+		self.assertEqual(cancelled.status, 'cancelled')
+
+	def test_invalid_requests(self):
+		self.assertEqual(self._post({'order_ids': [1], 'status': 'lost'}).status_code, 400)
+		self.assertEqual(self._post({'order_ids': 'abc', 'status': 'shipped'}).status_code, 400)
+		self.assertEqual(self._post({'order_ids': ['x'], 'status': 'shipped'}).status_code, 400)
+		self.client.force_authenticate(user=self.customer)
+		self.assertEqual(self._post({'order_ids': [1], 'status': 'shipped'}).status_code, 403)
+
+
+class OutboxTests(TestCase):
+	def setUp(self):
+		self.user = get_user_model().objects.create_user(username='outbox', email='outbox@example.com', password='pass12345')
+		self.calls = []
+
+	def _register(self, topic, fail=False):
+		def func(payload, event):
+			self.calls.append((event.topic, payload))
+			if fail:
+				raise RuntimeError('boom')
+		outbox.handler(topic)(func)
+		self.addCleanup(outbox._handlers[topic].remove, func)
+
+	def test_order_events_are_written_with_the_order(self):
+		order = Order.objects.create(user=self.user, total_price='10.00')
+		order.status = 'paid'
+		order.save()
+		events = list(OutboxEvent.objects.order_by('id').values_list('topic', 'payload'))
+		self.assertEqual(events, [
+			('order.created', {'order_id': order.id, 'user_id': self.user.id, 'shop_id': None, 'parent_id': None, 'status': 'pending', 'total_price': '10.00'}),
+			('order.status_changed', {'order_id': order.id, 'from': 'pending', 'to': 'paid'}),
+		])
+		try:
+			with transaction.atomic():
+				Order.objects.create(user=self.user, total_price='1.00')
+				raise RuntimeError
+		except RuntimeError:
+			pass
+		self.assertEqual(OutboxEvent.objects.count(), 2)
+
+	def test_worker_dispatches_claimed_events(self):
+		self._register('test.ok')
+		outbox.publish('test.ok', {'n': 1})
+		outbox.publish('test.ok', {'n': 2}, delay=3600)
+		out = io.StringIO()
+		call_command('run_outbox_worker', '--once', stdout=out)
+		self.assertIn('Dispatched 1 events, 0 failed', out.getvalue())
+		self.assertEqual(self.calls, [('test.ok', {'n': 1})])
+		done = OutboxEvent.objects.get(payload={'n': 1})
+		self.assertEqual((done.status, done.attempts, done.locked_until), ('done', 1, None))
+		self.assertIsNotNone(done.processed_at)
+
+	def test_leased_events_are_not_claimed_twice(self):
+		outbox.publish('test.lease', {})
+		self.assertEqual(len(outbox.claim(worker='a')), 1)
+		self.assertEqual(outbox.claim(worker='b'), [])
+		OutboxEvent.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+		self.assertEqual([e.locked_by for e in outbox.claim(worker='b')], ['b'])
+
+	@override_settings(OUTBOX_MAX_ATTEMPTS=2, OUTBOX_BACKOFF_SECONDS=10)
+	def test_failures_back_off_then_give_up(self):
+		self._register('test.fail', fail=True)
+		event = outbox.publish('test.fail', {})
+		before = timezone.now()
+		with self.assertLogs('shopnow.outbox', 'WARNING'):
+			self.assertEqual(outbox.run_once(), (0, 1))
+		event.refresh_from_db()
+		self.assertEqual((event.status, event.attempts), ('pending', 1))
+		self.assertIn('RuntimeError: boom', event.last_error)
+		self.assertGreaterEqual(event.available_at, before + timedelta(seconds=10))
+		# Not due yet
+		self.assertEqual(outbox.run_once(), (0, 0))
+		OutboxEvent.objects.update(available_at=timezone.now())
+		with self.assertLogs('shopnow.outbox', 'WARNING') as logs:
+			self.assertEqual(outbox.run_once(), (0, 1))
+		self.assertIn('giving up', logs.output[0])
+		event.refresh_from_db()
+		self.assertEqual((event.status, event.attempts), ('failed', 2))
+		self.assertEqual(outbox.backoff(3), timedelta(seconds=40))
+
+	def test_unknown_topic_is_retried(self):
+		outbox.publish('test.nobody', {})
+		with self.assertLogs('shopnow.outbox', 'WARNING'):
+			self.assertEqual(outbox.run_once(), (0, 1))
+		self.assertIn('No outbox handler', OutboxEvent.objects.get().last_error)
+
+
+class OrderQueryPlanTests(TestCase):
+	"""The hot order / credit / delivery queries must not fall back to full table scans."""
+	TABLES = ['orders_order', 'orders_delivery']
+
+	@classmethod
+	def setUpTestData(cls):
+		User = get_user_model()
+		cls.owner = User.objects.create_user(username='planowner', email='planowner@example.com', password='pass12345', role='shop_owner')
+		cls.admin = User.objects.create_superuser(username='planadmin', email='planadmin@example.com', password='pass12345')
+		customers = [
+			User.objects.create_user(username=f'plan{i}', email=f'plan{i}@example.com', password='pass12345')
+			for i in range(20)
+		]
+		cls.customer = customers[0]
+		shops = [Shop.objects.create(owner=cls.owner if i == 0 else cls.admin, name=f'Shop {i}', city='Tunis') for i in range(10)]
+		statuses = [code for code, _ in Order.STATUS_CHOICES]
+		credit = ['none', 'requested', 'approved', 'rejected']
+		today = timezone.localdate()
+		orders = []
+		for i in range(600):
+			is_credit = i % 3 == 0
+			orders.append(Order(
+				user=customers[i % len(customers)], shop=shops[i % len(shops)], status=statuses[i % len(statuses)],
+				total_price='10.00', payment_method='credit' if is_credit else 'card',
+				credit_status=credit[i % len(credit)] if is_credit else 'none',
+				payment_due_date=today + timedelta(days=i % 30) if is_credit else None,
+			))
+		Order.objects.bulk_create(orders)
+		# Re-read: MySQL does not return the ids of bulk-created rows
+		orders = list(Order.objects.order_by('pk'))
+		# Some multi-shop checkouts: the customer's parents and their per-shop sub-orders
+		for order in orders[:100:20]:
+			order.has_sub_orders = True
+			order.shop = None
+		Order.objects.bulk_update(orders[:100:20], ['has_sub_orders', 'shop'])
+		Order.objects.bulk_create([
+			Order(user=parent.user, parent=parent, shop=shop, total_price='5.00')
+			for parent in orders[:100:20] for shop in shops[:2]
+		])
+		Delivery.objects.bulk_create([
+			Delivery(
+				order_id=str(order.pk), user_id=order.user_id, delivery_address='Rue', delivery_city='Tunis',
+				delivery_postal_code='1000', phone_number='12345678', tracking_number=f'TRK{order.pk}',
+				status=['pending', 'in_transit', 'delivered'][order.pk % 3],
+			) for order in orders
+		])
+		query_plans.analyze(cls.TABLES)
+
+	def _assert_indexed(self, user, url):
+		client = APIClient()
+		client.force_authenticate(user=user)
+		with CaptureQueriesContext(connection) as ctx:
+			resp = client.get(url)
+		self.assertEqual(resp.status_code, 200, url)
+		checked = 0
+		for query in ctx.captured_queries:
+			sql = query['sql']
+			if not sql.startswith('SELECT') or 'orders_order' not in sql:
+				continue
+			checked += 1
+			self.assertEqual(query_plans.full_scans(sql, self.TABLES), [], f'{url}: {sql}')
+		self.assertTrue(checked, f'{url} did not query orders_order')
+
+	def test_customer_order_history(self):
+		self._assert_indexed(self.customer, '/api/orders/')
+		self._assert_indexed(self.customer, '/api/orders/?status=paid,shipped&date_from=2020-01-01&ordering=created_at')
+
+	def test_customer_credits(self):
+		self._assert_indexed(self.customer, '/api/orders/my-credits/')
+		self._assert_indexed(self.customer, '/api/orders/my-credits/?upcoming=true')
+
+	def test_shop_owner_views(self):
+		for url in (
+			'/api/orders/shop-owner/',
+			'/api/orders/shop-owner/?credit=1',
+			'/api/orders/shop-owner/?exclude_credit=1',
+			'/api/orders/shop-owner/credit-stats/',
+			'/api/orders/shop-owner/credits-by-user/',
+		):
+			self._assert_indexed(self.owner, url)
+
+	def test_admin_order_listing(self):
+		self._assert_indexed(self.admin, '/api/orders/admin/')
+		self._assert_indexed(self.admin, '/api/orders/admin/?status=shipped')
+
+	def test_delivery_lookups(self):
+		for qs in (
+			Delivery.objects.filter(order_id='42'),
+			Delivery.objects.filter(status='in_transit').order_by('-created_at')[:50],
+		):
+			sql, params = qs.query.sql_with_params()
+			self.assertEqual(query_plans.full_scans(sql, self.TABLES, params), [], sql)
+
+	def test_pending_order_sweep(self):
+		qs = cancellation.expirable(max_age=timedelta(0))[:500]
+		sql, params = qs.query.sql_with_params()
+		self.assertEqual(query_plans.full_scans(sql, self.TABLES, params), [], sql)
+
+
+class OrderItemSnapshotTests(TestCase):
+	def setUp(self):
+		User = get_user_model()
+		self.user = User.objects.create_user(username='snap', email='snap@example.com', password='pass12345')
+		owner = User.objects.create_user(username='snapowner', email='snapowner@example.com', password='pass12345')
+		self.shop = Shop.objects.create(owner=owner, name='Shop', city='Tunis')
+		self.product = Product.objects.create(
+			name='Harissa', price='4.00', stock=10, shop=self.shop, image='https://img.example.com/h.png',
+		)
+		self.client = APIClient()
+		self.client.force_authenticate(user=self.user)
+
+	def test_history_keeps_the_name_at_purchase_time_without_joining_products(self):
+		payload = {'orderItems': [{'product': self.product.id, 'quantity': 1, 'price': '4.00'}], 'shippingAddress': 'x', 'totalPrice': '4.00'}
+		self.assertEqual(self.client.post('/api/orders/', payload, format='json').status_code, 201)
+		item = OrderItem.objects.get()
+		self.assertEqual((item.product_name, item.product_image, item.shop_id), ('Harissa', self.product.image, self.shop.id))
+		self.product.name = 'Harissa Extra'
+		self.product.save()
+		with CaptureQueriesContext(connection) as ctx:
+			resp = self.client.get('/api/orders/')
+		line = resp.data['orders'][0]['items'][0]
+		self.assertEqual((line['product_name'], line['product_image'], line['shop_id']), ('Harissa', self.product.image, self.shop.id))
+		self.assertFalse([q for q in ctx.captured_queries if 'products_product' in q['sql']])
+
+	def test_backfill_command_fills_missing_snapshots(self):
+		order = Order.objects.create(user=self.user, total_price='8.00')
+		OrderItem.objects.create(order=order, product=self.product, quantity=2, price='4.00')
+		OrderItem.objects.update(product_name='', product_image=None, shop=None)
+		out = io.StringIO()
+		call_command('backfill_order_item_snapshots', '--batch-size', '1', stdout=out)
+		self.assertIn('Snapshotted 1 order items', out.getvalue())
+		item = OrderItem.objects.get()
+		self.assertEqual((item.product_name, item.product_image, item.shop_id), ('Harissa', self.product.image, self.shop.id))
+
+
+class MultiShopOrderTests(TestCase):
+	def setUp(self):
+		User = get_user_model()
+		self.customer = User.objects.create_user(username='multi', email='multi@example.com', password='pass12345')
+		self.owner_a = User.objects.create_user(username='ownera', email='ownera@example.com', password='pass12345', role='shop_owner')
+		self.owner_b = User.objects.create_user(username='ownerb', email='ownerb@example.com', password='pass12345', role='shop_owner')
+		self.shop_a = Shop.objects.create(owner=self.owner_a, name='A', city='Tunis')
+		self.shop_b = Shop.objects.create(owner=self.owner_b, name='B', city='Sousse')
+		self.apple = Product.objects.create(name='Pomme', price='2.00', stock=10, shop=self.shop_a)
+		self.pear = Product.objects.create(name='Poire', price='3.00', stock=10, shop=self.shop_a)
+		self.olive = Product.objects.create(name='Olive', price='5.00', stock=10, shop=self.shop_b)
+		self.client = APIClient()
+
+	def _checkout(self, products, **extra):
+		self.client.force_authenticate(user=self.customer)
+		payload = {
+			'orderItems': [{'product': p.id, 'quantity': 1, 'price': str(p.price)} for p in products],
+			'shippingAddress': 'Tunis', 'totalPrice': '0', **extra,
+		}
+		return self.client.post('/api/orders/', payload, format='json')
+
+	def test_multi_shop_cart_is_split_per_shop(self):
+		resp = self._checkout([self.apple, self.olive, self.pear])
+		self.assertEqual(resp.status_code, 201, resp.data)
+		parent = Order.objects.get(pk=resp.data['order']['id'])
+		self.assertTrue(parent.has_sub_orders)
+		self.assertEqual((parent.shop_id, parent.total_price, parent.items.count()), (None, Decimal('10.00'), 0))
+		subs = {sub.shop_id: sub for sub in parent.sub_orders.all()}
+		self.assertEqual(subs[self.shop_a.id].total_price, Decimal('5.00'))
+		self.assertEqual(subs[self.shop_b.id].total_price, Decimal('5.00'))
+		self.assertEqual(subs[self.shop_a.id].items.count(), 2)
+		self.assertEqual(len(resp.data['order']['sub_orders']), 2)
+		self.assertEqual({line['order_id'] for line in resp.data['order']['items']}, {sub.id for sub in subs.values()})
+		# Shops see their own sub-order; the customer sees one order with every item
+		self.client.force_authenticate(user=self.owner_b)
+		owner_orders = self.client.get('/api/orders/shop-owner/').data['orders']
+		self.assertEqual([(o['id'], o['parent_id']) for o in owner_orders], [(subs[self.shop_b.id].id, parent.id)])
+		self.client.force_authenticate(user=self.customer)
+		history = self.client.get('/api/orders/').data['orders']
+		self.assertEqual([o['id'] for o in history], [parent.id])
+		self.assertEqual(len(history[0]['items']), 3)
+		# Revenue is counted once, per shop
+		self.assertEqual(rollups.summary()['revenue'], Decimal('10.00'))
+		self.assertEqual(rollups.summary(shop_id=self.shop_a.id)['revenue'], Decimal('5.00'))
+
+	def test_single_shop_cart_is_not_split(self):
+		resp = self._checkout([self.apple, self.pear])
+		order = Order.objects.get(pk=resp.data['order']['id'])
+		self.assertEqual((order.shop_id, order.has_sub_orders, order.items.count()), (self.shop_a.id, False, 2))
+		self.assertEqual(resp.data['order']['sub_orders'], [])
+
+	def test_credit_is_requested_per_shop(self):
+		resp = self._checkout([self.apple, self.olive], paymentMethod='credit')
+		self.assertEqual(resp.status_code, 201, resp.data)
+		parent = Order.objects.get(pk=resp.data['order']['id'])
+		self.assertEqual(parent.credit_status, 'none')
+		self.assertEqual(sorted(parent.sub_orders.values_list('credit_status', flat=True)), ['requested', 'requested'])
+		credits = self.client.get('/api/orders/my-credits/').data['credits']
+		self.assertEqual(len(credits), 2)
+
+	def test_cancelling_the_parent_cancels_unshipped_sub_orders(self):
+		parent_id = self._checkout([self.apple, self.olive]).data['order']['id']
+		resp = self.client.patch(f'/api/orders/{parent_id}/', {'action': 'cancel'}, format='json')
+		self.assertEqual(resp.status_code, 200, resp.data)
+		self.assertEqual(set(Order.objects.values_list('status', flat=True)), {'cancelled'})
+		parent_id = self._checkout([self.apple, self.olive]).data['order']['id']
+		Order.objects.filter(parent_id=parent_id, shop=self.shop_b).update(status='shipped')
+		resp = self.client.patch(f'/api/orders/{parent_id}/', {'action': 'cancel'}, format='json')
+		self.assertEqual(resp.status_code, 400)
+
+	def test_parent_status_follows_sub_orders(self):
+		parent_id = self._checkout([self.apple, self.olive]).data['order']['id']
+		sub_a, sub_b = Order.objects.filter(parent_id=parent_id).order_by('shop_id')
+		sub_a.status = 'shipped'
+		sub_a.save(update_fields=['status'])
+		# As far along as the slowest shop
+		self.assertEqual(Order.objects.get(pk=parent_id).status, 'pending')
+		sub_b.status = 'delivered'
+		sub_b.save(update_fields=['status'])
+		self.assertEqual(Order.objects.get(pk=parent_id).status, 'shipped')
+		sub_a.status = 'delivered'
+		sub_a.save(update_fields=['status'])
+		history = self.client.get('/api/orders/').data['orders']
+		self.assertEqual([(o['id'], o['status']) for o in history], [(parent_id, 'delivered')])
+		parent_history = OrderStatusHistory.objects.filter(order_id=parent_id).order_by('id').values_list('from_status', 'to_status')
+		self.assertEqual(list(parent_history), [('pending', 'shipped'), ('shipped', 'delivered')])
+
+	def test_admins_move_sub_orders_not_the_parent(self):
+		parent_id = self._checkout([self.apple, self.olive]).data['order']['id']
+		sub_ids = list(Order.objects.filter(parent_id=parent_id).order_by('pk').values_list('pk', flat=True))
+		admin = get_user_model().objects.create_superuser(username='multiadmin', email='multiadmin@example.com', password='pass12345')
+		self.client.force_authenticate(user=admin)
+		resp = self.client.patch('/api/orders/admin/', {'order_id': parent_id, 'status': 'cancelled'}, format='json')
+		self.assertEqual(resp.status_code, 400)
+		resp = self.client.post('/api/orders/admin/bulk-status/', {'order_ids': [parent_id], 'status': 'cancelled'}, format='json')
+		self.assertEqual(resp.data['rejected'], {str(parent_id): 'multi_shop_order'})
+		resp = self.client.post('/api/orders/admin/bulk-status/', {'order_ids': sub_ids, 'status': 'cancelled'}, format='json')
+		self.assertEqual(resp.data['updated'], sub_ids)
+		self.assertEqual(Order.objects.get(pk=parent_id).status, 'cancelled')
+		self.assertEqual(dict(Product.objects.values_list('name', 'stock')), {'Pomme': 10, 'Poire': 10, 'Olive': 10})
+
+
+class PendingOrderExpiryTests(TestCase):
+	def setUp(self):
+		User = get_user_model()
+		self.customer = User.objects.create_user(username='expiry', email='expiry@example.com', password='pass12345')
+		owner = User.objects.create_user(username='expiryowner', email='expiryowner@example.com', password='pass12345', role='shop_owner')
+		other = User.objects.create_user(username='expiryother', email='expiryother@example.com', password='pass12345', role='shop_owner')
+		self.shop = Shop.objects.create(owner=owner, name='Expiry', city='Tunis')
+		self.other_shop = Shop.objects.create(owner=other, name='Other', city='Sfax')
+		self.apple = Product.objects.create(name='Pomme', price='2.00', stock=1, shop=self.shop)
+		self.pear = Product.objects.create(name='Poire', price='3.00', stock=10, shop=self.shop)
+		self.olive = Product.objects.create(name='Olive', price='5.00', stock=10, shop=self.other_shop)
+		self.client = APIClient()
+		self.client.force_authenticate(user=self.customer)
+
+	def _checkout(self, products, age_minutes=0, **extra):
+		payload = {
+			'orderItems': [{'product': p.id, 'quantity': 1, 'price': str(p.price)} for p in products],
+			'shippingAddress': 'Tunis', 'totalPrice': '0', **extra,
+		}
+		resp = self.client.post('/api/orders/', payload, format='json')
+		self.assertEqual(resp.status_code, 201, resp.data)
+		order_id = resp.data['order']['id']
+		created_at = timezone.now() - timedelta(minutes=age_minutes)
+		Order.objects.filter(Q(pk=order_id) | Q(parent_id=order_id)).update(created_at=created_at)
+		return order_id
+
+	def test_abandoned_orders_are_cancelled_and_restocked(self):
+		abandoned = self._checkout([self.apple, self.olive], age_minutes=120, paymentMethod='d17')
+		self.apple.refresh_from_db()
+		self.assertEqual((self.apple.stock, self.apple.status), (0, 'unavailable'))
+		kept = [
+			self._checkout([self.pear], age_minutes=120, paymentMethod='stripe', paymentIntentId='pi_123'),
+			self._checkout([self.pear], age_minutes=120, paymentMethod='cash_on_delivery'),
+			self._checkout([self.pear], age_minutes=120, paymentMethod='credit'),
+			self._checkout([self.pear], age_minutes=5, paymentMethod='d17'),
+		]
+		out = io.StringIO()
+		call_command('expire_pending_orders', stdout=out)
+		# Both sub-orders of the abandoned cart; their parent follows them
+		self.assertIn('Cancelled 2 expired pending orders', out.getvalue())
+		statuses = dict(Order.objects.filter(Q(pk=abandoned) | Q(parent_id=abandoned)).values_list('pk', 'status'))
+		self.assertEqual(set(statuses.values()), {'cancelled'})
+		self.assertEqual(set(Order.objects.filter(pk__in=kept).values_list('status', flat=True)), {'pending'})
+		history = OrderStatusHistory.objects.filter(order_id__in=statuses).values_list('from_status', 'to_status')
+		self.assertEqual(list(history), [('pending', 'cancelled')] * 3)
+		stock = {p.pk: (p.stock, p.status) for p in Product.objects.all()}
+		self.assertEqual(stock[self.apple.pk], (1, 'available'))
+		self.assertEqual(stock[self.olive.pk], (10, 'available'))
+		self.assertEqual(stock[self.pear.pk], (6, 'available'))
+		self.assertEqual(rollups.summary()['status_breakdown'], {'cancelled': 2, 'pending': 4})
+		# Nothing left to expire
+		self.assertEqual(cancellation.expire_pending(), 0)
+
+	def test_query_count_does_not_depend_on_chunk_size(self):
+		def abandon(count):
+			old = timezone.now() - timedelta(hours=2)
+			orders = [Order.objects.create(user=self.customer, total_price='3.00', payment_method='d17') for _ in range(count)]
+			for order in orders:
+				OrderItem.objects.create(order=order, product=self.pear, quantity=1, price='3.00')
+			Order.objects.filter(pk__in=[o.pk for o in orders]).update(created_at=old)
+
+		abandon(1)
+		with CaptureQueriesContext(connection) as small:
+			self.assertEqual(cancellation.expire_pending(batch_size=50), 1)
+		abandon(20)
+		with CaptureQueriesContext(connection) as large:
+			self.assertEqual(cancellation.expire_pending(batch_size=50), 20)
+		self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+		self.pear.refresh_from_db()
+		self.assertEqual(self.pear.stock, 10 + 21)
+
+	def test_cancelled_orders_give_their_stock_back(self):
+		order_id = self._checkout([self.apple], paymentMethod='cash_on_delivery')
+		resp = self.client.patch(f'/api/orders/{order_id}/', {'action': 'cancel'}, format='json')
+		self.assertEqual(resp.status_code, 200, resp.data)
+		self.apple.refresh_from_db()
+		self.assertEqual((self.apple.stock, self.apple.status), (1, 'available'))
+		# Bulk cancellation by an admin restocks too; shipped orders keep their stock out
+		pending = self._checkout([self.apple, self.pear], paymentMethod='cash_on_delivery')
+		shipped = self._checkout([self.pear], paymentMethod='cash_on_delivery')
+		Order.objects.filter(pk=shipped).update(status='shipped')
+		admin = get_user_model().objects.create_superuser(username='expiryadmin', email='expiryadmin@example.com', password='pass12345')
+		self.client.force_authenticate(user=admin)
+		resp = self.client.post('/api/orders/admin/bulk-status/', {'order_ids': [pending, shipped], 'status': 'cancelled'}, format='json')
+		self.assertEqual(resp.data['updated'], [pending, shipped])
+		stock = dict(Product.objects.values_list('pk', 'stock'))
+		self.assertEqual((stock[self.apple.pk], stock[self.pear.pk]), (1, 9))
+
+	def test_stock_goes_back_once_per_order(self):
+		self.pear.stock = 5
+		self.pear.save()
+		order_id = self._checkout([self.pear, self.pear], paymentMethod='cash_on_delivery')
+		# Customer cancel racing the sweeper / an admin: both loaded the order pending
+		customer_copy, admin_copy = Order.objects.get(pk=order_id), Order.objects.get(pk=order_id)
+		customer_copy.status = 'cancelled'
+		customer_copy.save(update_fields=['status'])
+		admin_copy.status = 'cancelled'
+		admin_copy.save(update_fields=['status'])
+		self.pear.refresh_from_db()
+		self.assertEqual(self.pear.stock, 5)
+		self.assertEqual(OrderStatusHistory.objects.filter(order_id=order_id, to_status='cancelled').count(), 1)
+		self.assertEqual(rollups.summary()['status_breakdown'], {'cancelled': 1})
+		# Reopening would re-sell units that went back on the shelf
+		admin = get_user_model().objects.create_superuser(username='reopenadmin', email='reopenadmin@example.com', password='pass12345')
+		self.client.force_authenticate(user=admin)
+		resp = self.client.patch('/api/orders/admin/', {'order_id': order_id, 'status': 'pending'}, format='json')
+		self.assertEqual(resp.status_code, 400)
+		self.assertIn('annulée', resp.data['error'])
+		stale = Order.objects.get(pk=order_id)
+		Order.objects.filter(pk=order_id).update(status='cancelled')
+		stale.status = 'processing'
+		with self.assertRaises(OrderReopenError), transaction.atomic():
+			stale.save()
+		resp = self.client.patch('/api/orders/admin/', {'order_id': order_id, 'status': 'cancelled'}, format='json')
+		self.assertEqual(resp.data['message'], 'No change')
+		self.pear.refresh_from_db()
+		self.assertEqual(self.pear.stock, 5)
+		self.assertEqual(Order.objects.get(pk=order_id).status, 'cancelled')
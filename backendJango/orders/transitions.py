@@ -0,0 +1,140 @@
+"""Bulk order status transitions.
+
+Moving N orders to a new status costs a fixed number of queries: one
+``SELECT ... FOR UPDATE`` validating every id, one UPDATE of the accepted
+orders, one ``bulk_create`` of their ``OrderStatusHistory`` rows, one of their
+``order.status_changed`` outbox events (shopnow.outbox), plus the daily
+statistics (orders.rollups), which ``QuerySet.update`` does not
+maintain by itself. Cancelled orders give their stock back
+(orders.cancellation).
+
+A multi-shop order's status is derived from its sub-orders
+(:func:`sync_parents`, also run when a single sub-order is saved): it is not
+moved directly, each shop moves its own sub-order.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+
+from shopnow import outbox
+from . import cancellation, rollups
+from .models import Order, OrderStatusHistory
+
+MAX_BULK_ORDERS = 1000
+# Orders in these states are not moved in bulk (use the single-order endpoint)
+FINAL_STATUSES = ('delivered', 'cancelled')
+# A multi-shop order is as far along as its slowest shop
+PROGRESS = {'pending': 0, 'paid': 1, 'processing': 2, 'shipped': 3, 'delivered': 4}
+
+
+def parse_ids(raw):
+    """Deduplicated int ids, in request order; raises ValueError."""
+    if not isinstance(raw, list) or not raw:
+        raise ValueError('order_ids must be a non-empty list')
+    if len(raw) > MAX_BULK_ORDERS:
+        raise ValueError(f'At most {MAX_BULK_ORDERS} orders per request')
+    ids = []
+    for value in raw:
+        try:
+            order_id = int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f'Invalid order id: {value!r}')
+        if order_id not in ids:
+            ids.append(order_id)
+    return ids
+
+
+def rejection(order, new_status):
+    """Why ``order`` (a values() row) cannot move to ``new_status``, or None."""
+    if order is None:
+        return 'not_found'
+    if order['has_sub_orders']:
+        return 'multi_shop_order'
+    if order['status'] == new_status:
+        return 'already_in_status'
+    if order['status'] in FINAL_STATUSES:
+        return f"final_status:{order['status']}"
+    return None
+
+
+@transaction.atomic
+def bulk_transition(order_ids, new_status):
+    """Move ``order_ids`` to ``new_status``; returns ``(updated ids, {id: reason})``."""
+    rows = (
+        Order.objects.select_for_update().filter(pk__in=order_ids).order_by('pk')
+        .values('pk', 'has_sub_orders', 'parent_id', *rollups.KEY_FIELDS)
+    )
+    found = {row['pk']: row for row in rows}
+    accepted, rejected = [], {}
+    for order_id in order_ids:
+        reason = rejection(found.get(order_id), new_status)
+        if reason:
+            rejected[order_id] = reason
+        else:
+            accepted.append(found[order_id])
+    if not accepted:
+        return [], rejected
+
+    ids = [row['pk'] for row in accepted]
+    Order.objects.filter(pk__in=ids).update(status=new_status, updated_at=timezone.now())
+    OrderStatusHistory.objects.bulk_create([
+        OrderStatusHistory(order_id=row['pk'], from_status=row['status'], to_status=new_status)
+        for row in accepted
+    ])
+    outbox.publish_many('order.status_changed', [
+        {'order_id': row['pk'], 'from': row['status'], 'to': new_status} for row in accepted
+    ])
+    rollups.apply(rollups.merge(
+        rollups.transition_deltas(row, dict(row, status=new_status)) for row in accepted if not row['has_sub_orders']
+    ))
+    if new_status == 'cancelled':
+        cancellation.restock([row['pk'] for row in accepted if row['status'] in cancellation.RESTOCKABLE_STATUSES])
+    sync_parents(row['parent_id'] for row in accepted if row['parent_id'])
+    return ids, rejected
+
+
+def parent_status(statuses):
+    """Status of a multi-shop order from its sub-orders' statuses."""
+    live = [status for status in statuses if status != 'cancelled']
+    if not live:
+        return 'cancelled'
+    return min(live, key=lambda status: PROGRESS.get(status, 0))
+
+
+def sync_parents(parent_ids):
+    """Move multi-shop orders to the status derived from their sub-orders; returns the ids moved.
+
+    Call inside the transaction that changed the sub-orders (they are locked
+    before their parent, like every writer of sub-orders does).
+    """
+    parent_ids = sorted(set(parent_ids))
+    if not parent_ids:
+        return []
+    parents = dict(
+        Order.objects.select_for_update().filter(pk__in=parent_ids, has_sub_orders=True)
+        .order_by('pk').values_list('pk', 'status')
+    )
+    statuses = defaultdict(list)
+    for parent_id, status in Order.objects.filter(parent_id__in=list(parents)).values_list('parent_id', 'status'):
+        statuses[parent_id].append(status)
+    moves = {
+        pk: (old, parent_status(statuses[pk])) for pk, old in parents.items()
+        if statuses[pk] and parent_status(statuses[pk]) != old
+    }
+    if not moves:
+        return []
+    by_status = defaultdict(list)
+    for pk, (_, new) in moves.items():
+        by_status[new].append(pk)
+    now = timezone.now()
+    for new, ids in sorted(by_status.items()):
+        Order.objects.filter(pk__in=ids).update(status=new, updated_at=now)
+    OrderStatusHistory.objects.bulk_create([
+        OrderStatusHistory(order_id=pk, from_status=old, to_status=new) for pk, (old, new) in moves.items()
+    ])
+    outbox.publish_many('order.status_changed', [
+        {'order_id': pk, 'from': old, 'to': new} for pk, (old, new) in moves.items()
+    ])
+    # Parents are not counted in the rollups and carry no items: nothing else to maintain
+    return sorted(moves)
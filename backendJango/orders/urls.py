@@ -1,5 +1,7 @@
 from django.urls import path
 from .views import OrdersView, OrderDetailView, AdminOrdersView, CreditOrderDecisionView, ShopOwnerOrdersView
+from .views import StockReservationView, StockAvailabilityView, AdminOrdersExportView, ShopOwnerOrdersExportView
+from .views import AdminBulkOrderStatusView
 from .credit_views import MarkCreditAsPaidView, CreditStatsView, CreditsByUserView, MyCreditsView
 from .delivery_views import DeliveryCalculatorView, DeliveryTrackingView, DeliveryMapView
 
@@ -9,6 +11,14 @@ urlpatterns = [
     path('admin/', AdminOrdersView.as_view(), name='admin-orders'),
     path('credit/decision/', CreditOrderDecisionView.as_view(), name='credit-order-decision'),
     path('shop-owner/', ShopOwnerOrdersView.as_view(), name='shop-owner-orders'),
+    path('admin/bulk-status/', AdminBulkOrderStatusView.as_view(), name='admin-orders-bulk-status'),
+    path('admin/export/', AdminOrdersExportView.as_view(), name='admin-orders-export'),
+    path('shop-owner/export/', ShopOwnerOrdersExportView.as_view(), name='shop-owner-orders-export'),
+
+    # Checkout stock reservations
+    path('reservations/', StockReservationView.as_view(), name='stock-reservations'),
+    path('reservations/<uuid:token>/', StockReservationView.as_view(), name='stock-reservation-detail'),
+    path('availability/', StockAvailabilityView.as_view(), name='stock-availability'),
     
     # Credit management endpoints
     path('credit/mark-paid/', MarkCreditAsPaidView.as_view(), name='mark-credit-paid'),
@@ -1,27 +1,60 @@
 
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
 from rest_framework import status
 from django.utils import timezone
 from django.db import transaction
-from django.db.models import Count, Sum, F
+from django.http import StreamingHttpResponse
+from django.db.models import Count, Sum, F, Prefetch, prefetch_related_objects
 from django.utils.timezone import now, timedelta
 from products.models import Product
-from .models import Order, OrderItem
+from .models import Order, OrderItem, OrderReopenError
+from . import export, placement, reservations, rollups, transitions
+from .pagination import OrderHistoryPagination
+from shopnow.idempotency import idempotent
 from shops.models import Shop
 from django.utils.timezone import now as tz_now
 import logging
 
 logger = logging.getLogger(__name__)
 
+def sub_order_data(sub):
+    """Summary of a per-shop sub-order of a multi-shop order."""
+    return {
+        'id': sub.id,
+        'shop_id': sub.shop_id,
+        'status': sub.status,
+        'credit_status': sub.credit_status,
+        'total_price': str(sub.total_price),
+    }
+
+
 class OrdersView(APIView):
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
-        orders = Order.objects.filter(user=request.user).prefetch_related('items__product', 'shop')
+        """Order history, newest first, cursor paginated (?cursor, ?page_size, ?ordering=created_at).
+
+        Filters: ?status=pending,paid and ?date_from / ?date_to (YYYY-MM-DD, inclusive).
+        Costs three queries per page whatever the number of orders.
+        """
+        try:
+            # Sub-orders are listed inside their parent
+            orders = export.filter_orders(Order.objects.filter(user=request.user, parent__isnull=True), request.query_params)
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        # Items render from their product snapshot: no join with the catalog
+        orders = orders.select_related('user', 'shop__owner').prefetch_related('items', 'status_history')
+        paginator = OrderHistoryPagination()
+        page = paginator.paginate_queryset(orders, request, view=self)
+        # Sub-orders (and their items) only for the multi-shop orders of the page
+        prefetch_related_objects(
+            [o for o in page if o.has_sub_orders],
+            Prefetch('sub_orders', queryset=Order.objects.order_by('id')), 'sub_orders__items',
+        )
         data = []
-        for o in orders:
+        for o in page:
             data.append({
                 'id': o.id,
                 'status': o.status,
@@ -49,13 +82,15 @@ class OrdersView(APIView):
                 'items': [
                     {
                         'product_id': it.product_id,
-                        'product_name': it.product.name,
+                        'product_name': it.product_name,
+                        'product_image': it.product_image,
+                        'shop_id': it.shop_id,
                         'quantity': it.quantity,
                         'price': str(it.price),
                         'subtotal': str(it.subtotal),
-                        'remaining_stock': it.product.stock,
-                    } for it in o.items.all()
+                    } for it in o.line_items()
                 ],
+                'sub_orders': [sub_order_data(sub) for sub in o.sub_orders.all()] if o.has_sub_orders else [],
                 'status_history': [
                     {
                         'from': h.from_status,
@@ -64,8 +99,9 @@ class OrdersView(APIView):
                     } for h in o.status_history.all()
                 ]
             })
-        return Response({'orders': data})
+        return paginator.get_paginated_response(data)
     
+    @idempotent('orders.create')
     def post(self, request):
         data = request.data
         required_fields = ['orderItems', 'shippingAddress', 'totalPrice']
@@ -78,27 +114,20 @@ class OrdersView(APIView):
             return Response({'error': 'orderItems empty'}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
+            lines = placement.parse_lines(items_payload)
+            # Checkout started with POST /api/orders/reservations/: its holds become the order lines
+            reservation = data.get('reservationToken')
+            if reservation:
+                reservation = reservations.check_token(reservation, request.user)
             with transaction.atomic():
                 payment_method = data.get('paymentMethod', '') or ''
                 is_credit = payment_method == 'credit'
-                # Collect distinct shops for credit validation
-                distinct_shops = set()
-                temp_lines = []
-                for line in items_payload:
-                    product_id = line.get('product') or line.get('product_id')
-                    quantity = int(line.get('quantity') or 0)
-                    if quantity <= 0:
-                        raise ValueError('Invalid quantity')
-                    product = Product.objects.get(id=product_id)
-                    temp_lines.append((product, quantity, line.get('price')))
-                    if product.shop_id:
-                        distinct_shops.add(product.shop_id)
-                order_shop = None
-                if len(distinct_shops) == 1:
-                    # Un seul shop: on peut l'affecter à la commande
-                    order_shop = Shop.objects.get(id=list(distinct_shops)[0])
-                if is_credit and len(distinct_shops) != 1:
-                    return Response({'error': "Le paiement à crédit n'est possible que si tous les produits proviennent du même shop."}, status=status.HTTP_400_BAD_REQUEST)
+                # One query for the whole cart (locked and ordered by id with the pessimistic engine)
+                engine = placement.get_engine()
+                products = engine.load(lines)
+                # Le crédit est approuvé par le shop de chaque (sous-)commande
+                if is_credit and any(not p.shop_id for p in products.values()):
+                    return Response({'error': "Le paiement à crédit n'est possible que pour des produits vendus par un shop."}, status=status.HTTP_400_BAD_REQUEST)
                 
                 # Pour crédit: récupérer la date de paiement prévue
                 payment_due_date = None
@@ -111,7 +140,7 @@ class OrdersView(APIView):
                         except ValueError:
                             return Response({'error': 'Format de date invalide pour paymentDueDate (YYYY-MM-DD)'}, status=status.HTTP_400_BAD_REQUEST)
                 
-                order = Order.objects.create(
+                order = Order(
                     user=request.user,
                     status='pending',
                     shipping_address=data.get('shippingAddress', ''),
@@ -119,35 +148,25 @@ class OrdersView(APIView):
                     payment_method=payment_method,
                     payment_intent_id=data.get('paymentIntentId', ''),
                     credit_status='requested' if is_credit else 'none',
-                    shop=order_shop,
                     payment_due_date=payment_due_date,
                 )
-
-                line_results = []
-                for product, quantity, price in temp_lines:
-                    product = Product.objects.select_for_update().get(id=product.id)
-                    if quantity > product.stock:
-                        raise ValueError(f'Stock insuffisant pour le produit {product.name}')
-                    product.stock -= quantity
-                    if product.stock == 0:
-                        product.status = 'unavailable'
-                    product.save(update_fields=['stock', 'status'])
-                    item = OrderItem.objects.create(
-                        order=order,
-                        product=product,
-                        quantity=quantity,
-                        price=price,
-                    )
-                    line_results.append({
-                        'product_id': product.id,
-                        'product_name': product.name,
-                        'quantity': quantity,
+                # Stock check, stock decrement and lines in bulk; total computed in the same pass.
+                # A multi-shop cart is split into one sub-order per shop (orders.placement)
+                items = engine.place(order, lines, products, reservation=reservation)
+                if reservation:
+                    reservations.release(reservation, request.user)
+                sub_orders = list({item.order.pk: item.order for item in items if item.order is not order}.values())
+                line_results = [
+                    {
+                        'product_id': item.product_id,
+                        'product_name': item.product.name,
+                        'order_id': item.order.pk,
+                        'quantity': item.quantity,
                         'price': str(item.price),
                         'subtotal': str(item.subtotal),
-                        'remaining_stock': product.stock,
-                    })
-
-                order.recalc_total()
+                        'remaining_stock': item.product.stock,
+                    } for item in items
+                ]
 
         except Product.DoesNotExist:
             return Response({'error': 'Produit introuvable'}, status=status.HTTP_400_BAD_REQUEST)
@@ -175,22 +194,69 @@ class OrdersView(APIView):
                 'payment_due_date': order.payment_due_date.isoformat() if order.payment_due_date else None,
                 'shipping_address': order.shipping_address,
                 'items': line_results,
-                'status_history': [
-                    {
-                        'from': h.from_status,
-                        'to': h.to_status,
-                        'changed_at': h.changed_at.isoformat(),
-                    } for h in order.status_history.all()
-                ],
+                'sub_orders': [sub_order_data(sub) for sub in sub_orders],
+                # A new order has no status change yet
+                'status_history': [],
             }
         }, status=status.HTTP_201_CREATED)
 
 
+class StockReservationView(APIView):
+    """Hold the cart's stock while the customer pays (TTL: STOCK_RESERVATION_TTL_SECONDS)."""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        items_payload = request.data.get('orderItems') or []
+        if not items_payload:
+            return Response({'error': 'orderItems empty'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            token, expires_at = reservations.reserve(request.user, placement.parse_lines(items_payload))
+        except Product.DoesNotExist:
+            return Response({'error': 'Produit introuvable'}, status=status.HTTP_400_BAD_REQUEST)
+        except ValueError as ve:
+            return Response({'error': str(ve)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'reservation': {
+                'token': str(token),
+                'expires_at': expires_at.isoformat(),
+                'ttl_seconds': int(reservations.ttl().total_seconds()),
+            }
+        }, status=status.HTTP_201_CREATED)
+
+    def delete(self, request, token):
+        reservations.release(token, request.user)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class StockAvailabilityView(APIView):
+    """Available stock (stock minus other checkouts' holds) for ?products=1,2,3, in one query."""
+    permission_classes = [AllowAny]
+    max_products = 100
+
+    def get(self, request):
+        try:
+            ids = [int(v) for v in request.query_params.get('products', '').split(',') if v.strip()]
+        except ValueError:
+            return Response({'error': 'products must be a comma separated list of ids'}, status=status.HTTP_400_BAD_REQUEST)
+        if not ids or len(ids) > self.max_products:
+            return Response({'error': f'Between 1 and {self.max_products} products'}, status=status.HTTP_400_BAD_REQUEST)
+        rows = (
+            reservations.with_available_stock(Product.objects.filter(pk__in=ids))
+            .values_list('pk', 'stock', 'available_stock').order_by('pk')
+        )
+        return Response({'availability': [
+            {'product_id': pk, 'stock': stock, 'available_stock': max(available, 0)}
+            for pk, stock, available in rows
+        ]})
+
+
 class OrderDetailView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get_object(self, user, pk):
-        return Order.objects.filter(user=user).prefetch_related('items__product', 'status_history').get(pk=pk)
+        return Order.objects.filter(user=user).prefetch_related(
+            'items__product', 'status_history', 'sub_orders__items__product',
+        ).get(pk=pk)
 
     def get(self, request, pk):
         try:
@@ -205,13 +271,14 @@ class OrderDetailView(APIView):
             'items': [
                 {
                     'product_id': it.product_id,
-                    'product_name': it.product.name,
+                    'product_name': it.product_name,
                     'quantity': it.quantity,
                     'price': str(it.price),
                     'subtotal': str(it.subtotal),
                     'remaining_stock': it.product.stock,
-                } for it in order.items.all()
+                } for it in order.line_items()
             ],
+            'sub_orders': [sub_order_data(sub) for sub in order.sub_orders.all()],
             'status_history': [
                 {
                     'from': h.from_status,
@@ -231,9 +298,18 @@ class OrderDetailView(APIView):
             return Response({'error': 'Order not found'}, status=status.HTTP_404_NOT_FOUND)
 
         if action == 'cancel':
-            if order.status in ['pending', 'processing']:
-                order.status = 'cancelled'
-                order.save(update_fields=['status'])
+            cancellable = ['pending', 'processing']
+            # Ordered by id: sub-orders are always locked in the same order, before their parent
+            sub_orders = sorted(order.sub_orders.all(), key=lambda sub: sub.pk)
+            if order.status in cancellable and all(sub.status in cancellable + ['cancelled'] for sub in sub_orders):
+                with transaction.atomic():
+                    # Cancelling a multi-shop order cancels what its shops have not shipped yet
+                    for sub in sub_orders:
+                        if sub.status != 'cancelled':
+                            sub.status = 'cancelled'
+                            sub.save(update_fields=['status'])
+                    order.status = 'cancelled'
+                    order.save(update_fields=['status'])
                 # Return full refreshed order representation
                 order.refresh_from_db()
                 data = {
@@ -245,13 +321,14 @@ class OrderDetailView(APIView):
                     'items': [
                         {
                             'product_id': it.product_id,
-                            'product_name': it.product.name,
+                            'product_name': it.product_name,
                             'quantity': it.quantity,
                             'price': str(it.price),
                             'subtotal': str(it.subtotal),
                             'remaining_stock': it.product.stock,
-                        } for it in order.items.all()
+                        } for it in order.line_items()
                     ],
+                    'sub_orders': [sub_order_data(sub) for sub in order.sub_orders.all()],
                     'status_history': [
                         {
                             'from': h.from_status,
@@ -273,7 +350,7 @@ class AdminOrdersView(APIView):
     def get(self, request):
         # Optional filters
         status_filter = request.query_params.get('status')
-        qs = Order.objects.all().prefetch_related('items__product', 'status_history', 'user')
+        qs = Order.objects.all().prefetch_related('items', 'status_history', 'user')
         if status_filter and status_filter != 'all':
             qs = qs.filter(status=status_filter)
 
@@ -290,10 +367,13 @@ class AdminOrdersView(APIView):
                 'customer_email': o.user.email,
                 'shipping_address': o.shipping_address,
                 'shop_id': o.shop_id,
+                'parent_id': o.parent_id,
+                'has_sub_orders': o.has_sub_orders,
                 'items': [
                     {
                         'product_id': it.product_id,
-                        'product_name': it.product.name,
+                        'product_name': it.product_name,
+                        'product_image': it.product_image,
                         'quantity': it.quantity,
                         'price': str(it.price),
                         'subtotal': str(it.subtotal),
@@ -308,22 +388,14 @@ class AdminOrdersView(APIView):
                 ]
             })
 
-        # Stats section
-        total_orders = Order.objects.count()
-        total_revenue = Order.objects.aggregate(s=Sum('total_price'))['s'] or 0
-        status_counts = Order.objects.values('status').annotate(c=Count('id'))
-        status_map = {row['status']: row['c'] for row in status_counts}
-
-        last_30 = now() - timedelta(days=30)
-        revenue_30 = Order.objects.filter(created_at__gte=last_30).aggregate(s=Sum('total_price'))['s'] or 0
-        orders_30 = Order.objects.filter(created_at__gte=last_30).count()
-
+        # Stats section, summed from the daily rollup rows (orders.rollups)
+        totals = rollups.summary(since=rollups.window_start(30))
         stats = {
-            'total_orders': total_orders,
-            'total_revenue': float(total_revenue),
-            'orders_last_30d': orders_30,
-            'revenue_last_30d': float(revenue_30),
-            'status_breakdown': status_map,
+            'total_orders': totals['orders'],
+            'total_revenue': float(totals['revenue']),
+            'orders_last_30d': totals['orders_since'],
+            'revenue_last_30d': float(totals['revenue_since']),
+            'status_breakdown': totals['status_breakdown'],
         }
 
         return Response({'orders': orders_data, 'stats': stats})
@@ -339,14 +411,44 @@ class AdminOrdersView(APIView):
             return Response({'error': 'Order not found'}, status=status.HTTP_404_NOT_FOUND)
         if new_status not in dict(Order.STATUS_CHOICES):
             return Response({'error': 'Invalid status'}, status=status.HTTP_400_BAD_REQUEST)
+        if order.has_sub_orders:
+            # Its status follows the sub-orders (orders.transitions.sync_parents)
+            return Response({'error': 'Multi-shop order: change the status of its sub-orders'}, status=status.HTTP_400_BAD_REQUEST)
         old = order.status
         if old == new_status:
             return Response({'message': 'No change', 'order_id': order.id})
         order.status = new_status
-        order.save(update_fields=['status'])
+        try:
+            order.save(update_fields=['status'])
+        except OrderReopenError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
         return Response({'message': 'updated', 'order_id': order.id, 'status': order.status})
 
 
+class AdminBulkOrderStatusView(APIView):
+    """Move many orders to one status: {"order_ids": [...], "status": "shipped"}.
+
+    Every id is validated with one query; accepted orders are updated together
+    and refused ones are reported in ``rejected`` ({id: reason}).
+    """
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def post(self, request):
+        new_status = request.data.get('status')
+        if new_status not in dict(Order.STATUS_CHOICES):
+            return Response({'error': 'Invalid status'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            order_ids = transitions.parse_ids(request.data.get('order_ids'))
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        updated, rejected = transitions.bulk_transition(order_ids, new_status)
+        return Response({
+            'status': new_status,
+            'updated': updated,
+            'rejected': {str(order_id): reason for order_id, reason in rejected.items()},
+        })
+
+
 class CreditOrderDecisionView(APIView):
     """Shop owner ou admin peut approuver / rejeter une demande de crédit."""
     permission_classes = [IsAuthenticated]
@@ -388,7 +490,10 @@ class CreditOrderDecisionView(APIView):
         order.credit_decision_at = tz_now()
         order.credit_decision_by = request.user
         order.credit_note = note
-        order.save(update_fields=['credit_status', 'credit_decision_at', 'credit_decision_by', 'credit_note', 'status'])
+        try:
+            order.save(update_fields=['credit_status', 'credit_decision_at', 'credit_decision_by', 'credit_note', 'status'])
+        except OrderReopenError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
         return Response({
             'order_id': order.id,
             'credit_status': order.credit_status,
@@ -408,7 +513,7 @@ class ShopOwnerOrdersView(APIView):
         # Shops de l'utilisateur
         from shops.models import Shop
         shop_ids = list(Shop.objects.filter(owner=request.user).values_list('id', flat=True))
-        qs = Order.objects.filter(shop_id__in=shop_ids).prefetch_related('items__product', 'status_history', 'user', 'shop')
+        qs = Order.objects.filter(shop_id__in=shop_ids).prefetch_related('items', 'status_history', 'user', 'shop')
         
         credit_only = request.query_params.get('credit') == '1'
         exclude_credit = request.query_params.get('exclude_credit') == '1'
@@ -442,11 +547,13 @@ class ShopOwnerOrdersView(APIView):
                 'customer_email': o.user.email,
                 'shop_id': o.shop_id,
                 'shop_name': o.shop.name if o.shop else None,
+                'parent_id': o.parent_id,
                 'payment_due_date': o.payment_due_date.isoformat() if o.payment_due_date else None,
                 'items': [
                     {
                         'product_id': it.product_id,
-                        'product_name': it.product.name,
+                        'product_name': it.product_name,
+                        'product_image': it.product_image,
                         'quantity': it.quantity,
                         'price': str(it.price),
                         'subtotal': str(it.subtotal),
@@ -461,3 +568,49 @@ class ShopOwnerOrdersView(APIView):
                 ]
             })
         return Response({'orders': data})
+
+
+def _export_response(request, queryset):
+    fmt = request.query_params.get('output_format', 'csv')
+    if fmt not in export.FORMATS:
+        return Response({'error': 'output_format must be csv or jsonl'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        queryset = export.filter_orders(queryset, request.query_params)
+    except ValueError as exc:
+        return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    response = StreamingHttpResponse(export.stream(queryset, fmt), content_type=export.CONTENT_TYPES[fmt])
+    response['Content-Disposition'] = f'attachment; filename="orders-{tz_now():%Y%m%d}.{fmt}"'
+    return response
+
+
+class AdminOrdersExportView(APIView):
+    """Full order history with items, streamed as CSV / JSONL (no row cap).
+
+    ?output_format=csv|jsonl, ?status=a,b, ?date_from / ?date_to (YYYY-MM-DD), ?shop=<id>.
+    """
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def get(self, request):
+        qs = Order.objects.all()
+        shop_id = request.query_params.get('shop')
+        if shop_id:
+            if not shop_id.isdigit():
+                return Response({'error': 'Shop introuvable'}, status=status.HTTP_404_NOT_FOUND)
+            qs = qs.filter(shop_id=shop_id)
+        return _export_response(request, qs)
+
+
+class ShopOwnerOrdersExportView(APIView):
+    """Export des commandes des shops du propriétaire (mêmes paramètres que l'export admin)."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        if not (request.user.is_staff or getattr(request.user, 'role', '') == 'shop_owner'):
+            return Response({'error': 'Permission refusée'}, status=status.HTTP_403_FORBIDDEN)
+        shop_ids = list(Shop.objects.filter(owner=request.user).values_list('id', flat=True))
+        shop_id = request.query_params.get('shop')
+        if shop_id:
+            if not shop_id.isdigit() or int(shop_id) not in shop_ids:
+                return Response({'error': 'Shop introuvable'}, status=status.HTTP_404_NOT_FOUND)
+            shop_ids = [int(shop_id)]
+        return _export_response(request, Order.objects.filter(shop_id__in=shop_ids))
@@ -1,3 +1,19 @@
 from django.test import TestCase
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
 
-# Create your tests here.
+
+class D17PaymentIdempotencyTests(TestCase):
+	def setUp(self):
+		self.user = get_user_model().objects.create_user(username='payer', email='payer@example.com', password='pass12345')
+		self.client = APIClient()
+		self.client.force_authenticate(user=self.user)
+
+	def test_retry_with_same_key_is_replayed(self):
+		body = {'amount': '25.00', 'phone_number': '+21620000000'}
+		first = self.client.post('/api/payments/create-d17-payment/', body, format='json', HTTP_IDEMPOTENCY_KEY='pay-1')
+		retry = self.client.post('/api/payments/create-d17-payment/', body, format='json', HTTP_IDEMPOTENCY_KEY='pay-1')
+		self.assertEqual(first.status_code, 200)
+		self.assertEqual(retry.content, first.content)
+		self.assertEqual(retry['Idempotent-Replayed'], 'true')
+		self.assertFalse(first.has_header('Idempotent-Replayed'))
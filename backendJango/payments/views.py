@@ -11,6 +11,7 @@ import json
 import logging
 import os
 from dotenv import load_dotenv
+from shopnow.idempotency import HEADER as IDEMPOTENCY_HEADER, idempotent
 
 # Charger les variables d'environnement
 load_dotenv()
@@ -22,6 +23,7 @@ stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent('payments.stripe_intent')
 def create_payment_intent(request):
     """
     Créer un PaymentIntent Stripe pour le processus de paiement
@@ -46,7 +48,10 @@ def create_payment_intent(request):
             metadata={
                 'user_id': request.user.id,
                 'user_email': request.user.email,
-            }
+            },
+            # Stripe deduplicates on its side too when the client sent a key
+            **({'idempotency_key': f"{request.user.id}:{request.headers[IDEMPOTENCY_HEADER]}"}
+               if request.headers.get(IDEMPOTENCY_HEADER) else {})
         )
         
         return Response({
@@ -68,6 +73,7 @@ def create_payment_intent(request):
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent('payments.d17')
 def create_d17_payment(request):
     """
     Créer une transaction d17 pour les clients tunisiens
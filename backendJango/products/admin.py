@@ -10,7 +10,7 @@ class CategoryAdmin(admin.ModelAdmin):
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-	list_display = ("id", "name", "shop", "category", "price", "stock", "status")
+	list_display = ("id", "name", "shop", "category", "price", "stock", "status", "rating_avg", "rating_count")
 	list_filter = ("status", "category", "shop")
 	search_fields = ("name", "description")
 	autocomplete_fields = ("shop", "category")
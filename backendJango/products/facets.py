@@ -0,0 +1,155 @@
+"""Faceted catalog filtering.
+
+All facet counts come from a single grouped query over
+(category, shop city, price bucket, status). Each facet is then counted
+in Python with every *other* selected filter applied, so picking a
+category still shows how many products the sibling categories hold.
+"""
+from collections import Counter
+from decimal import Decimal
+
+from django.db.models import Case, CharField, Count, Q, Value, When
+
+from categories.models import Category
+
+# (key, lower bound inclusive, upper bound exclusive)
+PRICE_BUCKETS = [
+    ('0-20', Decimal('0'), Decimal('20')),
+    ('20-50', Decimal('20'), Decimal('50')),
+    ('50-100', Decimal('50'), Decimal('100')),
+    ('100-200', Decimal('100'), Decimal('200')),
+    ('200+', Decimal('200'), None),
+]
+BUCKET_KEYS = {key for key, _, _ in PRICE_BUCKETS}
+FACETS = ('category', 'city', 'price', 'status')
+# Facet -> field name in the grouped rows
+_ROW_FIELDS = {
+    'category': 'category_id',
+    'city': 'shop__city',
+    'price': 'price_bucket',
+    'status': 'status',
+}
+
+
+def _split(value):
+    return [v.strip() for v in (value or '').split(',') if v.strip()]
+
+
+def parse_selection(params):
+    """Read ?category=1,2&city=Tunis&price=20-50&status=available into sets."""
+    selected = {}
+    categories = set()
+    for raw in _split(params.get('category')):
+        try:
+            categories.add(int(raw))
+        except ValueError:
+            continue
+    if categories:
+        selected['category'] = categories
+    cities = {c.lower() for c in _split(params.get('city'))}
+    if cities:
+        selected['city'] = cities
+    buckets = {key for key in _split(params.get('price')) if key in BUCKET_KEYS}
+    if buckets:
+        selected['price'] = buckets
+    statuses = set(_split(params.get('status')))
+    if statuses:
+        selected['status'] = statuses
+    return selected
+
+
+def price_bucket_expression():
+    whens = []
+    for key, low, high in PRICE_BUCKETS:
+        condition = Q(price__gte=low)
+        if high is not None:
+            condition &= Q(price__lt=high)
+        whens.append(When(condition, then=Value(key)))
+    return Case(*whens, default=Value(PRICE_BUCKETS[-1][0]), output_field=CharField())
+
+
+def _bucket_q(key):
+    for bucket_key, low, high in PRICE_BUCKETS:
+        if bucket_key == key:
+            q = Q(price__gte=low)
+            if high is not None:
+                q &= Q(price__lt=high)
+            return q
+    return Q(pk__in=[])
+
+
+def apply_selection(queryset, selected):
+    if 'category' in selected:
+        queryset = queryset.filter(category_id__in=selected['category'])
+    if 'city' in selected:
+        city_q = Q()
+        for city in selected['city']:
+            city_q |= Q(shop__city__iexact=city)
+        queryset = queryset.filter(city_q)
+    if 'price' in selected:
+        price_q = Q()
+        for key in selected['price']:
+            price_q |= _bucket_q(key)
+        queryset = queryset.filter(price_q)
+    if 'status' in selected:
+        queryset = queryset.filter(status__in=selected['status'])
+    return queryset
+
+
+def _matches(row, facet, values):
+    value = row[_ROW_FIELDS[facet]]
+    if facet == 'city':
+        return (value or '').lower() in values
+    return value in values
+
+
+def facet_counts(queryset, selected):
+    """Count products per facet value from one grouped aggregate over ``queryset``."""
+    rows = list(
+        queryset.annotate(price_bucket=price_bucket_expression())
+        .values(*_ROW_FIELDS.values())
+        .annotate(n=Count('pk'))
+        .order_by()
+    )
+    counters = {facet: Counter() for facet in FACETS}
+    for row in rows:
+        for facet in FACETS:
+            others = all(
+                _matches(row, other, values)
+                for other, values in selected.items() if other != facet
+            )
+            if others:
+                counters[facet][row[_ROW_FIELDS[facet]]] += row['n']
+
+    category_ids = [cid for cid in counters['category'] if cid is not None]
+    names = dict(Category.objects.filter(pk__in=category_ids).values_list('pk', 'name'))
+    return {
+        'category': sorted(
+            (
+                {'id': cid, 'name': names.get(cid), 'count': n, 'selected': cid in selected.get('category', ())}
+                for cid, n in counters['category'].items() if cid is not None
+            ),
+            key=lambda item: (-item['count'], item['name'] or ''),
+        ),
+        'city': sorted(
+            (
+                {'value': city, 'count': n, 'selected': city.lower() in selected.get('city', ())}
+                for city, n in counters['city'].items() if city
+            ),
+            key=lambda item: (-item['count'], item['value']),
+        ),
+        'price': [
+            {
+                'key': key,
+                'min': str(low),
+                'max': str(high) if high is not None else None,
+                'count': counters['price'].get(key, 0),
+                'selected': key in selected.get('price', ()),
+            }
+            for key, low, high in PRICE_BUCKETS
+        ],
+        'status': [
+            {'value': value, 'count': n, 'selected': value in selected.get('status', ())}
+            for value, n in sorted(counters['status'].items())
+        ],
+    }
@@ -0,0 +1,179 @@
+"""Streaming bulk product import (CSV or JSONL) with upsert by shop-scoped SKU.
+
+Rows are read lazily from the stream and processed in fixed-size chunks:
+each chunk is validated, matched against existing SKUs with one query and
+written with ``bulk_create`` / ``bulk_update``. Memory use therefore depends
+on the chunk size, not on the file size. Only the first ``MAX_REPORTED_ERRORS``
+row errors are kept in the report (the total is always counted). An upload
+that is not valid UTF-8 stops at the first bad byte with a row error.
+"""
+import codecs
+import csv
+import io
+import json
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from categories.models import Category
+from categories.serializers import normalize_name
+from shopnow import response_cache
+from . import search, stock_shards
+from .models import Product
+
+DEFAULT_CHUNK_SIZE = 500
+MAX_REPORTED_ERRORS = 1000
+FORMATS = ('csv', 'jsonl')
+# Columns written on update (created_at / shop / sku never change)
+UPDATE_FIELDS = ['name', 'description', 'price', 'stock', 'status', 'image', 'category', 'updated_at']
+
+
+class ProductImportRowSerializer(serializers.Serializer):
+    sku = serializers.CharField(max_length=64)
+    name = serializers.CharField(max_length=255)
+    description = serializers.CharField(required=False, allow_blank=True, default='')
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal('0'))
+    stock = serializers.IntegerField(min_value=0, required=False, default=0)
+    status = serializers.ChoiceField(choices=Product.STATUS_CHOICES, required=False, default='available')
+    image = serializers.URLField(required=False, allow_blank=True, allow_null=True, default=None)
+    category = serializers.CharField(required=False, allow_blank=True, default='')
+
+
+def detect_format(filename='', content_type=''):
+    name = (filename or '').lower()
+    if name.endswith(('.jsonl', '.ndjson')) or 'ndjson' in (content_type or '') or 'jsonl' in (content_type or ''):
+        return 'jsonl'
+    return 'csv'
+
+
+def iter_rows(stream, fmt):
+    """Yield dict rows from a binary stream without loading it in memory."""
+    text = codecs.getreader('utf-8-sig')(stream) if not isinstance(stream, io.TextIOBase) else stream
+    if fmt == 'csv':
+        for row in csv.DictReader(text):
+            yield {(k or '').strip(): (v.strip() if isinstance(v, str) else v) for k, v in row.items()}
+        return
+    for line in text:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield row if isinstance(row, dict) else {'__invalid__': line[:200]}
+
+
+def _chunks(rows, size):
+    chunk = []
+    for index, row in enumerate(rows, start=1):
+        chunk.append((index, row))
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class ProductImporter:
+    def __init__(self, shop, chunk_size=DEFAULT_CHUNK_SIZE, create_categories=True):
+        self.shop = shop
+        self.chunk_size = max(1, chunk_size)
+        self.create_categories = create_categories
+        # Normalized category name -> Category, resolved once for the whole job
+        self.categories = {normalize_name(c.name): c for c in Category.objects.only('id', 'name', 'updated_at')}
+        self.report = {'rows': 0, 'created': 0, 'updated': 0, 'error_count': 0, 'errors': []}
+
+    def _error(self, index, sku, errors):
+        self.report['error_count'] += 1
+        if len(self.report['errors']) < MAX_REPORTED_ERRORS:
+            self.report['errors'].append({'row': index, 'sku': sku, 'errors': errors})
+
+    def _category(self, name):
+        if not name:
+            return None
+        key = normalize_name(name)
+        category = self.categories.get(key)
+        if category is None and self.create_categories:
+            category = Category.objects.create(name=name.strip())
+            self.categories[key] = category
+        return category
+
+    def run(self, rows):
+        for chunk in _chunks(self._decoded(rows), self.chunk_size):
+            self._process_chunk(chunk)
+        return self.report
+
+    def _decoded(self, rows):
+        """Stop at the first undecodable byte and report it; rows read so far are still imported."""
+        index = 0
+        try:
+            for index, row in enumerate(rows, start=1):
+                yield row
+        except UnicodeDecodeError:
+            self._error(index + 1, None, {'non_field_errors': [
+                'File is not valid UTF-8: this row and the following ones were not imported'
+            ]})
+
+    def _process_chunk(self, chunk):
+        valid = {}
+        for index, row in chunk:
+            self.report['rows'] += 1
+            if '__invalid__' in row:
+                self._error(index, None, {'non_field_errors': ['Invalid JSON line']})
+                continue
+            serializer = ProductImportRowSerializer(data=row)
+            if not serializer.is_valid():
+                self._error(index, row.get('sku'), serializer.errors)
+                continue
+            data = serializer.validated_data
+            if data['category'] and self._category(data['category']) is None:
+                self._error(index, data['sku'], {'category': ['Unknown category']})
+                continue
+            # Last occurrence of a SKU inside a chunk wins
+            valid[data['sku']] = data
+        if not valid:
+            return
+
+        now = timezone.now()
+        with transaction.atomic():
+            existing = {
+                p.sku: p for p in Product.objects.filter(shop=self.shop, sku__in=list(valid))
+            }
+            to_create, to_update = [], []
+            for sku, data in valid.items():
+                product = existing.get(sku) or Product(shop=self.shop, sku=sku)
+                product.name = data['name']
+                product.description = data['description']
+                product.price = data['price']
+                product.stock = data['stock']
+                product.status = data['status']
+                product.image = data['image'] or None
+                product.category = self._category(data['category'])
+                product.updated_at = now
+                (to_update if product.pk else to_create).append(product)
+            if to_create:
+                Product.objects.bulk_create(to_create, batch_size=self.chunk_size)
+            if to_update:
+                Product.objects.bulk_update(to_update, UPDATE_FIELDS, batch_size=self.chunk_size)
+            # Some backends (MySQL) do not return ids from bulk_create
+            if to_create and to_create[0].pk is None:
+                ids = dict(Product.objects.filter(shop=self.shop, sku__in=[p.sku for p in to_create]).values_list('sku', 'pk'))
+                for product in to_create:
+                    product.pk = ids[product.sku]
+            for product in to_update:
+                if product.stock_shard_count:
+                    stock_shards.set_stock(product, product.stock)
+            # bulk writes bypass post_save: keep search index and response cache in sync
+            search.index_products(to_create + to_update)
+            response_cache.invalidate_products([p.pk for p in to_create + to_update], [self.shop.pk])
+        self.report['created'] += len(to_create)
+        self.report['updated'] += len(to_update)
+
+
+def import_products(stream, shop, fmt='csv', chunk_size=DEFAULT_CHUNK_SIZE):
+    if fmt not in FORMATS:
+        raise ValueError(f'Unsupported format {fmt!r} (expected one of {", ".join(FORMATS)})')
+    return ProductImporter(shop, chunk_size=chunk_size).run(iter_rows(stream, fmt))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from products import recommendations
+
+
+class Command(BaseCommand):
+    help = 'Build "frequently bought together" product recommendations from orders and wishlists'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true', help='Only fold in order lines / wishlist rows added since the last run (a full rebuild runs instead when one is due)')
+        parser.add_argument('--top-k', type=int, default=recommendations.DEFAULT_TOP_K, help='Neighbours kept per product')
+
+    def handle(self, *args, **options):
+        run = recommendations.build(incremental=options['incremental'], top_k=max(1, options['top_k']))
+        self.stdout.write(self.style.SUCCESS(
+            f'{run.mode} run: {run.products_updated} products updated in {run.duration_seconds:.2f}s'
+        ))
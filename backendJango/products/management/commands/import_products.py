@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from shops.models import Shop
+from products import importer
+
+
+class Command(BaseCommand):
+    help = 'Bulk upsert products of a shop from a CSV or JSONL file (matched by SKU)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV / JSONL file, or - for stdin')
+        parser.add_argument('--shop', type=int, required=True, help='Target shop ID')
+        parser.add_argument('--format', choices=importer.FORMATS, help='Input format (default: from file extension)')
+        parser.add_argument('--chunk-size', type=int, default=importer.DEFAULT_CHUNK_SIZE, help='Rows per batch')
+
+    def handle(self, *args, **options):
+        try:
+            shop = Shop.objects.get(pk=options['shop'])
+        except Shop.DoesNotExist:
+            raise CommandError(f"Shop {options['shop']} does not exist")
+        path = options['path']
+        fmt = options.get('format') or importer.detect_format(path)
+
+        if path == '-':
+            import sys
+            report = importer.import_products(sys.stdin.buffer, shop, fmt=fmt, chunk_size=options['chunk_size'])
+        else:
+            with open(path, 'rb') as stream:
+                report = importer.import_products(stream, shop, fmt=fmt, chunk_size=options['chunk_size'])
+
+        for error in report['errors']:
+            self.stdout.write(self.style.WARNING(f"  row {error['row']} ({error['sku']}): {error['errors']}"))
+        self.stdout.write(self.style.SUCCESS(
+            f"{report['rows']} rows: {report['created']} created, {report['updated']} updated, "
+            f"{report['error_count']} errors"
+        ))
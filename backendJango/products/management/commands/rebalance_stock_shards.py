@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from products import stock_shards
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Even out sharded product stock and refresh cached stock sums (optionally (re)shard products)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--product', type=int, action='append', dest='products', help='Product id (repeatable); default: every sharded product')
+        parser.add_argument('--shards', type=int, help='With --product: split stock over N shards (0 disables sharding)')
+
+    def handle(self, *args, **options):
+        product_ids = options['products']
+        shards = options['shards']
+        if shards is not None:
+            if not product_ids:
+                raise CommandError('--shards requires --product')
+            if not 0 <= shards <= 256:
+                raise CommandError('--shards must be between 0 and 256')
+            for product in Product.objects.filter(pk__in=product_ids):
+                try:
+                    stock_shards.configure(product, shards)
+                except ValueError as exc:
+                    raise CommandError(str(exc))
+                self.stdout.write(f'Product {product.pk}: {shards or "no"} stock shards')
+            return
+        total = stock_shards.rebalance(product_ids)
+        self.stdout.write(self.style.SUCCESS(f'Rebalanced stock shards of {total} products'))
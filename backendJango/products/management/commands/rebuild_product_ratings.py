@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Rebuild denormalized rating aggregates (sum, count, average, histogram) on products'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Products processed per grouped query')
+        parser.add_argument('--product', type=int, action='append', dest='products', help='Only rebuild this product id (repeatable)')
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+        ids_qs = Product.objects.order_by('pk').values_list('pk', flat=True)
+        if options.get('products'):
+            ids_qs = ids_qs.filter(pk__in=options['products'])
+
+        total = 0
+        last_id = 0
+        while True:
+            batch = list(ids_qs.filter(pk__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            Product.rebuild_ratings(batch)
+            total += len(batch)
+            last_id = batch[-1]
+            self.stdout.write(f'  {total} products rebuilt...')
+
+        self.stdout.write(self.style.SUCCESS(f'Rating aggregates rebuilt for {total} products'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from products import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the product full-text search index from scratch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help='Products indexed per batch')
+
+    def handle(self, *args, **options):
+        total = search.rebuild_index(chunk_size=max(1, options['chunk_size']))
+        self.stdout.write(self.style.SUCCESS(f'Search index rebuilt for {total} products'))
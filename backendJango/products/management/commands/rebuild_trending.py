@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from products import trending
+
+
+class Command(BaseCommand):
+    help = 'Recompute trending scores of every product from order history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Order lines read / products written per batch')
+
+    def handle(self, *args, **options):
+        total = trending.rebuild(chunk_size=max(1, options['chunk_size']))
+        self.stdout.write(self.style.SUCCESS(f'Trending scores rebuilt for {total} products'))
@@ -1,12 +1,19 @@
-from django.db import models
+from decimal import Decimal
+from django.db import models, transaction
+from django.db.models import Case, Count, F, FloatField, Value, When
+from django.db.models.functions import Cast
+from django.utils import timezone
+from shopnow.tracking import DirtyFieldsMixin
 
 
-class Product(models.Model):
+class Product(DirtyFieldsMixin, models.Model):
     STATUS_CHOICES = [
         ('available', 'Available'),
         ('unavailable', 'Unavailable'),
     ]
     name = models.CharField(max_length=255)
+    # Merchant reference, unique within a shop (used by bulk imports to upsert)
+    sku = models.CharField(max_length=64, null=True, blank=True)
     description = models.TextField(blank=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.PositiveIntegerField(default=0)
@@ -17,5 +24,179 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Denormalized review aggregates, maintained by reviews.signals
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_avg = models.DecimalField(max_digits=3, decimal_places=2, default=0)
+    rating_1_count = models.PositiveIntegerField(default=0)
+    rating_2_count = models.PositiveIntegerField(default=0)
+    rating_3_count = models.PositiveIntegerField(default=0)
+    rating_4_count = models.PositiveIntegerField(default=0)
+    rating_5_count = models.PositiveIntegerField(default=0)
+
+    # log2 of time-decayed sales rebased on products.trending.EPOCH (NULL: never sold).
+    # Decay scales every product by the same factor, so sorting on it never goes stale.
+    trending_score = models.FloatField(null=True, blank=True)
+    # Hot products only: number of ProductStockShard rows holding the stock (0: stock lives here).
+    # When sharded, ``stock`` is a cached sum refreshed by products.stock_shards.
+    stock_shard_count = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of the catalog listing (see products.pagination)
+            models.Index(fields=['created_at', 'id'], name='product_created_id_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_id_idx'),
+            models.Index(fields=['rating_avg', 'id'], name='product_rating_id_idx'),
+            # Trending listing, global or scoped to a category / shop (see products.trending)
+            models.Index(fields=['trending_score', 'id'], name='product_trending_idx'),
+            models.Index(fields=['category', 'trending_score'], name='product_cat_trending_idx'),
+            models.Index(fields=['shop', 'trending_score'], name='product_shop_trending_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['shop', 'sku'], name='product_shop_sku_unique'),
+        ]
+
     def __str__(self):
         return self.name
+
+    @property
+    def rating_histogram(self):
+        return {star: getattr(self, f'rating_{star}_count') for star in range(1, 6)}
+
+    @classmethod
+    def adjust_rating(cls, product_id, add=None, remove=None):
+        """Apply a review rating change to the stored aggregates without reading them.
+
+        ``add`` / ``remove`` are star values (1-5). Counters move with F-expressions;
+        the average is derived in a second UPDATE so it never sees half-applied columns.
+        ``updated_at`` is always bumped since the detail payload embeds the reviews.
+        """
+        qs = cls.objects.filter(pk=product_id)
+        if add == remove:
+            qs.update(updated_at=timezone.now())
+            return
+        changes = {'updated_at': timezone.now()}
+        delta_sum = 0
+        delta_count = 0
+        for star, step in ((add, 1), (remove, -1)):
+            if star is None:
+                continue
+            delta_sum += step * star
+            delta_count += step
+            column = f'rating_{star}_count'
+            changes[column] = changes.get(column, F(column)) + step
+        if delta_sum:
+            changes['rating_sum'] = F('rating_sum') + delta_sum
+        if delta_count:
+            changes['rating_count'] = F('rating_count') + delta_count
+        with transaction.atomic():
+            qs.update(**changes)
+            qs.update(rating_avg=cls.rating_avg_expression())
+
+    RATING_FIELDS = [
+        'rating_sum', 'rating_count', 'rating_avg',
+        'rating_1_count', 'rating_2_count', 'rating_3_count', 'rating_4_count', 'rating_5_count',
+    ]
+
+    @classmethod
+    def rebuild_ratings(cls, product_ids):
+        """Recompute aggregates for ``product_ids`` from one grouped query and persist them."""
+        products = {p.pk: p for p in cls.objects.filter(pk__in=product_ids).only('pk')}
+        now = timezone.now()
+        for product in products.values():
+            product.updated_at = now
+            for field in cls.RATING_FIELDS:
+                setattr(product, field, 0)
+        rows = (
+            cls.objects.filter(pk__in=products.keys(), reviews__isnull=False)
+            .values('pk', 'reviews__rating')
+            .annotate(n=Count('reviews'))
+            .order_by()
+        )
+        for row in rows:
+            product = products[row['pk']]
+            star, n = row['reviews__rating'], row['n']
+            setattr(product, f'rating_{star}_count', n)
+            product.rating_sum += star * n
+            product.rating_count += n
+        for product in products.values():
+            if product.rating_count:
+                product.rating_avg = round(Decimal(product.rating_sum) / product.rating_count, 2)
+        cls.objects.bulk_update(products.values(), cls.RATING_FIELDS + ['updated_at'])
+        return list(products.values())
+
+    @staticmethod
+    def rating_avg_expression():
+        return Case(
+            When(rating_count=0, then=Value(0.0)),
+            default=Cast('rating_sum', FloatField()) / F('rating_count'),
+            output_field=FloatField(),
+        )
+
+
+class ProductSearchDocument(models.Model):
+    """Per-product statistics of the search index (weighted token count for BM25)."""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='search_document')
+    length = models.FloatField(default=0)
+    indexed_at = models.DateTimeField(auto_now=True)
+
+
+class ProductSearchTerm(models.Model):
+    """Inverted index posting: one row per (normalized term, product)."""
+    term = models.CharField(max_length=64)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='search_terms')
+    # Field-weighted term frequency (name counts more than description)
+    tf = models.FloatField()
+    # Copy of ProductSearchDocument.length so scoring needs no join
+    doc_length = models.FloatField()
+
+    class Meta:
+        unique_together = [('term', 'product')]
+        indexes = [
+            models.Index(fields=['product'], name='product_search_term_prod_idx'),
+        ]
+
+
+class ProductStockShard(models.Model):
+    """Slice of a hot product's stock, so concurrent buyers update different rows (see products.stock_shards)."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_shards')
+    shard = models.PositiveSmallIntegerField()
+    stock = models.PositiveIntegerField(default=0)
+    # Sales not yet folded into Product.trending_score (same log2 scale, see products.trending)
+    trending_score = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        unique_together = [('product', 'shard')]
+        ordering = ['product', 'shard']
+
+
+class ProductRecommendation(models.Model):
+    """Top-K "frequently bought together" neighbours, built offline by products.recommendations."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommendations')
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        unique_together = [('product', 'related')]
+        indexes = [
+            models.Index(fields=['product', 'rank'], name='product_reco_rank_idx'),
+        ]
+        ordering = ['product', 'rank']
+
+
+class RecommendationRun(models.Model):
+    """Watermarks of the co-occurrence job, so incremental runs only fold in new rows."""
+    MODE_CHOICES = [
+        ('full', 'Full rebuild'),
+        ('incremental', 'Incremental'),
+    ]
+    mode = models.CharField(max_length=20, choices=MODE_CHOICES)
+    last_order_item_id = models.BigIntegerField(default=0)
+    last_wishlist_id = models.BigIntegerField(default=0)
+    products_updated = models.PositiveIntegerField(default=0)
+    duration_seconds = models.FloatField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
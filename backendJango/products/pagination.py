@@ -0,0 +1,151 @@
+import base64
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class ProductKeysetPagination:
+    """Keyset (seek) pagination over (ordering field, id).
+
+    Unlike OFFSET pagination the cost of a page does not grow with its depth:
+    each page is a ``WHERE (field, id) > (last_field, last_id) ORDER BY field, id
+    LIMIT n`` that walks the composite index. Cursors are opaque base64 tokens
+    and embed the ordering they were issued for.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    ordering_query_param = 'ordering'
+    page_size = 12
+    max_page_size = 100
+    # Allowed public orderings -> model field
+    orderings = {
+        'created_at': 'created_at',
+        '-created_at': 'created_at',
+        'price': 'price',
+        '-price': 'price',
+        'rating': 'rating_avg',
+        '-rating': 'rating_avg',
+    }
+    default_ordering = '-created_at'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def is_requested(self, request):
+        """Cursor mode is opt-in so the legacy ``{products, categories}`` payload keeps working."""
+        params = request.query_params
+        return any(p in params for p in (self.cursor_query_param, self.page_size_query_param, self.ordering_query_param))
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def get_ordering(self, request):
+        ordering = request.query_params.get(self.ordering_query_param) or self.default_ordering
+        if ordering not in self.orderings:
+            ordering = self.default_ordering
+        return ordering
+
+    # Cursor encoding -------------------------------------------------
+    def encode_cursor(self, ordering, value, pk, reverse=False):
+        payload = {'o': ordering, 'v': value, 'i': pk}
+        if reverse:
+            payload['r'] = 1
+        raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+    def decode_cursor(self, token, ordering):
+        try:
+            padded = token + '=' * (-len(token) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+            if payload['o'] != ordering:
+                raise ValueError('ordering mismatch')
+            pk = int(payload['i'])
+            value = self._parse_value(self.orderings[ordering], payload['v'])
+            return value, pk, bool(payload.get('r'))
+        except (KeyError, TypeError, ValueError, InvalidOperation, json.JSONDecodeError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def _parse_value(self, field, raw):
+        if field in ('price', 'rating_avg'):
+            return Decimal(str(raw))
+        value = parse_datetime(raw)
+        if value is None:
+            raise ValueError('bad datetime')
+        return value
+
+    def _dump_value(self, field, value):
+        if field in ('price', 'rating_avg'):
+            return str(value)
+        return value.isoformat()
+
+    # Pagination ------------------------------------------------------
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = self.get_ordering(request)
+        self.field = self.orderings[self.ordering]
+        self.descending = self.ordering.startswith('-')
+        size = self.get_page_size(request)
+
+        token = request.query_params.get(self.cursor_query_param)
+        reverse = False
+        if token:
+            value, pk, reverse = self.decode_cursor(token, self.ordering)
+            # Walking backwards means seeking in the opposite direction
+            forward = self.descending == reverse
+            op = 'gt' if forward else 'lt'
+            queryset = queryset.filter(
+                Q(**{f'{self.field}__{op}': value}) |
+                Q(**{self.field: value, f'id__{op}': pk})
+            )
+
+        descending = self.descending != reverse
+        prefix = '-' if descending else ''
+        queryset = queryset.order_by(f'{prefix}{self.field}', f'{prefix}id')
+
+        rows = list(queryset[:size + 1])
+        has_more = len(rows) > size
+        rows = rows[:size]
+        if reverse:
+            rows.reverse()
+
+        # Forward pages always have something before them when a cursor was given;
+        # backward pages always have something after them.
+        self.has_next = has_more if not reverse else bool(token)
+        self.has_previous = bool(token) if not reverse else has_more
+        self.page = rows
+        return rows
+
+    def _link(self, obj, reverse):
+        url = self.request.build_absolute_uri()
+        value = self._dump_value(self.field, getattr(obj, self.field))
+        token = self.encode_cursor(self.ordering, value, obj.pk, reverse=reverse)
+        return replace_query_param(url, self.cursor_query_param, token)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self._link(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self._link(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'ordering': self.ordering,
+            'results': data,
+        })
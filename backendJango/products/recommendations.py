@@ -0,0 +1,257 @@
+"""Item-to-item "frequently bought together" recommendations.
+
+Offline job (``manage.py build_recommendations``):
+
+1. Orders and wishlists are read as baskets into a sparse basket x product
+   matrix ``B`` (orders weigh 1.0, a user's wishlist weighs ``WISHLIST_WEIGHT``).
+   A multi-shop order is one basket: its sub-orders' lines are keyed on the
+   top-level order.
+2. The co-occurrence matrix is ``C = B.T @ B``; its diagonal holds each
+   product's own (weighted) frequency.
+3. Scores are cosine-normalized, ``C_ij / sqrt(C_ii * C_jj)``, and only the
+   top-K neighbours of each product are stored in ``ProductRecommendation``.
+
+``C`` is persisted as a ``.npz`` file next to the watermarks kept in
+``RecommendationRun``, so an incremental run only reads order lines and
+wishlist rows newer than the last run, folds their delta into ``C`` and
+rewrites the neighbours of the products it touched.
+
+Lines of cancelled orders are not read. Incremental runs only ever add:
+wishlist rows deleted and orders cancelled after being folded in stay in
+``C``, so an incremental run rebuilds in full instead once the last full run
+is older than ``RECOMMENDATIONS_FULL_REBUILD_HOURS``.
+
+NumPy and SciPy are only needed by this job, not by the web process.
+"""
+import os
+import time
+from pathlib import Path
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Product, ProductRecommendation, RecommendationRun
+
+ORDER_WEIGHT = 1.0
+WISHLIST_WEIGHT = 0.5
+DEFAULT_TOP_K = 20
+READ_CHUNK_SIZE = 50000
+WRITE_BATCH_SIZE = 5000
+IN_CLAUSE_SIZE = 1000
+DEFAULT_FULL_REBUILD_HOURS = 24
+
+
+def _libs():
+    try:
+        import numpy as np
+        from scipy import sparse
+    except ImportError as exc:  # pragma: no cover - depends on the deployment
+        raise RuntimeError('build_recommendations requires numpy and scipy (pip install numpy scipy)') from exc
+    return np, sparse
+
+
+def matrix_path():
+    default = Path(settings.BASE_DIR) / 'var' / 'recommendations.npz'
+    return Path(getattr(settings, 'RECOMMENDATIONS_MATRIX_PATH', default))
+
+
+def _read_pairs(queryset, fields):
+    """Stream a two-column values_list into two int64 arrays, chunk by chunk."""
+    np, _ = _libs()
+    parts = []
+    buffer = []
+    for row in queryset.values_list(*fields).order_by().iterator(chunk_size=READ_CHUNK_SIZE):
+        buffer.append(row)
+        if len(buffer) >= READ_CHUNK_SIZE:
+            parts.append(np.array(buffer, dtype=np.int64))
+            buffer = []
+    if buffer:
+        parts.append(np.array(buffer, dtype=np.int64))
+    if not parts:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+    pairs = np.concatenate(parts)
+    return pairs[:, 0], pairs[:, 1]
+
+
+def _cooccurrence(baskets, products, weight, size):
+    """``B.T @ B`` for the (basket, product) pairs, with repeated lines counted once."""
+    np, sparse = _libs()
+    if len(baskets) == 0:
+        return sparse.csr_matrix((size, size), dtype=np.float64)
+    _, rows = np.unique(baskets, return_inverse=True)
+    matrix = sparse.coo_matrix(
+        (np.ones(len(rows), dtype=np.float64), (rows, products)),
+        shape=(int(rows.max()) + 1, size),
+    ).tocsr()
+    matrix.sum_duplicates()
+    matrix.data[:] = weight
+    return (matrix.T @ matrix).tocsr()
+
+
+def _basket_delta(queryset, basket_field, old_mark, new_mark, weight, size):
+    """Co-occurrence change caused by rows with ``old_mark < id <= new_mark``.
+
+    Baskets that received new rows are re-read in full: their new contribution
+    minus the one already folded in (rows with ``id <= old_mark``).
+    """
+    np, sparse = _libs()
+    touched = np.unique(np.fromiter(
+        queryset.filter(id__gt=old_mark, id__lte=new_mark)
+        .values_list(basket_field, flat=True).order_by().iterator(chunk_size=READ_CHUNK_SIZE),
+        dtype=np.int64,
+    ))
+    delta = sparse.csr_matrix((size, size), dtype=np.float64)
+    for start in range(0, len(touched), IN_CLAUSE_SIZE):
+        ids = touched[start:start + IN_CLAUSE_SIZE].tolist()
+        lines = queryset.filter(**{f'{basket_field}__in': ids}, id__lte=new_mark)
+        delta = delta + _cooccurrence(*_read_pairs(lines, (basket_field, 'product_id')), weight, size)
+        old = lines.filter(id__lte=old_mark)
+        delta = delta - _cooccurrence(*_read_pairs(old, (basket_field, 'product_id')), weight, size)
+    delta.eliminate_zeros()
+    return delta
+
+
+def _normalized(cooc):
+    """Cosine-normalize ``C`` and drop self-similarity, all as sparse products."""
+    np, sparse = _libs()
+    diag = cooc.diagonal()
+    inv = np.zeros_like(diag)
+    nonzero = diag > 0
+    inv[nonzero] = 1.0 / np.sqrt(diag[nonzero])
+    scaling = sparse.diags(inv)
+    scores = (scaling @ cooc @ scaling).tocsr()
+    scores.setdiag(0)
+    scores.eliminate_zeros()
+    return scores
+
+
+def _top_k_rows(scores, rows, valid, top_k):
+    """Yield (product_id, [(related_id, score), ...]) for each row, best first."""
+    np, _ = _libs()
+    indptr, indices, data = scores.indptr, scores.indices, scores.data
+    for row in rows:
+        start, end = indptr[row], indptr[row + 1]
+        cols = indices[start:end]
+        vals = data[start:end]
+        keep = valid[cols]
+        cols, vals = cols[keep], vals[keep]
+        if len(cols) > top_k:
+            best = np.argpartition(-vals, top_k)[:top_k]
+            cols, vals = cols[best], vals[best]
+        order = np.lexsort((cols, -vals))
+        yield int(row), [(int(cols[i]), float(vals[i])) for i in order]
+
+
+def _write(scores, rows, valid, top_k):
+    """Replace stored neighbours of ``rows`` (only existing products are written)."""
+    rows = [int(r) for r in rows if valid[r]]
+    with transaction.atomic():
+        for start in range(0, len(rows), IN_CLAUSE_SIZE):
+            ProductRecommendation.objects.filter(product_id__in=rows[start:start + IN_CLAUSE_SIZE]).delete()
+        batch = []
+        for product_id, neighbours in _top_k_rows(scores, rows, valid, top_k):
+            batch.extend(
+                ProductRecommendation(product_id=product_id, related_id=related, score=score, rank=rank)
+                for rank, (related, score) in enumerate(neighbours, start=1)
+            )
+            if len(batch) >= WRITE_BATCH_SIZE:
+                ProductRecommendation.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            ProductRecommendation.objects.bulk_create(batch)
+    return len(rows)
+
+
+def _delete_stale(keep):
+    """Drop the neighbours of products outside ``keep``, ``IN_CLAUSE_SIZE`` ids per statement."""
+    keep = set(keep)
+    stale = [
+        pk for pk in ProductRecommendation.objects.values_list('product_id', flat=True).distinct().order_by('product_id')
+        if pk not in keep
+    ]
+    for start in range(0, len(stale), IN_CLAUSE_SIZE):
+        ProductRecommendation.objects.filter(product_id__in=stale[start:start + IN_CLAUSE_SIZE]).delete()
+
+
+def _valid_products(size):
+    np, _ = _libs()
+    valid = np.zeros(size, dtype=bool)
+    ids = np.fromiter(Product.objects.values_list('id', flat=True).order_by().iterator(chunk_size=READ_CHUNK_SIZE), dtype=np.int64)
+    valid[ids] = True
+    return valid
+
+
+def _save_matrix(cooc):
+    _, sparse = _libs()
+    path = matrix_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.stem + '.tmp.npz')
+    sparse.save_npz(tmp, cooc)
+    os.replace(tmp, path)
+
+
+def _load_matrix():
+    _, sparse = _libs()
+    path = matrix_path()
+    if not path.exists():
+        return None
+    return sparse.load_npz(path).tocsr()
+
+
+def full_rebuild_due(now=None):
+    """True when no full run happened in the last ``RECOMMENDATIONS_FULL_REBUILD_HOURS``."""
+    hours = getattr(settings, 'RECOMMENDATIONS_FULL_REBUILD_HOURS', DEFAULT_FULL_REBUILD_HOURS)
+    last_full = RecommendationRun.objects.filter(mode='full').values_list('created_at', flat=True).first()
+    return last_full is None or last_full < (now or timezone.now()) - timedelta(hours=hours)
+
+
+def build(incremental=False, top_k=DEFAULT_TOP_K):
+    """Run the job; falls back to a full rebuild when no previous state exists or one is due."""
+    from orders.models import OrderItem
+    from wishlist.models import Wishlist
+    np, _ = _libs()
+
+    started = time.monotonic()
+    size = (Product.objects.aggregate(m=Max('id'))['m'] or 0) + 1
+    item_mark = OrderItem.objects.aggregate(m=Max('id'))['m'] or 0
+    wish_mark = Wishlist.objects.aggregate(m=Max('id'))['m'] or 0
+    last = RecommendationRun.objects.first()
+    cooc = _load_matrix() if incremental and last and not full_rebuild_due() else None
+    # Lines of a multi-shop checkout live on per-shop sub-orders: one basket per checkout
+    order_items = OrderItem.objects.exclude(order__status='cancelled').annotate(basket=Coalesce('order__parent_id', 'order_id'))
+
+    if cooc is None:
+        mode = 'full'
+        cooc = _cooccurrence(*_read_pairs(order_items.filter(id__lte=item_mark), ('basket', 'product_id')), ORDER_WEIGHT, size)
+        cooc = cooc + _cooccurrence(*_read_pairs(Wishlist.objects.filter(id__lte=wish_mark), ('user_id', 'product_id')), WISHLIST_WEIGHT, size)
+        rows = np.unique(cooc.nonzero()[0])
+    else:
+        mode = 'incremental'
+        if cooc.shape[0] < size:
+            cooc.resize((size, size))
+        size = cooc.shape[0]
+        delta = _basket_delta(order_items, 'basket', last.last_order_item_id, item_mark, ORDER_WEIGHT, size)
+        delta = delta + _basket_delta(Wishlist.objects.all(), 'user_id', last.last_wishlist_id, wish_mark, WISHLIST_WEIGHT, size)
+        cooc = (cooc + delta).tocsr()
+        rows = np.unique(delta.nonzero()[0])
+
+    cooc.eliminate_zeros()
+    valid = _valid_products(size)
+    updated = _write(_normalized(cooc), rows, valid, top_k) if len(rows) else 0
+    if mode == 'full':
+        # Products that no longer co-occur with anything keep no stale neighbours
+        _delete_stale(int(r) for r in rows)
+    _save_matrix(cooc)
+    return RecommendationRun.objects.create(
+        mode=mode,
+        last_order_item_id=item_mark,
+        last_wishlist_id=wish_mark,
+        products_updated=updated,
+        duration_seconds=time.monotonic() - started,
+    )
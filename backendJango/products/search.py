@@ -0,0 +1,160 @@
+"""Inverted-index product search with BM25 ranking.
+
+Products are tokenized with ``categories.serializers.normalize_name`` (lower case,
+accents folded) so that "cafe" matches "Café". The index lives in
+``ProductSearchTerm`` / ``ProductSearchDocument`` and is refreshed by
+``products.signals`` whenever a product is saved.
+"""
+import math
+import re
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Avg, Count
+
+from categories.serializers import normalize_name
+from .models import Product, ProductSearchDocument, ProductSearchTerm
+
+TOKEN_RE = re.compile(r'\w+')
+MIN_TOKEN_LENGTH = 2
+MAX_TERM_LENGTH = 64
+# Weight of each indexed field in the term frequency
+FIELD_WEIGHTS = (
+    ('name', 3.0),
+    ('category', 2.0),
+    ('shop', 2.0),
+    ('description', 1.0),
+)
+# Product fields whose change requires reindexing
+INDEXED_FIELDS = {'name', 'description', 'category', 'shop'}
+BM25_K1 = 1.2
+BM25_B = 0.75
+# How many indexed terms the last (incomplete) query word may expand to
+PREFIX_EXPANSION_LIMIT = 20
+
+
+def tokenize(text):
+    return [
+        token[:MAX_TERM_LENGTH]
+        for token in TOKEN_RE.findall(normalize_name(text or ''))
+        if len(token) >= MIN_TOKEN_LENGTH
+    ]
+
+
+def _field_texts(product):
+    return {
+        'name': product.name,
+        'description': product.description,
+        'category': product.category.name if product.category_id else '',
+        'shop': product.shop.name if product.shop_id else '',
+    }
+
+
+def build_postings(product):
+    """Return ({term: weighted tf}, document length) for a product."""
+    weights = Counter()
+    texts = _field_texts(product)
+    for field, weight in FIELD_WEIGHTS:
+        for token in tokenize(texts[field]):
+            weights[token] += weight
+    return weights, float(sum(weights.values()))
+
+
+def index_products(products):
+    """(Re)index the given products: delete their postings and bulk insert fresh ones."""
+    products = list(products)
+    if not products:
+        return
+    ids = [p.pk for p in products]
+    postings = []
+    documents = []
+    for product in products:
+        weights, length = build_postings(product)
+        documents.append(ProductSearchDocument(product_id=product.pk, length=length))
+        postings.extend(
+            ProductSearchTerm(term=term, product_id=product.pk, tf=tf, doc_length=length)
+            for term, tf in weights.items()
+        )
+    with transaction.atomic():
+        ProductSearchTerm.objects.filter(product_id__in=ids).delete()
+        ProductSearchDocument.objects.filter(product_id__in=ids).delete()
+        ProductSearchDocument.objects.bulk_create(documents)
+        ProductSearchTerm.objects.bulk_create(postings, batch_size=1000)
+
+
+def index_product(product):
+    index_products([product])
+
+
+def reindex_queryset(queryset, chunk_size=500):
+    """Reindex a product queryset in bounded-size chunks; returns the number indexed."""
+    total = 0
+    last_id = 0
+    queryset = queryset.select_related('shop', 'category').order_by('pk')
+    while True:
+        chunk = list(queryset.filter(pk__gt=last_id)[:chunk_size])
+        if not chunk:
+            return total
+        index_products(chunk)
+        total += len(chunk)
+        last_id = chunk[-1].pk
+
+
+def expand_query(query):
+    """Normalize query words; the last one also matches as a prefix (search as you type)."""
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not terms:
+        return []
+    last = terms[-1]
+    expansions = (
+        ProductSearchTerm.objects.filter(term__startswith=last)
+        .values_list('term', flat=True)
+        .distinct()
+        .order_by('term')[:PREFIX_EXPANSION_LIMIT]
+    )
+    return list(dict.fromkeys(terms + list(expansions)))
+
+
+def rank(query, products=None):
+    """Return [(product_id, score)] best first.
+
+    ``products`` is an optional Product queryset restricting the candidates
+    (visibility, shop / category filters); it is applied as a subquery.
+    """
+    terms = expand_query(query)
+    if not terms:
+        return []
+    postings = ProductSearchTerm.objects.filter(term__in=terms)
+    if products is not None:
+        postings = postings.filter(product__in=products.values('pk'))
+    rows = list(postings.values_list('product_id', 'term', 'tf', 'doc_length'))
+    if not rows:
+        return []
+
+    stats = ProductSearchDocument.objects.aggregate(n=Count('pk'), avg=Avg('length'))
+    total_docs = stats['n'] or 1
+    avg_length = stats['avg'] or 1.0
+    # df over the whole index, from the postings already fetched when unfiltered
+    if products is None:
+        df = Counter(term for _, term, _, _ in rows)
+    else:
+        df = dict(
+            ProductSearchTerm.objects.filter(term__in=terms)
+            .values_list('term')
+            .annotate(n=Count('pk'))
+            .order_by()
+        )
+
+    scores = defaultdict(float)
+    for product_id, term, tf, doc_length in rows:
+        n = df.get(term, 0)
+        idf = math.log(1 + (total_docs - n + 0.5) / (n + 0.5))
+        norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * doc_length / avg_length)
+        scores[product_id] += idf * tf * (BM25_K1 + 1) / norm
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+def rebuild_index(chunk_size=500):
+    ProductSearchTerm.objects.all().delete()
+    ProductSearchDocument.objects.all().delete()
+    return reindex_queryset(Product.objects.all(), chunk_size=chunk_size)
@@ -3,35 +3,47 @@ from .models import Product
 from categories.models import Category
 from reviews.serializers import ReviewSerializer
 
-class ProductSerializer(serializers.ModelSerializer):
+class ImageCompatMixin:
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # Ensure image is properly formatted
+        if data.get('image'):
+            data['images'] = [{'image': data['image']}]  # Format for frontend compatibility
+        return data
+
+
+class ProductListSerializer(ImageCompatMixin, serializers.ModelSerializer):
+    """Compact product card used by listings, cart and wishlist (no reviews, no description)."""
+    category_name = serializers.CharField(source='category.name', read_only=True)
+    shop_id = serializers.IntegerField(source='shop.id', read_only=True)
+    shop_name = serializers.CharField(source='shop.name', read_only=True)
+    shop_is_active = serializers.BooleanField(source='shop.is_active', read_only=True)
+    rating = serializers.FloatField(source='rating_avg', read_only=True)
+
+    class Meta:
+        model = Product
+        fields = [
+            'id', 'name', 'price', 'stock', 'status', 'image',
+            'shop', 'shop_id', 'shop_name', 'shop_is_active', 'category', 'category_name',
+            'rating', 'rating_count',
+        ]
+        read_only_fields = fields
+
+
+class ProductSerializer(ImageCompatMixin, serializers.ModelSerializer):
     category_name = serializers.CharField(source='category.name', read_only=True)
     shop_id = serializers.IntegerField(source='shop.id', read_only=True)
     shop_name = serializers.CharField(source='shop.name', read_only=True)
     shop_is_active = serializers.BooleanField(source='shop.is_active', read_only=True)
     reviews = ReviewSerializer(many=True, read_only=True)
-    rating = serializers.SerializerMethodField()
+    rating = serializers.FloatField(source='rating_avg', read_only=True)
+    rating_histogram = serializers.DictField(child=serializers.IntegerField(), read_only=True)
     
     class Meta:
         model = Product
         fields = [
-            'id', 'name', 'description', 'price', 'stock', 'status', 
+            'id', 'name', 'sku', 'description', 'price', 'stock', 'status', 
             'image', 'shop', 'shop_id', 'shop_name', 'shop_is_active', 'category', 'category_name', 'created_at', 'updated_at',
-            'reviews', 'rating'
+            'reviews', 'rating', 'rating_count', 'rating_histogram'
         ]
-        read_only_fields = ['id', 'created_at', 'updated_at', 'reviews', 'rating', 'shop_id', 'shop_name']
-
-    def get_rating(self, obj):
-        # Calculer la note moyenne si des avis existent
-        reviews = obj.reviews.all()
-        if not reviews:
-            return 0
-        
-        total = sum(review.rating for review in reviews)
-        return float(total) / len(reviews)
-
-    def to_representation(self, instance):
-        data = super().to_representation(instance)
-        # Ensure image is properly formatted
-        if data.get('image'):
-            data['images'] = [{'image': data['image']}]  # Format for frontend compatibility
-        return data
+        read_only_fields = ['id', 'created_at', 'updated_at', 'reviews', 'rating', 'rating_count', 'shop_id', 'shop_name']
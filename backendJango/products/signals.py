@@ -0,0 +1,59 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from categories.models import Category
+from shops.models import Shop
+from shopnow import response_cache
+from . import search
+from .models import Product
+
+
+INDEXED_ATTNAMES = {Product._meta.get_field(name).attname for name in search.INDEXED_FIELDS}
+
+
+@receiver(post_save, sender=Product)
+def reindex_product(sender, instance, created, **kwargs):
+    # Stock / status / rating updates do not touch indexed text (changes tracked in memory)
+    if not created and not INDEXED_ATTNAMES.intersection(instance.saved_changes):
+        return
+    search.index_product(instance)
+
+
+@receiver(pre_save, sender=Category)
+@receiver(pre_save, sender=Shop)
+def remember_indexed_name(sender, instance, **kwargs):
+    instance._indexed_name = None
+    if instance.pk:
+        instance._indexed_name = sender.objects.filter(pk=instance.pk).values_list('name', flat=True).first()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Shop)
+def reindex_renamed_products(sender, instance, created, **kwargs):
+    """Category and shop names are indexed with each product: refresh them on rename."""
+    if created or getattr(instance, '_indexed_name', None) in (None, instance.name):
+        return
+    lookup = 'category' if sender is Category else 'shop'
+    search.reindex_queryset(Product.objects.filter(**{lookup: instance}))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_responses(sender, instance, **kwargs):
+    shop_ids = {instance.shop_id}
+    # A product moved to another shop leaves the old shop's listing too
+    old_shop_id, _ = getattr(instance, 'saved_changes', {}).get('shop_id', (None, None))
+    shop_ids.add(old_shop_id)
+    response_cache.invalidate_products([instance.pk], [pk for pk in shop_ids if pk])
+
+
+@receiver(post_save, sender=Shop)
+@receiver(post_delete, sender=Shop)
+def invalidate_shop_responses(sender, instance, **kwargs):
+    # Activating / deactivating a shop changes which products are listed
+    response_cache.invalidate('shops', 'products', f'shop:{instance.pk}', f'shop-products:{instance.pk}')
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_responses(sender, instance, **kwargs):
+    response_cache.invalidate('categories', f'category:{instance.pk}')
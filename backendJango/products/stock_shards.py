@@ -0,0 +1,188 @@
+"""Sharded stock counters for very hot products.
+
+A sharded product keeps its stock in ``stock_shard_count`` ``ProductStockShard``
+rows. A purchase takes the whole quantity from one shard picked at random
+with a guarded ``UPDATE ... WHERE stock >= n`` and falls back to the sibling
+shards, so concurrent buyers rarely wait on the same row. Only when no single
+shard can serve the quantity are the shards locked and drained together.
+
+``Product.stock`` stays the value everybody reads (catalog, cart, admin
+stats): for sharded products it is a cached sum, refreshed at most every
+``STOCK_SHARD_REFRESH_SECONDS`` after purchases, on demand with
+:func:`refresh_totals`, and by ``manage.py rebalance_stock_shards`` which also
+evens out the shards. Sales recorded on shards are folded into
+``Product.trending_score`` at refresh time, keeping the product row cold.
+"""
+import math
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, F, OuterRef, Subquery, Sum, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from shopnow import response_cache
+from . import trending
+from .models import Product, ProductStockShard
+
+DEFAULT_REFRESH_SECONDS = 5
+REFRESH_KEY = 'stockshards:refresh:{}'
+
+
+def _split(total, count):
+    base, extra = divmod(total, count)
+    return [base + (1 if shard < extra else 0) for shard in range(count)]
+
+
+def _log2_sum(scores):
+    scores = [s for s in scores if s is not None]
+    if not scores:
+        return None
+    high = max(scores)
+    return high + math.log2(sum(2 ** (s - high) for s in scores))
+
+
+def configure(product, count):
+    """Spread ``product``'s stock over ``count`` shards (0 folds it back into the product row).
+
+    Sharded products cannot be reserved at checkout (orders.reservations):
+    raises ValueError while ``product`` has unexpired holds.
+    """
+    from orders.models import StockReservation
+    with transaction.atomic():
+        product = Product.objects.select_for_update().get(pk=product.pk)
+        if count and StockReservation.objects.filter(product=product, expires_at__gt=timezone.now()).exists():
+            raise ValueError(f'Product {product.pk} has active stock reservations')
+        if product.stock_shard_count:
+            refresh_totals([product.pk])
+            product.refresh_from_db()
+        ProductStockShard.objects.filter(product=product).delete()
+        if count:
+            ProductStockShard.objects.bulk_create([
+                ProductStockShard(product=product, shard=shard, stock=stock)
+                for shard, stock in enumerate(_split(product.stock, count))
+            ])
+        product.stock_shard_count = count
+        product.save(update_fields=['stock_shard_count', 'updated_at'])
+    return product
+
+
+def set_stock(product, total):
+    """Replace a sharded product's stock (admin edit, import) and refresh the cached sum."""
+    with transaction.atomic():
+        shards = list(ProductStockShard.objects.select_for_update().filter(product_id=product.pk).order_by('shard'))
+        for shard, stock in zip(shards, _split(total, len(shards))):
+            shard.stock = stock
+        ProductStockShard.objects.bulk_update(shards, ['stock'])
+        refresh_totals([product.pk])
+
+
+def take(product, quantity, sold_at):
+    """Take ``quantity`` units of a sharded product; False when the shards cannot cover it.
+
+    Must run inside the order transaction: a later failure rolls the shards back too.
+    """
+    count = product.stock_shard_count
+    start = random.randrange(count)
+    sale = trending.add_sale_expression(quantity, sold_at)
+    for offset in range(count):
+        shard = (start + offset) % count
+        taken = ProductStockShard.objects.filter(product_id=product.pk, shard=shard, stock__gte=quantity).update(
+            stock=F('stock') - quantity,
+            trending_score=sale,
+        )
+        if taken:
+            return True
+    # No single shard holds enough: lock them all and drain in order (only near sell-out)
+    shards = list(ProductStockShard.objects.select_for_update().filter(product_id=product.pk).order_by('shard'))
+    if sum(s.stock for s in shards) < quantity:
+        return False
+    remaining = quantity
+    for shard in shards:
+        part = min(shard.stock, remaining)
+        shard.stock -= part
+        remaining -= part
+    shards[0].trending_score = trending.add_sale(shards[0].trending_score, quantity, sold_at)
+    ProductStockShard.objects.bulk_update(shards, ['stock', 'trending_score'])
+    return True
+
+
+def give_back(product_id, count, quantity):
+    """Return ``quantity`` units (cancelled order) to one of the ``count`` shards of a sharded product."""
+    shard = random.randrange(count)
+    ProductStockShard.objects.filter(product_id=product_id, shard=shard).update(stock=F('stock') + quantity)
+    schedule_refresh([product_id])
+
+
+def refresh_totals(product_ids=None):
+    """Write shard sums into ``Product.stock`` / ``status`` and fold pending shard sales.
+
+    ``product_ids=None`` refreshes every sharded product. Returns the number refreshed.
+    """
+    products = Product.objects.filter(stock_shard_count__gt=0)
+    if product_ids is not None:
+        products = products.filter(pk__in=list(product_ids))
+    with transaction.atomic():
+        products = {p.pk: p for p in products.select_for_update().order_by('pk')}
+        if not products:
+            return 0
+        shards = list(
+            ProductStockShard.objects.select_for_update()
+            .filter(product_id__in=list(products)).order_by('product_id', 'shard')
+        )
+        totals = {pk: 0 for pk in products}
+        pending = {pk: [] for pk in products}
+        for shard in shards:
+            totals[shard.product_id] += shard.stock
+            if shard.trending_score is not None:
+                pending[shard.product_id].append(shard.trending_score)
+                shard.trending_score = None
+        now = timezone.now()
+        for pk, product in products.items():
+            product.stock = totals[pk]
+            if product.stock == 0:
+                product.status = 'unavailable'
+            product.trending_score = _log2_sum([product.trending_score] + pending[pk])
+            product.updated_at = now
+        Product.objects.bulk_update(products.values(), ['stock', 'status', 'trending_score', 'updated_at'])
+        ProductStockShard.objects.bulk_update([s for s in shards if s.trending_score is None], ['trending_score'])
+        response_cache.invalidate_products(list(products), {p.shop_id for p in products.values() if p.shop_id})
+    return len(products)
+
+
+def with_live_stock(queryset):
+    """Annotate ``live_stock``: current shard sums for sharded products, read without locks."""
+    shard_sum = (
+        ProductStockShard.objects.filter(product_id=OuterRef('pk')).order_by()
+        .values('product_id').annotate(total=Sum('stock')).values('total')
+    )
+    return queryset.annotate(live_stock=Case(
+        When(stock_shard_count__gt=0, then=Coalesce(Subquery(shard_sum), 0)),
+        default=F('stock'),
+    ))
+
+
+def schedule_refresh(product_ids):
+    """Refresh cached sums after commit, at most once per interval and product."""
+    interval = getattr(settings, 'STOCK_SHARD_REFRESH_SECONDS', DEFAULT_REFRESH_SECONDS)
+    due = [pk for pk in product_ids if cache.add(REFRESH_KEY.format(pk), 1, timeout=interval)]
+    if due:
+        transaction.on_commit(lambda: refresh_totals(due))
+
+
+def rebalance(product_ids=None):
+    """Even out the shards of sharded products, then refresh their cached sums."""
+    products = Product.objects.filter(stock_shard_count__gt=0)
+    if product_ids is not None:
+        products = products.filter(pk__in=list(product_ids))
+    ids = list(products.values_list('pk', flat=True).order_by('pk'))
+    for pk in ids:
+        with transaction.atomic():
+            shards = list(ProductStockShard.objects.select_for_update().filter(product_id=pk).order_by('shard'))
+            for shard, stock in zip(shards, _split(sum(s.stock for s in shards), len(shards))):
+                shard.stock = stock
+            ProductStockShard.objects.bulk_update(shards, ['stock'])
+    refresh_totals(ids)
+    return len(ids)
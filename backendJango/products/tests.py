@@ -1,3 +1,490 @@
-from django.test import TestCase
+import io
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from pathlib import Path
+from unittest.mock import patch
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
+from categories.models import Category
+from orders.models import Order, OrderItem
+from products import importer, recommendations, trending
+from products.models import Product, ProductRecommendation, RecommendationRun
+from shops.models import Shop
+from wishlist.models import Wishlist
 
-# Create your tests here.
+
+class ProductKeysetPaginationTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		User = get_user_model()
+		self.owner = User.objects.create_user(username='owner', email='owner@example.com', password='pass12345')
+		self.shop = Shop.objects.create(owner=self.owner, name='Shop', city='Tunis')
+		# Several products share a price to exercise the id tie-breaker
+		for i in range(7):
+			Product.objects.create(name=f'P{i}', price=Decimal('10.00') + (i // 3), stock=3, shop=self.shop)
+		self.client = APIClient()
+
+	def _walk(self, params):
+		ids = []
+		resp = self.client.get('/api/products/', params)
+		while True:
+			self.assertEqual(resp.status_code, 200)
+			ids.extend(p['id'] for p in resp.data['results'])
+			if not resp.data['next']:
+				return ids
+			resp = self.client.get(resp.data['next'])
+
+	def test_pages_cover_catalog_once_in_order(self):
+		ids = self._walk({'ordering': 'price', 'page_size': 2})
+		expected = list(Product.objects.order_by('price', 'id').values_list('id', flat=True))
+		self.assertEqual(ids, expected)
+
+	def test_descending_created_at_and_previous_link(self):
+		first = self.client.get('/api/products/', {'page_size': 3})
+		second = self.client.get(first.data['next'])
+		back = self.client.get(second.data['previous'])
+		self.assertEqual([p['id'] for p in back.data['results']], [p['id'] for p in first.data['results']])
+		self.assertNotIn('categories', first.data)
+
+	def test_filters_still_apply(self):
+		self.shop.is_active = False
+		self.shop.save()
+		resp = self.client.get('/api/products/', {'page_size': 5})
+		self.assertEqual(resp.data['results'], [])
+
+	def test_invalid_cursor(self):
+		resp = self.client.get('/api/products/', {'cursor': 'garbage'})
+		self.assertEqual(resp.status_code, 404)
+
+
+class ProductSerializerSplitTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		User = get_user_model()
+		self.owner = User.objects.create_user(username='owner', email='owner@example.com', password='pass12345')
+		shop = Shop.objects.create(owner=self.owner, name='Shop', city='Tunis')
+		self.product = Product.objects.create(name='P', description='long text', price='3.00', stock=2, shop=shop)
+		self.client = APIClient()
+
+	def test_list_is_compact_and_detail_embeds_reviews(self):
+		listing = self.client.get('/api/products/', {'page_size': 10}).data['results'][0]
+		self.assertNotIn('reviews', listing)
+		self.assertNotIn('description', listing)
+		self.assertEqual(listing['shop_name'], 'Shop')
+		detail = self.client.get(f'/api/products/{self.product.id}/').data
+		self.assertEqual(detail['reviews'], [])
+		self.assertEqual(detail['description'], 'long text')
+
+	def test_list_query_count_does_not_depend_on_page_size(self):
+		for i in range(5):
+			Product.objects.create(name=f'X{i}', price='1.00', stock=1, shop=self.product.shop)
+		# validator aggregate + one page query
+		with self.assertNumQueries(2):
+			self.client.get('/api/products/', {'page_size': 10})
+
+
+class ProductSearchTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		User = get_user_model()
+		owner = User.objects.create_user(username='owner', email='owner@example.com', password='pass12345')
+		self.shop = Shop.objects.create(owner=owner, name='Épicerie Fine', city='Tunis')
+		self.cafe = Product.objects.create(name='Café moulu', description='Arabica', price='8.00', stock=4, shop=self.shop)
+		self.mug = Product.objects.create(name='Mug', description='Pour votre café du matin', price='6.00', stock=4, shop=self.shop)
+		self.tea = Product.objects.create(name='Thé vert', description='Menthe', price='4.00', stock=4, shop=self.shop)
+		self.client = APIClient()
+
+	def test_accent_folded_and_ranked(self):
+		resp = self.client.get('/api/products/search/', {'q': 'cafe'})
+		self.assertEqual(resp.status_code, 200)
+		ids = [p['id'] for p in resp.data['results']]
+		# Name matches outrank description matches
+		self.assertEqual(ids, [self.cafe.id, self.mug.id])
+
+	def test_shop_name_and_prefix_match(self):
+		resp = self.client.get('/api/products/search/', {'q': 'epic'})
+		self.assertEqual(resp.data['count'], 3)
+
+	def test_index_follows_product_edits(self):
+		self.tea.name = 'Infusion'
+		self.tea.save()
+		self.assertEqual(self.client.get('/api/products/search/', {'q': 'the'}).data['count'], 0)
+		self.assertEqual(self.client.get('/api/products/search/', {'q': 'infusion'}).data['count'], 1)
+		self.tea.delete()
+		self.assertEqual(self.client.get('/api/products/search/', {'q': 'infusion'}).data['count'], 0)
+
+	def test_empty_query_rejected(self):
+		self.assertEqual(self.client.get('/api/products/search/', {'q': ' '}).status_code, 400)
+
+
+class ProductFacetTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		User = get_user_model()
+		owner = User.objects.create_user(username='owner', email='owner@example.com', password='pass12345')
+		self.food = Category.objects.create(name='Food')
+		self.home = Category.objects.create(name='Home')
+		tunis = Shop.objects.create(owner=owner, name='A', city='Tunis')
+		sfax = Shop.objects.create(owner=owner, name='B', city='Sfax')
+		Product.objects.create(name='1', price='10.00', stock=1, shop=tunis, category=self.food)
+		Product.objects.create(name='2', price='30.00', stock=1, shop=tunis, category=self.home)
+		Product.objects.create(name='3', price='30.00', stock=0, status='unavailable', shop=sfax, category=self.food)
+		self.client = APIClient()
+
+	def test_counts_ignore_own_facet_selection(self):
+		resp = self.client.get('/api/products/facets/', {'category': str(self.food.id), 'city': 'tunis'})
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual([p['name'] for p in resp.data['results']], ['1'])
+		facets = resp.data['facets']
+		# Category counts are restricted by city only
+		self.assertEqual({c['name']: c['count'] for c in facets['category']}, {'Food': 1, 'Home': 1})
+		# City counts are restricted by category only
+		self.assertEqual({c['value']: c['count'] for c in facets['city']}, {'Tunis': 1, 'Sfax': 1})
+		self.assertEqual({b['key']: b['count'] for b in facets['price']}['0-20'], 1)
+
+	def test_single_grouped_query_for_all_facets(self):
+		# page + grouped facet rows + category names
+		with self.assertNumQueries(3):
+			self.client.get('/api/products/facets/', {'price': '20-50'})
+
+
+class ConditionalGetTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		User = get_user_model()
+		owner = User.objects.create_user(username='owner', email='owner@example.com', password='pass12345')
+		self.shop = Shop.objects.create(owner=owner, name='Shop', city='Tunis')
+		self.product = Product.objects.create(name='P', price='3.00', stock=2, shop=self.shop)
+		self.client = APIClient()
+
+	def _revalidate(self, url, params=None):
+		first = self.client.get(url, params or {})
+		self.assertEqual(first.status_code, 200)
+		return self.client.get(url, params or {}, HTTP_IF_NONE_MATCH=first['ETag'])
+
+	def test_unchanged_resources_return_304(self):
+		for url in ['/api/products/', f'/api/products/{self.product.id}/', '/api/shops/', '/api/categories/']:
+			self.assertEqual(self._revalidate(url).status_code, 304, url)
+
+	def test_not_modified_skips_serialization(self):
+		# Authenticated: bypasses the anonymous response cache
+		self.client.force_authenticate(get_user_model().objects.create_user(username='c', email='c@example.com', password='x'))
+		first = self.client.get('/api/products/', {'page_size': 5})
+		with self.assertNumQueries(1):
+			resp = self.client.get('/api/products/', {'page_size': 5}, HTTP_IF_NONE_MATCH=first['ETag'])
+		self.assertEqual(resp.status_code, 304)
+
+	def test_writes_change_validators(self):
+		first = self.client.get(f'/api/products/{self.product.id}/')
+		self.product.stock = 0
+		self.product.save(update_fields=['stock', 'updated_at'])
+		resp = self.client.get(f'/api/products/{self.product.id}/', HTTP_IF_NONE_MATCH=first['ETag'])
+		self.assertEqual(resp.status_code, 200)
+		# Shop edits invalidate product payloads (shop name is embedded)
+		etag = resp['ETag']
+		self.shop.name = 'Renamed'
+		self.shop.save()
+		resp = self.client.get(f'/api/products/{self.product.id}/', HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual(resp.data['shop_name'], 'Renamed')
+
+	def test_if_modified_since_alone_never_returns_304(self):
+		first = self.client.get('/api/products/')
+		self.assertFalse(first.has_header('Last-Modified'))
+		detail = self.client.get(f'/api/products/{self.product.id}/')
+		since = detail['Last-Modified']
+		# A delete does not move max(updated_at): only the count-bearing ETag sees it
+		Product.objects.create(name='Q', price='1.00', stock=1, shop=self.shop).delete()
+		self.product.delete()
+		resp = self.client.get('/api/products/', HTTP_IF_MODIFIED_SINCE=since)
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual(resp.json()['products'], [])
+		self.assertEqual(self.client.get('/api/products/', HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+
+
+@override_settings(RESPONSE_CACHE_ENABLED=True)
+class ResponseCacheTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		User = get_user_model()
+		owner = User.objects.create_user(username='owner', email='owner@example.com', password='pass12345')
+		self.shop = Shop.objects.create(owner=owner, name='Shop', city='Tunis')
+		self.product = Product.objects.create(name='P', price='3.00', stock=2, shop=self.shop)
+		self.client = APIClient()
+
+	def test_second_anonymous_read_is_served_from_cache(self):
+		url = f'/api/products/{self.product.id}/'
+		self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+		with self.assertNumQueries(0):
+			resp = self.client.get(url)
+		self.assertEqual(resp['X-Cache'], 'HIT')
+
+	def test_writes_are_visible_immediately(self):
+		self.client.get('/api/products/', {'page_size': 5})
+		self.client.get('/api/shops/')
+		self.product.stock = 1
+		self.product.save(update_fields=['stock', 'updated_at'])
+		resp = self.client.get('/api/products/', {'page_size': 5})
+		self.assertEqual(resp['X-Cache'], 'MISS')
+		self.assertEqual(resp.json()['results'][0]['stock'], 1)
+		self.shop.is_active = False
+		self.shop.save()
+		self.assertEqual(self.client.get('/api/products/', {'page_size': 5}).json()['results'], [])
+		self.assertEqual(self.client.get('/api/shops/')['X-Cache'], 'MISS')
+
+	def test_moving_a_product_invalidates_both_shops(self):
+		other = Shop.objects.create(owner=self.shop.owner, name='Other', city='Sousse')
+		urls = [f'/api/shops/{self.shop.id}/', f'/api/shops/{other.id}/']
+		for url in urls:
+			self.client.get(url)
+			self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+		self.product.shop = other
+		self.product.save()
+		old, new = (self.client.get(url) for url in urls)
+		self.assertEqual((old['X-Cache'], new['X-Cache']), ('MISS', 'MISS'))
+		self.assertEqual((old.json()['total_products'], new.json()['total_products']), (0, 1))
+
+	def test_review_invalidates_product_detail(self):
+		from reviews.models import Review
+		url = f'/api/products/{self.product.id}/'
+		self.client.get(url)
+		Review.objects.create(product=self.product, user=self.shop.owner, rating=4, title='t', comment='c')
+		self.assertEqual(self.client.get(url).json()['rating_count'], 1)
+
+	def test_stats_endpoint(self):
+		self.client.get('/api/categories/')
+		self.client.get('/api/categories/')
+		admin = get_user_model().objects.create_user(username='adm', email='a@example.com', password='x', is_staff=True)
+		self.client.force_authenticate(admin)
+		data = self.client.get('/api/admin/cache-stats/').data
+		self.assertEqual(data['by_namespace']['categories'], {'hits': 1, 'misses': 1})
+
+	@override_settings(RESPONSE_CACHE_ENABLED=False)
+	def test_disabled_without_shared_cache(self):
+		url = f'/api/products/{self.product.id}/'
+		self.assertFalse(self.client.get(url).has_header('X-Cache'))
+		# Nothing was stored: a write another worker cannot invalidate here is still seen
+		Product.objects.filter(pk=self.product.pk).update(stock=7)
+		self.assertEqual(self.client.get(url).json()['stock'], 7)
+
+
+class ProductBulkImportTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		User = get_user_model()
+		self.owner = User.objects.create_user(username='owner', email='owner@example.com', password='pass12345', role='shop_owner')
+		self.shop = Shop.objects.create(owner=self.owner, name='Shop', city='Tunis')
+		self.category = Category.objects.create(name='Épicerie')
+		Product.objects.create(name='Old', sku='A1', price='1.00', stock=1, shop=self.shop)
+		self.client = APIClient()
+		self.client.force_authenticate(self.owner)
+
+	def test_csv_upload_upserts_by_sku_and_reports_errors(self):
+		body = (
+			'sku,name,price,stock,category\n'
+			'A1,Renamed,2.50,4,epicerie\n'
+			'B2,New,3.00,1,EPICERIE\n'
+			'C3,Bad,-1,1,\n'
+		).encode('utf-8')
+		upload = SimpleUploadedFile('items.csv', body, content_type='text/csv')
+		resp = self.client.post(f'/api/products/import/?shop={self.shop.id}', {'file': upload}, format='multipart')
+		self.assertEqual(resp.status_code, 200, resp.data)
+		self.assertEqual((resp.data['created'], resp.data['updated'], resp.data['error_count']), (1, 1, 1))
+		self.assertEqual(resp.data['errors'][0]['row'], 3)
+		a1 = Product.objects.get(shop=self.shop, sku='A1')
+		self.assertEqual((a1.name, a1.stock, a1.category_id), ('Renamed', 4, self.category.id))
+		self.assertEqual(Product.objects.get(sku='B2').category_id, self.category.id)
+		# Imported products are searchable
+		self.assertEqual(self.client.get('/api/products/search/', {'q': 'renamed'}).data['count'], 1)
+
+	def test_jsonl_raw_body_in_small_chunks(self):
+		lines = '\n'.join(
+			'{"sku": "J%d", "name": "Item %d", "price": "1.00", "stock": 2}' % (i, i) for i in range(7)
+		) + '\nnot json\n'
+		report = importer.import_products(io.BytesIO(lines.encode('utf-8')), self.shop, fmt='jsonl', chunk_size=3)
+		self.assertEqual((report['rows'], report['created'], report['error_count']), (8, 7, 1))
+		self.assertEqual(Product.objects.filter(shop=self.shop, sku__startswith='J').count(), 7)
+
+	def test_non_utf8_upload_is_reported_not_500(self):
+		body = 'sku,name,price\nL1,Café,1.00\n'.encode('latin-1')
+		upload = SimpleUploadedFile('items.csv', body, content_type='text/csv')
+		resp = self.client.post(f'/api/products/import/?shop={self.shop.id}', {'file': upload}, format='multipart')
+		self.assertEqual(resp.status_code, 200, resp.data)
+		self.assertEqual((resp.data['created'], resp.data['error_count']), (0, 1))
+		self.assertIn('UTF-8', resp.data['errors'][0]['errors']['non_field_errors'][0])
+
+
+class ProductRecommendationTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		self.tmp = tempfile.TemporaryDirectory()
+		self.addCleanup(self.tmp.cleanup)
+		override = override_settings(RECOMMENDATIONS_MATRIX_PATH=Path(self.tmp.name) / 'reco.npz')
+		override.enable()
+		self.addCleanup(override.disable)
+		User = get_user_model()
+		self.buyer = User.objects.create_user(username='buyer', email='buyer@example.com', password='pass12345')
+		owner = User.objects.create_user(username='owner', email='owner@example.com', password='pass12345', role='shop_owner')
+		shop = Shop.objects.create(owner=owner, name='Shop', city='Tunis')
+		self.tea, self.sugar, self.mint, self.soap = [
+			Product.objects.create(name=name, price='1.00', stock=100, shop=shop)
+			for name in ('Thé', 'Sucre', 'Menthe', 'Savon')
+		]
+
+	def _order(self, *products):
+		order = Order.objects.create(user=self.buyer)
+		for product in products:
+			OrderItem.objects.create(order=order, product=product, quantity=1, price=product.price)
+		return order
+
+	def _related(self, product):
+		return [(r.related_id, r.rank) for r in ProductRecommendation.objects.filter(product=product)]
+
+	def test_full_build_ranks_by_cosine_cooccurrence(self):
+		self._order(self.tea, self.sugar)
+		self._order(self.tea, self.sugar, self.mint)
+		self._order(self.tea, self.mint, self.mint)
+		Wishlist.objects.create(user=self.buyer, product=self.soap)
+		run = recommendations.build(top_k=5)
+		self.assertEqual(run.mode, 'full')
+		self.assertEqual(self._related(self.sugar), [(self.tea.id, 1), (self.mint.id, 2)])
+		# Soap was only wishlisted alone: no neighbours
+		self.assertEqual(self._related(self.soap), [])
+		top = ProductRecommendation.objects.get(product=self.sugar, rank=1)
+		self.assertAlmostEqual(top.score, 2 / (2 * 3) ** 0.5, places=6)
+
+	def test_incremental_run_matches_full_rebuild(self):
+		first = self._order(self.tea, self.sugar)
+		recommendations.build()
+		# New line on an existing order plus a new basket
+		OrderItem.objects.create(order=first, product=self.soap, quantity=1, price='1.00')
+		self._order(self.mint, self.soap)
+		Wishlist.objects.create(user=self.buyer, product=self.tea)
+		Wishlist.objects.create(user=self.buyer, product=self.mint)
+		run = recommendations.build(incremental=True, top_k=5)
+		self.assertEqual(run.mode, 'incremental')
+		incremental = sorted(ProductRecommendation.objects.values_list('product_id', 'related_id', 'rank', 'score'))
+		recommendations.build(top_k=5)
+		full = sorted(ProductRecommendation.objects.values_list('product_id', 'related_id', 'rank', 'score'))
+		self.assertEqual([row[:3] for row in incremental], [row[:3] for row in full])
+		for a, b in zip(incremental, full):
+			self.assertAlmostEqual(a[3], b[3], places=9)
+
+	def test_incremental_runs_rebuild_in_full_periodically(self):
+		order = self._order(self.tea, self.sugar)
+		self._order(self.mint, self.soap)
+		Wishlist.objects.create(user=self.buyer, product=self.tea)
+		Wishlist.objects.create(user=self.buyer, product=self.mint)
+		recommendations.build()
+		Order.objects.filter(pk=order.pk).update(status='cancelled')
+		Wishlist.objects.filter(product=self.mint).delete()
+		# Removals are not subtracted incrementally...
+		self.assertEqual(recommendations.build(incremental=True).mode, 'incremental')
+		self.assertIn((self.sugar.id, 1), self._related(self.tea))
+		# ...until the next full rebuild is due
+		RecommendationRun.objects.filter(mode='full').update(created_at=timezone.now() - timedelta(hours=25))
+		self.assertEqual(recommendations.build(incremental=True).mode, 'full')
+		self.assertEqual(self._related(self.tea), [])
+		self.assertEqual(self._related(self.mint), [(self.soap.id, 1)])
+
+	def test_multi_shop_checkout_is_one_basket(self):
+		other = Shop.objects.create(owner=self.tea.shop.owner, name='Other', city='Sousse')
+		olive = Product.objects.create(name='Olive', price='1.00', stock=100, shop=other)
+		recommendations.build()
+		client = APIClient()
+		client.force_authenticate(self.buyer)
+		payload = {
+			'orderItems': [{'product': p.id, 'quantity': 1, 'price': str(p.price)} for p in (self.tea, olive)],
+			'shippingAddress': 'Tunis', 'totalPrice': '0',
+		}
+		self.assertEqual(client.post('/api/orders/', payload, format='json').status_code, 201)
+		self.assertEqual(Order.objects.filter(parent__isnull=False).count(), 2)
+		# Lines live on the two per-shop sub-orders and still co-occur
+		recommendations.build(incremental=True)
+		self.assertEqual(self._related(olive), [(self.tea.id, 1)])
+		recommendations.build()
+		self.assertEqual(self._related(olive), [(self.tea.id, 1)])
+
+	def test_full_rebuild_drops_stale_neighbours_in_chunks(self):
+		order = self._order(self.tea, self.sugar)
+		self._order(self.mint, self.soap)
+		recommendations.build()
+		OrderItem.objects.filter(order=order).delete()
+		with patch.object(recommendations, 'IN_CLAUSE_SIZE', 1):
+			recommendations.build()
+		self.assertEqual(set(ProductRecommendation.objects.values_list('product_id', flat=True)), {self.mint.id, self.soap.id})
+
+	def test_related_endpoint(self):
+		self._order(self.tea, self.sugar)
+		self._order(self.tea, self.mint)
+		self._order(self.tea, self.mint)
+		call_command('build_recommendations', stdout=io.StringIO())
+		resp = APIClient().get(f'/api/products/{self.tea.id}/related/', {'limit': 1})
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual([item['id'] for item in resp.data['results']], [self.mint.id])
+		self.assertIn('score', resp.data['results'][0])
+		self.assertEqual(APIClient().get(f'/api/products/{self.tea.id}/related/', {'limit': 'x'}).status_code, 400)
+
+
+class TrendingProductsTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		User = get_user_model()
+		self.buyer = User.objects.create_user(username='buyer', email='buyer@example.com', password='pass12345')
+		owner = User.objects.create_user(username='owner', email='owner@example.com', password='pass12345', role='shop_owner')
+		self.shop = Shop.objects.create(owner=owner, name='Shop', city='Tunis')
+		self.food = Category.objects.create(name='Food')
+		self.old_hit, self.new_hit, self.other = [
+			Product.objects.create(name=name, price='1.00', stock=100, shop=self.shop, category=self.food)
+			for name in ('Old hit', 'New hit', 'Other')
+		]
+		self.client = APIClient()
+		self.client.force_authenticate(self.buyer)
+
+	def _buy(self, product, quantity):
+		payload = {
+			'orderItems': [{'product': product.id, 'quantity': quantity, 'price': '1.00'}],
+			'shippingAddress': 'Tunis', 'totalPrice': str(quantity),
+		}
+		self.assertEqual(self.client.post('/api/orders/', payload, format='json').status_code, 201)
+
+	def test_decay_weights_recent_sales(self):
+		now = timezone.now()
+		half_life = timedelta(seconds=trending.half_life_seconds())
+		score = trending.add_sale(None, 8, now - 3 * half_life)
+		self.assertAlmostEqual(trending.decayed(score, now), 1.0)
+		score = trending.add_sale(score, 1, now)
+		self.assertAlmostEqual(trending.decayed(score, now), 2.0)
+		self.assertAlmostEqual(trending.decayed(score, now + half_life), 1.0)
+
+	def test_order_creation_updates_score_and_endpoint_ranks(self):
+		self._buy(self.old_hit, 10)
+		# Ten units sold four half-lives ago weigh less than two units now
+		Product.objects.filter(pk=self.old_hit.pk).update(
+			trending_score=trending.add_sale(None, 10, timezone.now() - 4 * timedelta(seconds=trending.half_life_seconds()))
+		)
+		self._buy(self.new_hit, 1)
+		self._buy(self.new_hit, 1)
+		resp = APIClient().get('/api/products/trending/', {'category': self.food.id})
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual([item['id'] for item in resp.data['results']], [self.new_hit.id, self.old_hit.id])
+		self.assertAlmostEqual(resp.data['results'][0]['trending_score'], 2.0, places=3)
+		self.assertEqual(APIClient().get('/api/products/trending/', {'category': 0}).data['results'], [])
+
+	def test_rebuild_matches_incremental_scores(self):
+		self._buy(self.old_hit, 3)
+		self._buy(self.new_hit, 1)
+		self._buy(self.old_hit, 2)
+		before = dict(Product.objects.values_list('pk', 'trending_score'))
+		Product.objects.update(trending_score=None)
+		self.assertEqual(trending.rebuild(), 2)
+		after = dict(Product.objects.values_list('pk', 'trending_score'))
+		self.assertIsNone(after[self.other.pk])
+		for pk in (self.old_hit.pk, self.new_hit.pk):
+			self.assertAlmostEqual(before[pk], after[pk])
@@ -0,0 +1,94 @@
+"""Trending products: exponentially time-decayed sales velocity.
+
+A product's trend at time ``t`` is ``sum(q_i * 2 ** -((t - t_i) / half_life))``
+over its order lines. Factoring out ``2 ** (-t / half_life)``, which is the
+same for every product, leaves a value that only changes when a sale happens:
+
+    trending_score = log2(sum(q_i * 2 ** ((t_i - EPOCH) / half_life)))
+
+It is stored on ``Product`` (log2 keeps it inside float range for centuries),
+updated in O(1) when an order is placed and read back through an index, so
+ranking never scans orders. :func:`decayed` converts it to the current value.
+"""
+import math
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Value, When
+from django.db.models.functions import Greatest, Least, Log, Power
+from django.utils import timezone
+
+from .models import Product
+
+EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+DEFAULT_HALF_LIFE_HOURS = 72
+
+
+def half_life_seconds():
+    return getattr(settings, 'TRENDING_HALF_LIFE_HOURS', DEFAULT_HALF_LIFE_HOURS) * 3600.0
+
+
+def _exponent(at):
+    return (at - EPOCH).total_seconds() / half_life_seconds()
+
+
+def _log2_add(a, b):
+    """log2(2**a + 2**b) without overflowing."""
+    if a is None:
+        return b
+    high, low = max(a, b), min(a, b)
+    return high + math.log2(1 + 2 ** (low - high))
+
+
+def add_sale(score, quantity, at):
+    """Fold ``quantity`` units sold at ``at`` into a stored ``trending_score``."""
+    if quantity <= 0:
+        return score
+    return _log2_add(score, math.log2(quantity) + _exponent(at))
+
+
+def add_sale_expression(quantity, at, field='trending_score'):
+    """SQL twin of :func:`add_sale`, for UPDATEs that must not read the row first."""
+    value = Value(math.log2(quantity) + _exponent(at), output_field=FloatField())
+    current = F(field)
+    high, low = Greatest(current, value), Least(current, value)
+    return Case(
+        When(**{f'{field}__isnull': True}, then=value),
+        default=high + Log(Value(2.0), Value(1.0) + Power(Value(2.0), low - high)),
+        output_field=FloatField(),
+    )
+
+
+def decayed(score, at=None):
+    """Current decayed sales (units, weighted by age) for a stored score."""
+    if score is None:
+        return 0.0
+    return 2 ** (score - _exponent(at or timezone.now()))
+
+
+def trending(queryset, limit):
+    """Top ``limit`` products of ``queryset`` by trend, served from the trending indexes."""
+    return queryset.filter(trending_score__isnull=False).order_by('-trending_score', '-id')[:limit]
+
+
+def rebuild(chunk_size=2000):
+    """Recompute every score from order lines (after changing the half-life, or to drop cancelled orders)."""
+    from orders.models import OrderItem
+
+    scores = {}
+    lines = (
+        OrderItem.objects.exclude(order__status='cancelled')
+        .values_list('product_id', 'quantity', 'order__created_at')
+        .order_by()
+        .iterator(chunk_size=chunk_size)
+    )
+    for product_id, quantity, created_at in lines:
+        scores[product_id] = add_sale(scores.get(product_id), quantity, created_at)
+    with transaction.atomic():
+        Product.objects.filter(trending_score__isnull=False).update(trending_score=None)
+        ids = list(scores)
+        for start in range(0, len(ids), chunk_size):
+            batch = [Product(pk=pk, trending_score=scores[pk]) for pk in ids[start:start + chunk_size]]
+            Product.objects.bulk_update(batch, ['trending_score'])
+    return len(scores)
@@ -1,12 +1,17 @@
 
-from rest_framework import viewsets, permissions
+from rest_framework import viewsets, permissions, status
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from .models import Product
+from django.utils import timezone
+from .models import Product, ProductRecommendation
 from shops.models import Shop
-from .serializers import ProductSerializer
+from .serializers import ProductSerializer, ProductListSerializer
+from .pagination import ProductKeysetPagination
+from . import facets, importer, search, stock_shards, trending
 from categories.models import Category
 from categories.serializers import CategorySerializer
+from shopnow.conditional import ConditionalGetMixin, aggregate_version
+from shopnow.response_cache import ResponseCacheMixin
 
 
 class IsShopOwnerOrAdmin(permissions.BasePermission):
@@ -22,19 +27,23 @@ class IsShopOwnerOrAdmin(permissions.BasePermission):
         return getattr(obj, 'shop_id', None) is not None and user.shops.filter(id=obj.shop_id).exists()
 
     def has_permission(self, request, view):
-        if view.action in ['create', 'update', 'partial_update', 'destroy']:
+        if view.action in ['create', 'update', 'partial_update', 'destroy', 'bulk_import']:
             return request.user.is_authenticated and (request.user.is_staff or getattr(request.user, 'is_shop_owner', False))
         return True
 
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(ResponseCacheMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    cache_namespace = 'products'
 
     def get_queryset(self):
-        qs = super().get_queryset().select_related('shop')
+        qs = super().get_queryset().select_related('shop', 'category')
+        if self.action in ['retrieve', 'my']:
+            # Only the detail payload embeds reviews and their authors
+            qs = qs.prefetch_related('reviews__user')
         # Exclude products belonging to inactive shops ALWAYS unless staff explicitly asks include_inactive=1
-        if self.request.method == 'GET' and self.action in ['list', 'retrieve']:
+        if self.request.method == 'GET' and self.action in ['list', 'retrieve', 'search', 'facets', 'related', 'trending_products']:
             include_inactive = self.request.query_params.get('include_inactive') in ['1', 'true', 'True']
             if not (include_inactive and getattr(self.request.user, 'is_staff', False)):
                 qs = qs.filter(shop__is_active=True)
@@ -42,12 +51,52 @@ class ProductViewSet(viewsets.ModelViewSet):
         if shop_id:
             qs = qs.filter(shop_id=shop_id)
         category_id = self.request.query_params.get('category')
-        if category_id:
+        # The facets action reads a multi-valued ?category= itself
+        if category_id and self.action != 'facets':
             qs = qs.filter(category_id=category_id)
         return qs
 
+    def get_resource_version(self):
+        # Listing / detail show shop and category names: their edits count too
+        fields = ('updated_at', 'shop__updated_at', 'category__updated_at')
+        qs = self.get_queryset()
+        if self.action == 'retrieve':
+            try:
+                return aggregate_version(qs.filter(pk=int(self.kwargs['pk'])), *fields)
+            except (KeyError, ValueError):
+                return None
+        token, last_modified = aggregate_version(qs, *fields)
+        if not ProductKeysetPagination().is_requested(self.request):
+            # Legacy payload bundles every category
+            cat_token, cat_modified = aggregate_version(Category.objects.all())
+            token = f'{token}#{cat_token}'
+            last_modified = max(filter(None, [last_modified, cat_modified]), default=None)
+        return token, last_modified
+
+    def get_initial_cache_tags(self):
+        if self.action == 'retrieve':
+            return [f"product:{self.kwargs.get('pk')}"]
+        # The legacy listing bundles every category
+        return ['products', 'categories']
+
+    def get_cache_tags(self, data):
+        items = data.get('results', data.get('products')) if 'id' not in data else [data]
+        tags = []
+        for item in items or []:
+            tags.append(f"product:{item['id']}")
+            if item.get('shop'):
+                tags.append(f"shop:{item['shop']}")
+            if item.get('category'):
+                tags.append(f"category:{item['category']}")
+        return tags
+
+    def get_serializer_class(self):
+        if self.action in ['list', 'search', 'facets', 'related', 'trending_products']:
+            return ProductListSerializer
+        return ProductSerializer
+
     def get_permissions(self):
-        if self.action in ['create', 'update', 'partial_update', 'destroy']:
+        if self.action in ['create', 'update', 'partial_update', 'destroy', 'bulk_import']:
             return [IsShopOwnerOrAdmin()]
         return [permissions.AllowAny()]
 
@@ -60,8 +109,18 @@ class ProductViewSet(viewsets.ModelViewSet):
         - Fallback: if no valid shop provided for a non-staff owner, use their first shop.
         - If still none (e.g. admin without specifying), shop remains None (product will be hidden publicly).
         """
-        user = self.request.user
         shop_id = self.request.data.get('shop') or self.request.data.get('shop_id')
+        serializer.save(shop=self.resolve_shop(shop_id))
+
+    def perform_update(self, serializer):
+        product = serializer.save()
+        # Sharded stock lives in ProductStockShard rows: spread the new value over them
+        if product.stock_shard_count and 'stock' in serializer.validated_data:
+            stock_shards.set_stock(product, serializer.validated_data['stock'])
+
+    def resolve_shop(self, shop_id):
+        """Shop a new product may be attached to, following the perform_create rules."""
+        user = self.request.user
         shop = None
         if shop_id:
             try:
@@ -69,15 +128,21 @@ class ProductViewSet(viewsets.ModelViewSet):
                     shop = Shop.objects.get(id=shop_id)
                 else:
                     shop = Shop.objects.get(id=shop_id, owner=user)
-            except Shop.DoesNotExist:
+            except (Shop.DoesNotExist, ValueError):
                 shop = None
         if not shop and not user.is_staff:
             qs = getattr(user, 'shops', None)
             if qs:
                 shop = qs.first()
-        serializer.save(shop=shop)
+        return shop
 
     def list(self, request, *args, **kwargs):
+        # Keyset pagination when the client asks for it (?cursor / ?page_size / ?ordering).
+        # Categories are not bundled in that mode: fetch them from /api/categories/.
+        paginator = ProductKeysetPagination()
+        if paginator.is_requested(request):
+            page = paginator.paginate_queryset(self.get_queryset(), request, view=self)
+            return paginator.get_paginated_response(self.get_serializer(page, many=True).data)
         products_qs = self.get_queryset()
         products_data = self.get_serializer(products_qs, many=True).data
         categories_qs = Category.objects.all()
@@ -87,17 +152,108 @@ class ProductViewSet(viewsets.ModelViewSet):
             'categories': categories_data
         })
 
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """Ranked full-text search: ?q=terms (+ shop / category filters), paginated with ?page."""
+        query = request.query_params.get('q', '')
+        if not search.tokenize(query):
+            return Response({'error': 'q is required'}, status=status.HTTP_400_BAD_REQUEST)
+        ranked = search.rank(query, products=self.get_queryset())
+        page = self.paginate_queryset(ranked)
+        scores = dict(page)
+        products = self.get_queryset().in_bulk(scores.keys())
+        ordered = [products[pk] for pk in scores if pk in products]
+        data = self.get_serializer(ordered, many=True).data
+        for item in data:
+            item['score'] = round(scores[item['id']], 4)
+        return self.get_paginated_response(data)
+
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        """Filtered product page + facet counts.
+
+        Filters (comma separated, OR within a facet, AND across facets):
+        ?category=ids&city=names&price=bucket keys&status=available|unavailable
+        """
+        base = self.get_queryset()
+        selected = facets.parse_selection(request.query_params)
+        paginator = ProductKeysetPagination()
+        page = paginator.paginate_queryset(facets.apply_selection(base, selected), request, view=self)
+        response = paginator.get_paginated_response(self.get_serializer(page, many=True).data)
+        response.data['facets'] = facets.facet_counts(base, selected)
+        return response
+
+    @action(detail=False, methods=['get'], url_path='trending')
+    def trending_products(self, request):
+        """Best selling products right now (time-decayed sales), ?category= / ?shop= scoped, ?limit=N."""
+        try:
+            limit = min(max(int(request.query_params.get('limit', 20)), 1), 100)
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        products = list(trending.trending(self.get_queryset(), limit))
+        now = timezone.now()
+        data = self.get_serializer(products, many=True).data
+        for item, product in zip(data, products):
+            item['trending_score'] = round(trending.decayed(product.trending_score, now), 4)
+        return Response({'results': data})
+
+    @action(detail=True, methods=['get'])
+    def related(self, request, pk=None):
+        """Frequently bought together (built by ``manage.py build_recommendations``): ?limit=N, best first."""
+        product = self.get_object()
+        try:
+            limit = min(max(int(request.query_params.get('limit', 10)), 1), 50)
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        recommendations = (
+            ProductRecommendation.objects.filter(product=product, related__shop__is_active=True)
+            .select_related('related__shop', 'related__category')
+            .order_by('rank')[:limit]
+        )
+        recommendations = list(recommendations)
+        data = self.get_serializer([r.related for r in recommendations], many=True).data
+        for item, recommendation in zip(data, recommendations):
+            item['score'] = round(recommendation.score, 4)
+        return Response({'product': product.id, 'results': data})
+
+    @action(detail=False, methods=['post'], url_path='import')
+    def bulk_import(self, request):
+        """Upsert products by SKU from a CSV / JSONL upload (multipart ``file``) or raw request body.
+
+        ?shop=<id> selects the target shop (owners default to their first shop);
+        ?input_format=csv|jsonl overrides detection from the file name / content type.
+        """
+        if request.content_type.startswith('multipart/'):
+            upload = request.FILES.get('file')
+            if upload is None:
+                return Response({'error': 'file is required'}, status=status.HTTP_400_BAD_REQUEST)
+            stream, fmt = upload, importer.detect_format(upload.name, upload.content_type)
+            shop_id = request.query_params.get('shop') or request.data.get('shop')
+        else:
+            # Raw body: read straight from the request stream
+            stream, fmt = request.stream, importer.detect_format(content_type=request.content_type)
+            shop_id = request.query_params.get('shop')
+        fmt = request.query_params.get('input_format') or fmt
+        if fmt not in importer.FORMATS or stream is None:
+            return Response({'error': 'input_format must be csv or jsonl'}, status=status.HTTP_400_BAD_REQUEST)
+        shop = self.resolve_shop(shop_id)
+        if shop is None:
+            return Response({'error': 'Shop introuvable'}, status=status.HTTP_400_BAD_REQUEST)
+        report = importer.import_products(stream, shop, fmt=fmt)
+        report['shop_id'] = shop.id
+        return Response(report)
+
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAdminUser])
     def recalc_rating(self, request, pk=None):
-        """Force recalcul de la note moyenne (utile si batch update avis)."""
+        """Force recalcul des agrégats de notes (utile si batch update avis)."""
         product = self.get_object()
-        reviews = product.reviews.all()
-        if not reviews:
-            rating = 0
-        else:
-            rating = sum(r.rating for r in reviews) / reviews.count()
-        # Pas de champ persistant rating: juste renvoi
-        return Response({'id': product.id, 'rating': rating})
+        product = Product.rebuild_ratings([product.pk])[0]
+        return Response({
+            'id': product.id,
+            'rating': float(product.rating_avg),
+            'rating_count': product.rating_count,
+            'rating_histogram': product.rating_histogram,
+        })
 
     @action(detail=False, methods=['get'], permission_classes=[permissions.IsAuthenticated])
     def my(self, request):
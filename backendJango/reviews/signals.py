@@ -0,0 +1,41 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from products.models import Product
+from shopnow import response_cache
+from .models import Review
+
+
+@receiver(pre_save, sender=Review)
+def remember_previous_rating(sender, instance, **kwargs):
+    """Keep the stored (product, rating) so post_save can apply the exact delta."""
+    instance._previous_rating = None
+    if instance.pk:
+        instance._previous_rating = (
+            Review.objects.filter(pk=instance.pk).values_list('product_id', 'rating').first()
+        )
+
+
+@receiver(post_save, sender=Review)
+def apply_review_saved(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_rating', None)
+    if created or previous is None:
+        Product.adjust_rating(instance.product_id, add=instance.rating)
+        return
+    old_product_id, old_rating = previous
+    if old_product_id == instance.product_id:
+        Product.adjust_rating(instance.product_id, add=instance.rating, remove=old_rating)
+    else:
+        Product.adjust_rating(old_product_id, remove=old_rating)
+        Product.adjust_rating(instance.product_id, add=instance.rating)
+
+
+@receiver(post_delete, sender=Review)
+def apply_review_deleted(sender, instance, **kwargs):
+    Product.adjust_rating(instance.product_id, remove=instance.rating)
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_review_responses(sender, instance, **kwargs):
+    # Ratings appear in listings, reviews in the product detail
+    response_cache.invalidate('products', f'product:{instance.product_id}')
@@ -1,3 +1,48 @@
+from decimal import Decimal
+from io import StringIO
+from django.core.management import call_command
 from django.test import TestCase
+from django.contrib.auth import get_user_model
+from products.models import Product
+from .models import Review
 
-# Create your tests here.
+
+class ProductRatingAggregateTests(TestCase):
+	def setUp(self):
+		User = get_user_model()
+		self.users = [
+			User.objects.create_user(username=f'u{i}', email=f'u{i}@example.com', password='pass12345')
+			for i in range(3)
+		]
+		self.product = Product.objects.create(name='Rated', price='5.00', stock=1)
+
+	def _review(self, user, rating):
+		return Review.objects.create(product=self.product, user=user, rating=rating, title='t', comment='c')
+
+	def test_create_update_delete_keep_aggregates(self):
+		r1 = self._review(self.users[0], 5)
+		self._review(self.users[1], 2)
+		self.product.refresh_from_db()
+		self.assertEqual((self.product.rating_sum, self.product.rating_count), (7, 2))
+		self.assertEqual(self.product.rating_avg, Decimal('3.50'))
+
+		r1.rating = 4
+		r1.save()
+		self.product.refresh_from_db()
+		self.assertEqual(self.product.rating_histogram, {1: 0, 2: 1, 3: 0, 4: 1, 5: 0})
+		self.assertEqual(self.product.rating_avg, Decimal('3.00'))
+
+		r1.delete()
+		self.product.refresh_from_db()
+		self.assertEqual((self.product.rating_sum, self.product.rating_count), (2, 1))
+		self.assertEqual(self.product.rating_avg, Decimal('2.00'))
+
+	def test_rebuild_command_matches_incremental_values(self):
+		for user, rating in zip(self.users, [1, 4, 4]):
+			self._review(user, rating)
+		Product.objects.filter(pk=self.product.pk).update(rating_sum=0, rating_count=0, rating_avg=0, rating_4_count=0)
+		call_command('rebuild_product_ratings', stdout=StringIO())
+		self.product.refresh_from_db()
+		self.assertEqual((self.product.rating_sum, self.product.rating_count), (9, 3))
+		self.assertEqual(self.product.rating_avg, Decimal('3.00'))
+		self.assertEqual(self.product.rating_histogram[4], 2)
@@ -3,10 +3,13 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAdminUser
 from django.contrib.auth import get_user_model
 from django.utils.timezone import now, timedelta
-from django.db.models import Count, Sum
+from django.db.models import Count
 from products.models import Product
+from products import stock_shards
 from categories.models import Category
 from orders.models import Order
+from orders import rollups
+from shopnow import response_cache
 
 
 class AdminStatsView(APIView):
@@ -17,8 +20,10 @@ class AdminStatsView(APIView):
         user_count = User.objects.count() or 0
         product_count = Product.objects.count() or 0
         order_qs = Order.objects.all()
-        total_orders = order_qs.count() or 0
-        total_revenue = order_qs.aggregate(s=Sum('total_price'))['s'] or 0
+        # Order totals come from the daily rollup rows, not a scan of the orders table
+        totals = rollups.summary()
+        total_orders = totals['orders']
+        total_revenue = totals['revenue']
 
         # Recent activity windows
         last_7 = now() - timedelta(days=7)
@@ -55,12 +60,14 @@ class AdminStatsView(APIView):
         ]
 
         # Low stock products (stock < 5) limit 10
-        low_stock_qs = Product.objects.filter(stock__lt=5).order_by('stock', '-updated_at' if hasattr(Product, 'updated_at') else 'id')[:10]
+        # Sharded products: sum their shards without locking them (folding is left to the refresh job)
+        low_stock_qs = stock_shards.with_live_stock(Product.objects.all()).filter(live_stock__lt=5)
+        low_stock_qs = low_stock_qs.order_by('live_stock', '-updated_at' if hasattr(Product, 'updated_at') else 'id')[:10]
         low_stock_products = [
             {
                 'id': p.id,
                 'name': p.name,
-                'stock': p.stock,
+                'stock': p.live_stock,
                 'price': float(p.price),
             } for p in low_stock_qs
         ]
@@ -75,3 +82,11 @@ class AdminStatsView(APIView):
             'topCategories': top_categories,
             'lowStockProducts': low_stock_products,
         })
+
+
+class ResponseCacheStatsView(APIView):
+    """Hit / miss counters of the public catalog response cache."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(response_cache.stats(['products', 'shops', 'categories']))
@@ -0,0 +1,91 @@
+"""Conditional GET (ETag / Last-Modified) for read-mostly viewsets.
+
+A viewset using :class:`ConditionalGetMixin` implements ``get_resource_version()``
+returning a cheap version of what ``list`` / ``retrieve`` would serialize: usually
+``(max(updated_at), row count)`` from one aggregate query. When the client's
+``If-None-Match`` matches, a 304 is returned before the handler runs, so nothing
+is serialized.
+
+Only the ETag is honoured: ``If-Modified-Since`` has one-second resolution and
+cannot see deletes or rows leaving a filtered list, so it never produces a 304.
+Last-Modified is still sent on ``retrieve`` responses, never on lists.
+"""
+import hashlib
+from calendar import timegm
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+
+class _NotModified(Exception):
+    def __init__(self, response):
+        super().__init__('not modified')
+        self.response = response
+
+
+def aggregate_version(queryset, *timestamp_fields):
+    """Return (token, last_modified) from one aggregate over ``queryset``."""
+    fields = timestamp_fields or ('updated_at',)
+    aggregates = {f'v{i}': Max(field) for i, field in enumerate(fields)}
+    row = queryset.order_by().aggregate(n=Count('pk'), **aggregates)
+    stamps = [row[key] for key in aggregates if row[key] is not None]
+    token = '|'.join([str(row['n'])] + [row[key].isoformat() if row[key] else '-' for key in aggregates])
+    return token, max(stamps) if stamps else None
+
+
+class ConditionalGetMixin:
+    conditional_actions = ('list', 'retrieve')
+
+    def get_resource_version(self):
+        """Return ``(token, last_modified)`` for the current request, or None to skip."""
+        raise NotImplementedError
+
+    def get_cached_validators(self):
+        """Return ``(etag, timestamp)`` already known for this request (response cache hit)."""
+        return None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self._validators = None
+        if request.method not in ('GET', 'HEAD') or self.action not in self.conditional_actions:
+            return
+        self._validators = self.get_cached_validators() or self._compute_validators(request)
+        if self._validators is None:
+            return
+        etag, _ = self._validators
+        response = get_conditional_response(request, etag=etag)
+        if response is not None:
+            raise _NotModified(self._set_validators(response))
+
+    def _compute_validators(self, request):
+        version = self.get_resource_version()
+        if version is None:
+            return None
+        token, last_modified = version
+        # Same data renders differently per URL (filters, cursor) and for staff (include_inactive)
+        user = getattr(request, 'user', None)
+        scope = 'staff' if getattr(user, 'is_staff', False) else 'public'
+        digest = hashlib.md5(f'{request.get_full_path()}|{scope}|{token}'.encode('utf-8')).hexdigest()
+        timestamp = None
+        if last_modified and self.action != 'list':
+            timestamp = timegm(last_modified.utctimetuple())
+        return f'W/"{digest}"', timestamp
+
+    def handle_exception(self, exc):
+        if isinstance(exc, _NotModified):
+            return exc.response
+        return super().handle_exception(exc)
+
+    def _set_validators(self, response):
+        etag, timestamp = self._validators
+        response['ETag'] = etag
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+        return response
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if getattr(self, '_validators', None) and response.status_code == 200:
+            self._set_validators(response)
+        return response
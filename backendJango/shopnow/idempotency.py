@@ -0,0 +1,164 @@
+"""``Idempotency-Key`` support for POST endpoints that must not run twice.
+
+Decorate a DRF handler (``APIView.post`` or an ``@api_view`` function) with
+:func:`idempotent`. When the client sends an ``Idempotency-Key`` header:
+
+* the first request inserts an ``IdempotencyRecord`` row (unique on user,
+  scope and key) before running; the row is the lock: a concurrent duplicate
+  fails to insert it and waits up to ``IDEMPOTENCY_WAIT_SECONDS`` for the
+  first response, then gets a 409;
+* the rendered response (status, bytes, content type) is stored for
+  ``IDEMPOTENCY_TTL_SECONDS`` and replayed byte for byte on retries, which
+  cost one lookup on the unique index;
+* reusing a key with a different body is refused with a 422;
+* 5xx responses and exceptions are not stored: the key can be retried.
+
+Requests without the header behave exactly as before.
+"""
+import hashlib
+import time
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+POLL_INTERVAL = 0.1
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _record_model():
+    from orders.models import IdempotencyRecord
+    return IdempotencyRecord
+
+
+def _lookup(user, scope, key):
+    return _record_model().objects.filter(user=user, scope=scope, key=key).first()
+
+
+def _replay(record):
+    response = HttpResponse(bytes(record.content or b''), status=record.status_code, content_type=record.content_type)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _error(message, code):
+    return Response({'error': message}, status=code)
+
+
+def _render(request, response):
+    """Render a DRF Response now (as finalize_response would) so its bytes can be stored."""
+    if isinstance(response, Response) and not response.is_rendered:
+        view = request.parser_context.get('view') if request.parser_context else None
+        response.accepted_renderer = request.accepted_renderer
+        response.accepted_media_type = request.accepted_media_type
+        response.renderer_context = view.get_renderer_context() if view else {'request': request}
+        response.render()
+    return response
+
+
+def _claim(user, scope, key, fingerprint):
+    """Insert the in-progress row; returns (record, owned)."""
+    model = _record_model()
+    now = timezone.now()
+    lock = timedelta(seconds=_setting('IDEMPOTENCY_LOCK_SECONDS', 30))
+    try:
+        with transaction.atomic():
+            record = model.objects.create(
+                user=user, scope=scope, key=key, request_hash=fingerprint,
+                locked_until=now + lock,
+                expires_at=now + timedelta(seconds=_setting('IDEMPOTENCY_TTL_SECONDS', 86400)),
+            )
+        return record, True
+    except IntegrityError:
+        record = _lookup(user, scope, key)
+    if record is None:
+        return _claim(user, scope, key, fingerprint)
+    # Take over a lock abandoned by a crashed worker
+    taken = model.objects.filter(pk=record.pk, status_code__isnull=True, locked_until__lt=now).update(locked_until=now + lock)
+    return record, bool(taken)
+
+
+def _wait(user, scope, key):
+    deadline = time.monotonic() + _setting('IDEMPOTENCY_WAIT_SECONDS', 5)
+    while time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        record = _lookup(user, scope, key)
+        if record is None or record.status_code is not None:
+            return record
+    return None
+
+
+def _handle(request, scope, key, run):
+    user = request.user
+    fingerprint = hashlib.sha256(request.body).hexdigest()
+    record = _lookup(user, scope, key)
+    if record is not None and record.expires_at <= timezone.now():
+        record.delete()
+        record = None
+    if record is not None and record.status_code is not None:
+        if record.request_hash != fingerprint:
+            return _error(f'{HEADER} déjà utilisée avec une autre requête', status.HTTP_422_UNPROCESSABLE_ENTITY)
+        return _replay(record)
+
+    record, owned = _claim(user, scope, key, fingerprint)
+    if record.request_hash != fingerprint:
+        return _error(f'{HEADER} déjà utilisée avec une autre requête', status.HTTP_422_UNPROCESSABLE_ENTITY)
+    if not owned:
+        done = _wait(user, scope, key)
+        if done is not None and done.status_code is not None:
+            return _replay(done)
+        return _error('Une requête identique est en cours de traitement', status.HTTP_409_CONFLICT)
+
+    try:
+        response = _render(request, run())
+    except BaseException:
+        record.delete()
+        raise
+    if response.status_code >= 500 or not hasattr(response, 'content'):
+        record.delete()
+        return response
+    record.status_code = response.status_code
+    record.content = response.content
+    record.content_type = response.get('Content-Type', '')
+    record.locked_until = None
+    record.save(update_fields=['status_code', 'content', 'content_type', 'locked_until'])
+    return response
+
+
+def idempotent(scope):
+    """Decorator making a DRF POST handler honour the ``Idempotency-Key`` header."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            request = next(arg for arg in args if isinstance(arg, Request))
+            key = request.headers.get(HEADER)
+            if not key or not request.user.is_authenticated:
+                return func(*args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return _error(f'{HEADER} trop longue (max {MAX_KEY_LENGTH})', status.HTTP_400_BAD_REQUEST)
+            return _handle(request, scope, key, lambda: func(*args, **kwargs))
+        return wrapper
+    return decorator
+
+
+def purge_expired(batch_size=1000):
+    """Delete expired records in batches; returns how many were deleted."""
+    model = _record_model()
+    now = timezone.now()
+    deleted = 0
+    while True:
+        ids = list(model.objects.filter(expires_at__lte=now).values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += model.objects.filter(pk__in=ids).delete()[0]
@@ -0,0 +1,156 @@
+"""Transactional outbox: side effects that run after commit, out of the request.
+
+Write an event with :func:`publish` inside the transaction that causes it
+(e.g. from ``Order.save``): it is committed or rolled back together with the
+data, so no event is lost or sent for a rolled-back change, and no broker is
+needed. ``manage.py run_outbox_worker`` then:
+
+* claims due events in batches (``SELECT ... FOR UPDATE SKIP LOCKED`` where
+  the database supports it, plus a lease: ``locked_until``), so several
+  workers can run side by side;
+* runs every handler registered for the event's topic;
+* marks the event done, or on failure schedules a retry with exponential
+  backoff, giving up (status ``failed``) after ``OUTBOX_MAX_ATTEMPTS``.
+
+Delivery is at least once: handlers must be idempotent. Register them with
+:func:`handler` in an ``outbox_handlers`` module of any installed app; the
+worker imports those modules at start-up.
+"""
+import logging
+import os
+import socket
+import traceback
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import autodiscover_modules
+
+logger = logging.getLogger(__name__)
+
+_handlers = defaultdict(list)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _event_model():
+    from orders.models import OutboxEvent
+    return OutboxEvent
+
+
+def handler(topic):
+    """Decorator registering ``func(payload, event)`` for ``topic``."""
+    def decorator(func):
+        if func not in _handlers[topic]:
+            _handlers[topic].append(func)
+        return func
+    return decorator
+
+
+def handlers_for(topic):
+    return list(_handlers.get(topic, ()))
+
+
+def autodiscover():
+    autodiscover_modules('outbox_handlers')
+
+
+def publish(topic, payload, delay=0):
+    """Add an event to the current transaction."""
+    return _event_model().objects.create(
+        topic=topic, payload=payload, available_at=timezone.now() + timedelta(seconds=delay),
+    )
+
+
+def publish_many(topic, payloads):
+    """Add one event per payload with a single INSERT."""
+    model = _event_model()
+    now = timezone.now()
+    return model.objects.bulk_create([model(topic=topic, payload=payload, available_at=now) for payload in payloads])
+
+
+def worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def claim(batch_size=100, worker=None, lease_seconds=None):
+    """Lease up to ``batch_size`` due events to ``worker`` and return them."""
+    model = _event_model()
+    now = timezone.now()
+    lease = now + timedelta(seconds=lease_seconds or _setting('OUTBOX_LEASE_SECONDS', 60))
+    worker = worker or worker_id()
+    due = model.objects.filter(
+        Q(locked_until__isnull=True) | Q(locked_until__lt=now),
+        status='pending', available_at__lte=now,
+    ).order_by('available_at', 'id')
+    with transaction.atomic():
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        ids = list(due.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return []
+        # The lease, not the row lock, keeps other workers away once this commits
+        model.objects.filter(pk__in=ids).update(locked_until=lease, locked_by=worker)
+    return list(model.objects.filter(pk__in=ids, locked_by=worker).order_by('available_at', 'id'))
+
+
+def backoff(attempts):
+    """Delay before retry number ``attempts`` (1-based): base * 2**(attempts-1), capped."""
+    base = _setting('OUTBOX_BACKOFF_SECONDS', 5)
+    return timedelta(seconds=min(base * 2 ** max(attempts - 1, 0), _setting('OUTBOX_MAX_BACKOFF_SECONDS', 3600)))
+
+
+def dispatch(event):
+    """Run the handlers of one claimed event and record the outcome; returns True on success."""
+    model = _event_model()
+    pending = model.objects.filter(pk=event.pk, locked_by=event.locked_by, locked_until=event.locked_until)
+    try:
+        handlers = handlers_for(event.topic)
+        if not handlers:
+            raise LookupError(f'No outbox handler registered for {event.topic!r}')
+        with transaction.atomic():
+            for func in handlers:
+                func(event.payload, event)
+    except Exception:
+        attempts = event.attempts + 1
+        gave_up = attempts >= _setting('OUTBOX_MAX_ATTEMPTS', 8)
+        error = traceback.format_exc(limit=5)
+        logger.warning('Outbox event %s (%s) failed, attempt %s%s', event.pk, event.topic, attempts, ', giving up' if gave_up else '')
+        pending.update(
+            status='failed' if gave_up else 'pending', attempts=attempts, last_error=error,
+            available_at=timezone.now() + backoff(attempts), locked_until=None, locked_by='',
+        )
+        return False
+    pending.update(
+        status='done', attempts=event.attempts + 1, processed_at=timezone.now(),
+        last_error='', locked_until=None, locked_by='',
+    )
+    return True
+
+
+def run_once(batch_size=100, worker=None):
+    """Claim and dispatch one batch; returns ``(succeeded, failed)``."""
+    succeeded = failed = 0
+    for event in claim(batch_size=batch_size, worker=worker):
+        if dispatch(event):
+            succeeded += 1
+        else:
+            failed += 1
+    return succeeded, failed
+
+
+def purge_done(older_than_seconds, batch_size=1000):
+    """Delete events processed more than ``older_than_seconds`` ago; returns the count."""
+    model = _event_model()
+    cutoff = timezone.now() - timedelta(seconds=older_than_seconds)
+    deleted = 0
+    while True:
+        ids = list(model.objects.filter(status='done', processed_at__lt=cutoff).values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += model.objects.filter(pk__in=ids).delete()[0]
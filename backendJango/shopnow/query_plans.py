@@ -0,0 +1,59 @@
+"""EXPLAIN helpers for query plan regression tests.
+
+:func:`full_scans` runs the database's EXPLAIN on a SQL statement (e.g. one
+captured with ``CaptureQueriesContext`` while calling a view) and returns
+the tables it reads with a full table scan. Walking a whole index counts as
+a full scan too, unless the statement has a LIMIT (``ORDER BY
+indexed_column LIMIT n`` stops after n entries).
+
+Supported: SQLite (``EXPLAIN QUERY PLAN``), MySQL / MariaDB (``type = ALL``)
+and PostgreSQL (``Seq Scan``).
+"""
+import re
+
+from django.db import connection
+
+_SQLITE_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(.*)$')
+_POSTGRES_SCAN = re.compile(r'Seq Scan on (\w+)')
+_LIMIT = re.compile(r'\bLIMIT\b', re.IGNORECASE)
+
+
+def analyze(tables):
+    """Refresh planner statistics of ``tables`` after seeding test data."""
+    with connection.cursor() as cursor:
+        for table in tables:
+            name = connection.ops.quote_name(table)
+            if connection.vendor == 'mysql':
+                cursor.execute(f'ANALYZE TABLE {name}')
+                cursor.fetchall()
+            else:
+                cursor.execute(f'ANALYZE {name}')
+
+
+def explain(sql, params=None):
+    """Raw plan rows of ``sql``, as dicts (column name -> value)."""
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+    with connection.cursor() as cursor:
+        cursor.execute(prefix + sql, params)
+        columns = [col[0] for col in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def full_scans(sql, tables, params=None):
+    """Names among ``tables`` that ``sql`` reads with a full table scan."""
+    tables = set(tables)
+    limited = bool(_LIMIT.search(sql))
+    scanned = set()
+    for row in explain(sql, params):
+        if connection.vendor == 'sqlite':
+            match = _SQLITE_SCAN.match(row['detail'])
+            if match and ('INDEX' not in match.group(2) or not limited):
+                scanned.add(match.group(1))
+        elif connection.vendor == 'mysql':
+            if row.get('type') == 'ALL' or (row.get('type') == 'index' and not limited):
+                scanned.add(row.get('table'))
+        elif connection.vendor == 'postgresql':
+            scanned.update(_POSTGRES_SCAN.findall(next(iter(row.values()))))
+        else:
+            raise NotImplementedError(f'No plan parser for {connection.vendor}')
+    return sorted(scanned & tables)
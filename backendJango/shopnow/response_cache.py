@@ -0,0 +1,221 @@
+"""Tag-invalidated response cache for anonymous catalog reads.
+
+Each cached response remembers the tags it depends on (``product:12``,
+``shop:3``, ``products``...) together with the version each tag had when it
+was stored. Invalidating a tag just increments its version, so every entry
+depending on it is treated as a miss on its next read: no key enumeration
+and no reliance on TTLs for freshness.
+
+Versions live in the Django cache, so responses are only cached when
+``RESPONSE_CACHE_ENABLED`` is set, which the settings do when a shared backend
+(``REDIS_URL``) is configured: with a per-process cache the invalidations of one
+worker would never reach the others.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.http import parse_http_date_safe
+
+KEY_PREFIX = 'respcache'
+STATS_KEY = f'{KEY_PREFIX}:stats'
+
+
+def _cache():
+    return caches[getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default')]
+
+
+def enabled():
+    return getattr(settings, 'RESPONSE_CACHE_ENABLED', False)
+
+
+def _timeout():
+    return getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 3600)
+
+
+def _tag_key(tag):
+    return f'{KEY_PREFIX}:tag:{tag}'
+
+
+def _bump(tags):
+    cache = _cache()
+    for tag in tags:
+        key = _tag_key(tag)
+        # add() is a no-op when the key exists; incr() is atomic on shared backends
+        cache.add(key, 0, timeout=None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, timeout=None)
+
+
+def invalidate(*tags):
+    """Invalidate every cached response depending on ``tags``.
+
+    Bumped immediately and again after commit, so a read racing with the
+    write cannot re-cache the pre-commit state.
+    """
+    tags = [t for t in tags if t]
+    if not tags:
+        return
+    _bump(tags)
+    transaction.on_commit(lambda: _bump(tags))
+
+
+def invalidate_products(product_ids=(), shop_ids=()):
+    """Helper for bulk writers (queryset.update / bulk_update) that bypass signals."""
+    invalidate(
+        'products',
+        *[f'product:{pk}' for pk in product_ids],
+        *[f'shop-products:{pk}' for pk in shop_ids],
+    )
+
+
+def _record(outcome, namespace):
+    cache = _cache()
+    for key in (f'{STATS_KEY}:{outcome}', f'{STATS_KEY}:{namespace}:{outcome}'):
+        cache.add(key, 0, timeout=None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, timeout=None)
+
+
+def stats(namespaces=()):
+    cache = _cache()
+    keys = [f'{STATS_KEY}:hit', f'{STATS_KEY}:miss']
+    for ns in namespaces:
+        keys += [f'{STATS_KEY}:{ns}:hit', f'{STATS_KEY}:{ns}:miss']
+    values = cache.get_many(keys)
+    data = {
+        'hits': values.get(f'{STATS_KEY}:hit', 0),
+        'misses': values.get(f'{STATS_KEY}:miss', 0),
+        'by_namespace': {},
+    }
+    for ns in namespaces:
+        data['by_namespace'][ns] = {
+            'hits': values.get(f'{STATS_KEY}:{ns}:hit', 0),
+            'misses': values.get(f'{STATS_KEY}:{ns}:miss', 0),
+        }
+    return data
+
+
+def get_entry(key, namespace):
+    cache = _cache()
+    entry = cache.get(key)
+    if entry is not None:
+        current = cache.get_many([_tag_key(t) for t in entry['tags']])
+        if all(current.get(_tag_key(t), 0) == v for t, v in entry['tags'].items()):
+            _record('hit', namespace)
+            return entry
+    _record('miss', namespace)
+    return None
+
+
+def snapshot(tags):
+    """Current versions of ``tags``, taken before the response is computed."""
+    keys = {_tag_key(t): t for t in tags}
+    current = _cache().get_many(list(keys))
+    return {t: current.get(k, 0) for k, t in keys.items()}
+
+
+def store_entry(key, response, tags, known_versions=None):
+    """Store a rendered response under ``key``.
+
+    ``known_versions`` (from :func:`snapshot`) wins over the versions read now:
+    a write that lands while the response was being built then makes the
+    entry stale immediately instead of being hidden by it.
+    """
+    cache = _cache()
+    known_versions = known_versions or {}
+    tags = sorted(set(tags) | set(known_versions))
+    versions = cache.get_many([_tag_key(t) for t in tags if t not in known_versions])
+    entry = {
+        'tags': {t: known_versions[t] if t in known_versions else versions.get(_tag_key(t), 0) for t in tags},
+        'content': response.content,
+        'content_type': response['Content-Type'],
+        'headers': {h: response[h] for h in ('ETag', 'Last-Modified', 'Cache-Control') if response.has_header(h)},
+    }
+    cache.set(key, entry, timeout=_timeout())
+
+
+def to_response(entry):
+    response = HttpResponse(entry['content'], content_type=entry['content_type'])
+    for header, value in entry['headers'].items():
+        response[header] = value
+    response['X-Cache'] = 'HIT'
+    return response
+
+
+class _CacheHit(Exception):
+    def __init__(self, response):
+        super().__init__('cache hit')
+        self.response = response
+
+
+class ResponseCacheMixin:
+    """Serve anonymous list/retrieve GETs from the tag-invalidated cache.
+
+    Views implement ``get_initial_cache_tags()`` (tags known from the URL alone,
+    snapshotted before the handler runs) and ``get_cache_tags(data)`` returning
+    the tags the rendered payload depends on. Place before ``ConditionalGetMixin`` in the bases so a
+    hit can answer revalidations from the stored validators without a query.
+    """
+    cache_namespace = None
+    cached_actions = ('list', 'retrieve')
+
+    def get_initial_cache_tags(self):
+        return []
+
+    def get_cache_tags(self, data):
+        raise NotImplementedError
+
+    def _response_cache_key(self, request):
+        if not enabled() or request.method != 'GET' or self.action not in self.cached_actions:
+            return None
+        if request.user.is_authenticated:
+            return None
+        params = sorted((k, sorted(v)) for k, v in request.query_params.lists())
+        query = '&'.join(f'{k}={",".join(v)}' for k, v in params)
+        pk = self.kwargs.get(self.lookup_url_kwarg or self.lookup_field, '')
+        # Rendered bytes depend on the negotiated renderer (JSON vs browsable API)
+        accept = hashlib.md5(request.META.get('HTTP_ACCEPT', '').encode('utf-8')).hexdigest()[:8]
+        return f'{KEY_PREFIX}:{self.cache_namespace}:{self.action}:{pk}:{query}:{accept}'
+
+    def get_cached_validators(self):
+        entry = getattr(self, '_cache_entry', None)
+        if not entry:
+            return None
+        etag = entry['headers'].get('ETag')
+        if not etag:
+            return None
+        return etag, parse_http_date_safe(entry['headers'].get('Last-Modified', ''))
+
+    def initial(self, request, *args, **kwargs):
+        self._cache_entry = None
+        self._cache_versions = None
+        self._cache_key = self._response_cache_key(request)
+        if self._cache_key:
+            self._cache_entry = get_entry(self._cache_key, self.cache_namespace)
+            if not self._cache_entry:
+                self._cache_versions = snapshot(self.get_initial_cache_tags())
+        super().initial(request, *args, **kwargs)
+        if self._cache_entry:
+            raise _CacheHit(to_response(self._cache_entry))
+
+    def handle_exception(self, exc):
+        if isinstance(exc, _CacheHit):
+            return exc.response
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if getattr(self, '_cache_key', None) and not self._cache_entry and response.status_code == 200 \
+                and hasattr(response, 'data'):
+            tags = self.get_cache_tags(response.data)
+            response.render()
+            store_entry(self._cache_key, response, tags, self._cache_versions)
+            response['X-Cache'] = 'MISS'
+        return response
@@ -16,6 +16,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
+from corsheaders.defaults import default_headers
 import os
 from dotenv import load_dotenv
 
@@ -111,6 +112,57 @@ DATABASES = {
 }
 
 
+# Cache
+# The public catalog response cache (shopnow.response_cache) keeps its tag versions here:
+# use a shared backend (Redis) as soon as more than one worker process serves requests.
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+RESPONSE_CACHE_TIMEOUT = 3600
+# Only with a shared backend: a per-process LocMemCache never sees the other workers'
+# invalidations and would keep serving stale catalog responses
+RESPONSE_CACHE_ENABLED = bool(REDIS_URL)
+
+# Stock engine used when placing orders (orders.placement): 'pessimistic' locks the
+# cart's product rows, 'optimistic' takes stock with one guarded UPDATE (flash sales)
+ORDER_STOCK_ENGINE = os.getenv('ORDER_STOCK_ENGINE', 'pessimistic')
+# Max staleness of Product.stock for products with sharded stock (products.stock_shards)
+STOCK_SHARD_REFRESH_SECONDS = 5
+# How long a checkout holds its cart's stock (orders.reservations)
+STOCK_RESERVATION_TTL_SECONDS = 900
+# Orders still pending this long after creation with one of these payment methods and no
+# payment reference are cancelled and restocked (manage.py expire_pending_orders)
+PENDING_ORDER_EXPIRY_MINUTES = 60
+PENDING_ORDER_EXPIRY_PAYMENT_METHODS = ('stripe', 'card', 'd17')
+
+# Idempotency-Key handling for order / payment creation (shopnow.idempotency)
+IDEMPOTENCY_TTL_SECONDS = 24 * 3600
+IDEMPOTENCY_LOCK_SECONDS = 30
+IDEMPOTENCY_WAIT_SECONDS = 5
+
+# Transactional outbox (shopnow.outbox, manage.py run_outbox_worker)
+OUTBOX_LEASE_SECONDS = 60
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_BACKOFF_SECONDS = 5
+OUTBOX_MAX_BACKOFF_SECONDS = 3600
+
+# Co-occurrence matrix kept between `build_recommendations --incremental` runs
+RECOMMENDATIONS_MATRIX_PATH = BASE_DIR / 'var' / 'recommendations.npz'
+# Incremental runs never subtract deleted wishlist rows / cancelled orders: rebuild in full this often
+RECOMMENDATIONS_FULL_REBUILD_HOURS = 24
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -188,3 +240,5 @@ CORS_ALLOWED_ORIGINS = [
 ]
 
 CORS_ALLOW_ALL_ORIGINS = DEBUG  # Seulement en développement
+# Retries of order / payment creation carry an Idempotency-Key header
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
@@ -0,0 +1,140 @@
+"""In-memory dirty-field tracking for models.
+
+:class:`DirtyFieldsMixin` remembers the values an instance was loaded with
+(``from_db``) or last saved with, so ``save()`` can tell what changed without
+re-reading the row. During and after each save (post_save receivers
+included), ``saved_changes`` holds ``{attname: (old, new)}`` for the fields
+actually written; :data:`fields_changed` is then sent with the same mapping.
+
+Side effects derived from ``saved_changes`` (history rows, statistics) must
+not trust a stale snapshot: models with ``guarded_fields`` call
+:meth:`DirtyFieldsMixin.compare_and_set` in the transaction of their save.
+It updates the row only while it still holds their loaded values; when that
+matches nothing, the row is re-read under ``SELECT ... FOR UPDATE`` and its
+values become the loaded ones, so ``saved_changes`` is computed against what
+was really there. Models refuse a change in
+:meth:`DirtyFieldsMixin.check_changes`, run before anything is written.
+"""
+from django.db.models.signals import ModelSignal
+
+# sender=model class, instance, changes={attname: (old, new)}
+fields_changed = ModelSignal(use_caching=True)
+
+_UNKNOWN = object()
+
+
+class DirtyFieldsMixin:
+    # attnames to track; None tracks every concrete field
+    tracked_fields = None
+    # attnames whose old values drive side effects (see compare_and_set)
+    guarded_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {
+            name: value for name, value in zip(field_names, values) if instance._is_tracked(name)
+        }
+        return instance
+
+    def _is_tracked(self, attname):
+        return self.tracked_fields is None or attname in self.tracked_fields
+
+    def _tracked_attnames(self, fields=None):
+        names = [f.attname for f in self._meta.concrete_fields if self._is_tracked(f.attname)]
+        if fields is not None:
+            wanted = set()
+            for name in fields:
+                field = self._meta.get_field(name)
+                wanted.add(field.attname)
+            names = [name for name in names if name in wanted]
+        return names
+
+    def _loaded(self, names):
+        """Loaded values of ``names``; fields that were deferred are fetched once."""
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            loaded = self._loaded_values = {}
+        missing = [name for name in names if name not in loaded]
+        if missing and self.pk is not None and not self._state.adding:
+            row = type(self)._base_manager.filter(pk=self.pk).values(*missing).first()
+            loaded.update(row or {})
+        return {name: loaded.get(name, _UNKNOWN) for name in names}
+
+    def get_dirty_fields(self, fields=None):
+        """``{attname: loaded value}`` of tracked fields changed since load / last save."""
+        if self._state.adding:
+            return {}
+        deferred = self.get_deferred_fields()
+        names = [name for name in self._tracked_attnames(fields) if name not in deferred]
+        return {
+            name: old for name, old in self._loaded(names).items()
+            if old is not _UNKNOWN and old != getattr(self, name)
+        }
+
+    def is_dirty(self, *fields):
+        return bool(self.get_dirty_fields(fields or None))
+
+    def pending_changes(self, fields=None):
+        """``{attname: (loaded value, current value)}`` a save of ``fields`` would write."""
+        return {name: (old, getattr(self, name)) for name, old in self.get_dirty_fields(fields).items()}
+
+    def _snapshot(self, fields=None):
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            loaded = self._loaded_values = {}
+        deferred = self.get_deferred_fields()
+        for name in self._tracked_attnames(fields):
+            if name not in deferred:
+                loaded[name] = getattr(self, name)
+
+    def check_changes(self, changes):
+        """Hook: raise to refuse writing ``changes`` (``{attname: (old, new)}``); nothing is written then."""
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        # Set before writing so post_save receivers can read it too
+        self.saved_changes = self.pending_changes(update_fields)
+        try:
+            self.check_changes(self.saved_changes)
+            super().save(*args, **kwargs)
+        except Exception:
+            self.saved_changes = {}
+            raise
+        self._snapshot(update_fields)
+        if self.saved_changes:
+            fields_changed.send(sender=type(self), instance=self, changes=self.saved_changes)
+
+    def compare_and_set(self, update_fields=None):
+        """Take the row for a save of ``update_fields`` if it still holds the loaded ``guarded_fields``.
+
+        Otherwise lock it (call inside a transaction) and load what it really
+        holds. Returns False when the row is gone.
+        """
+        if self._state.adding or self.pk is None:
+            return True
+        if update_fields is None:
+            written = {f.attname for f in self._meta.concrete_fields}
+        else:
+            written = {self._meta.get_field(name).attname for name in update_fields}
+        guarded = [name for name in self.guarded_fields if name in written]
+        if not guarded:
+            return True
+        loaded = getattr(self, '_loaded_values', None) or {}
+        expected = {name: loaded[name] for name in self.guarded_fields if name in loaded}
+        manager = type(self)._base_manager
+        if manager.filter(pk=self.pk, **expected).update(**{name: getattr(self, name) for name in guarded}):
+            return True
+        current = manager.select_for_update().filter(pk=self.pk).values(*self.guarded_fields).first()
+        if current is None:
+            return False
+        for name, value in current.items():
+            self._loaded_values[name] = value
+            if name not in written:
+                setattr(self, name, value)
+        return True
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        fields = kwargs.get('fields') or (args[1] if len(args) > 1 else None)
+        self._snapshot(fields)
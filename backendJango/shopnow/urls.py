@@ -21,7 +21,7 @@ from shops.views import ShopViewSet
 from rest_framework_simplejwt.views import TokenRefreshView
 from accounts.jwt_views import CustomTokenObtainPairView
 
-from .admin_stats import AdminStatsView
+from .admin_stats import AdminStatsView, ResponseCacheStatsView
 
 router = DefaultRouter()
 router.register(r'shops', ShopViewSet, basename='shop')
@@ -37,6 +37,7 @@ urlpatterns = [
     path('api/payments/', include('payments.urls')),
     path('api/', include(router.urls)),
     path('api/admin/stats/', AdminStatsView.as_view(), name='admin-stats'),
+    path('api/admin/cache-stats/', ResponseCacheStatsView.as_view(), name='admin-cache-stats'),
     path('api/token/', CustomTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
 ]
@@ -5,6 +5,8 @@ from .models import Shop
 from .serializers import ShopSerializer
 from products.models import Product
 from categories.models import Category
+from shopnow.conditional import ConditionalGetMixin, aggregate_version
+from shopnow.response_cache import ResponseCacheMixin
 
 class IsOwnerOrAdmin(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
@@ -19,9 +21,10 @@ class IsOwnerOrAdmin(permissions.BasePermission):
             return user.is_authenticated and (user.is_staff or getattr(user, 'is_shop_owner', False))
         return True
 
-class ShopViewSet(viewsets.ModelViewSet):
+class ShopViewSet(ResponseCacheMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Shop.objects.all()
     serializer_class = ShopSerializer
+    cache_namespace = 'shops'
 
     def get_permissions(self):
         if self.action in ['update', 'partial_update', 'destroy']:
@@ -60,6 +63,9 @@ class ShopViewSet(viewsets.ModelViewSet):
             )
         except Exception:
             pass
+        return self.filter_shops(qs)
+
+    def filter_shops(self, qs):
         # Allow filtering by city or owner
         owner_id = self.request.query_params.get('owner')
         if owner_id:
@@ -69,6 +75,32 @@ class ShopViewSet(viewsets.ModelViewSet):
             qs = qs.filter(city__iexact=city)
         return qs
 
+    def get_resource_version(self):
+        shops = self.filter_shops(Shop.objects.all())
+        if self.action == 'retrieve':
+            try:
+                shops = shops.filter(pk=int(self.kwargs['pk']))
+            except (KeyError, ValueError):
+                return None
+        token, last_modified = aggregate_version(shops)
+        # Product counts are part of the payload
+        products_token, products_modified = aggregate_version(Product.objects.filter(shop__in=shops.values('pk')))
+        return f'{token}#{products_token}', max(filter(None, [last_modified, products_modified]), default=None)
+
+    def get_initial_cache_tags(self):
+        if self.action == 'retrieve':
+            pk = self.kwargs.get('pk')
+            return [f'shop:{pk}', f'shop-products:{pk}']
+        return ['shops']
+
+    def get_cache_tags(self, data):
+        items = data.get('results', []) if 'id' not in data else [data]
+        tags = []
+        for item in items:
+            # Product counts are embedded in the payload
+            tags += [f"shop:{item['id']}", f"shop-products:{item['id']}"]
+        return tags
+
     @action(detail=True, methods=['get'])
     def stats(self, request, pk=None):
         shop = self.get_object()
@@ -96,6 +128,6 @@ class ShopViewSet(viewsets.ModelViewSet):
         """Admin toggle active status of a shop."""
         shop = self.get_object()
         shop.is_active = not shop.is_active
-        shop.save(update_fields=['is_active'])
+        shop.save(update_fields=['is_active', 'updated_at'])
         serializer = self.get_serializer(shop)
         return Response({'status': 'ok', 'is_active': shop.is_active, 'shop': serializer.data})
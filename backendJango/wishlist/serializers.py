@@ -1,9 +1,9 @@
 from rest_framework import serializers
 from .models import Wishlist
-from products.serializers import ProductSerializer
+from products.serializers import ProductListSerializer
 
 class WishlistSerializer(serializers.ModelSerializer):
-    product = ProductSerializer(read_only=True)
+    product = ProductListSerializer(read_only=True)
     product_id = serializers.IntegerField(write_only=True)
 
     class Meta:
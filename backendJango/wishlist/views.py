@@ -11,7 +11,7 @@ class WishlistViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return Wishlist.objects.filter(user=self.request.user).select_related('product')
+        return Wishlist.objects.filter(user=self.request.user).select_related('product__shop', 'product__category')
 
     def perform_create(self, serializer):
         product_id = serializer.validated_data.get('product_id')